@@ -1,5 +1,26 @@
-import requests
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urljoin
+
+import numpy as np
 import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from schema import conform
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+OUTPUT_FILE = "depuratori_normalizzati.csv"
+
+
+class HarvestError(RuntimeError):
+    """Download di una fonte interrotto o incompleto: i dati parziali non vanno salvati"""
+
 
 # Elenco delle API regionali
 API_REGIONALI = [
@@ -11,79 +32,175 @@ API_REGIONALI = [
     # Aggiungi altre API regionali qui
 ]
 
-# Funzione per raccogliere i dati da un'API regionale
-def fetch_data(api_info, limit=1000):
-    try:
-        params = {
-            "resource_id": api_info["resource_id"],
-            "limit": limit
-        }
-        response = requests.get(api_info["url"], params=params)
-        if response.status_code == 200:
-            data = response.json().get("result", {}).get("records", [])
-            return pd.DataFrame(data)
+# Crea una sessione HTTP con pool di connessioni e retry automatici
+def create_session(pool_size=10, retries=3, backoff=0.5):
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Generatore delle pagine di record di una risorsa CKAN (datastore_search).
+# Solleva HarvestError se la paginazione si interrompe prima del 'total' dichiarato.
+def iter_pages(session, api_info, page_size=1000, timeout=30):
+    url = api_info["url"]
+    params = {"resource_id": api_info["resource_id"], "limit": page_size, "offset": 0}
+    fetched = 0
+    total = None
+    while url:
+        try:
+            response = session.get(url, params=params, timeout=timeout)
+            response.raise_for_status()
+            result = response.json().get("result", {})
+        except (requests.RequestException, ValueError) as e:
+            raise HarvestError(f"{api_info['nome']}: pagina non scaricata dopo {fetched} record ({e})") from e
+        records = result.get("records", [])
+        total = result.get("total", total)
+        if not records:
+            break
+        fetched += len(records)
+        yield records
+
+        if total is not None and fetched >= total:
+            break
+        # CKAN indica la pagina successiva in _links.next (percorso relativo al sito)
+        next_link = result.get("_links", {}).get("next")
+        if next_link:
+            url, params = urljoin(api_info["url"], next_link), None
         else:
-            print(f"Errore API {api_info['nome']}: {response.status_code}")
-            return pd.DataFrame()
+            params = dict(params, offset=fetched)
+
+    if total is not None and fetched < total:
+        raise HarvestError(f"{api_info['nome']}: ricevuti {fetched} record su {total}")
+
+# Funzione per raccogliere tutti i dati da un'API regionale
+def fetch_data(api_info, limit=1000, session=None):
+    try:
+        pages = iter_pages(session or create_session(), api_info, page_size=limit)
+        return pd.DataFrame([record for page in pages for record in page])
     except Exception as e:
         print(f"Errore durante il fetch da {api_info['nome']}: {e}")
         return pd.DataFrame()
 
-# Funzione per normalizzare i dati def normalizza_dati(df):
-    # Rinominare colonne
-    rename_map = {
-        "Denominazione": "nome",
-        "Comune": "comune",
-        "Latitudine": "lat",
-        "Longitudine": "lon",
-        "Potenzialita_Progettuale": "capacita_progettuale",
-        "Volume_Trattato": "volume_trattato",
-        "Fanghi_Prodotti": "fanghi_prodotti",
-        "Stato": "stato_attivo"
-    }
-    df = df.rename(columns=rename_map)
+# Funzione per normalizzare i dati
+def normalizza_dati(df):
+    # Rinominare colonne e convertire i tipi secondo lo schema canonico
+    df = conform(df, "ckan")
 
     # Rimuovere duplicati
     df = df.drop_duplicates()
 
     # Gestire valori mancanti (esempio: sostituire con 0 o valori medi)
     df = df.fillna({
-        "capacita_progettuale": 0,
-        "volume_trattato": 0,
-        "fanghi_prodotti": 0
+        "Capacita_Progettuale": 0,
+        "Volume_Trattato": 0,
+        "Fanghi_Prodotti": 0
     })
 
-    # Convalidare tipi di dato
-    df["lat"] = pd.to_numeric(df["lat"], errors="coerce")
-    df["lon"] = pd.to_numeric(df["lon"], errors="coerce")
-    df["capacita_progettuale"] = pd.to_numeric(df["capacita_progettuale"], errors="coerce")
-
     # Rimuovere record con coordinate non valide
-    df = df[(df["lat"].between(-90, 90)) & (df["lon"].between(-180, 180))]
+    if "LAT" in df.columns and "LON" in df.columns:
+        df = df[(df["LAT"].between(-90, 90)) & (df["LON"].between(-180, 180))]
 
     return df
 
-# Raccolta dati da tutte le API
-all_data = []
-for api in API_REGIONALI:
-    df = fetch_data(api)
-    if not df.empty:
-        df["Fonte"] = api["nome"]  # Aggiungi la fonte dei dati
-        all_data.append(df)
-
-# Combina tutti i dati
-if all_data:
-    combined_df = pd.concat(all_data, ignore_index=True)
-
-    # Normalizzare i dati
-    normalized_df = normalizza_dati(combined_df)
-
-    # Salva in un file CSV per un'analisi successiva
-    normalized_df.to_csv("depuratori_normalizzati.csv", index=False)
-    print("Dati normalizzati salvati in 'depuratori_normalizzati.csv'")
-else:
-    print("Nessun dato disponibile dalle API")
-
-# Prossimi passi:
-# 1. Creare un backend con FastAPI per servire questi dati.
-# 2. Implementare endpoint per query specifiche.
+# Scarica una fonte pagina per pagina, normalizzando e scrivendo ogni pagina su un file parziale.
+# In caso di errore il file parziale viene eliminato e l'errore propagato come HarvestError.
+def harvest_source(session, api_info, part_file, page_size=1000):
+    start = time.perf_counter()
+    seen = set()
+    rows = 0
+    header = True
+    try:
+        for page in iter_pages(session, api_info, page_size=page_size):
+            df = normalizza_dati(pd.DataFrame(page))
+            df["Fonte"] = api_info["nome"]  # Aggiungi la fonte dei dati
+            # Deduplica tra pagine diverse tramite hash di riga
+            hashes = pd.util.hash_pandas_object(df.drop(columns="_id", errors="ignore"), index=False)
+            is_new = np.fromiter((h not in seen for h in hashes), dtype=bool, count=len(hashes))
+            df = df[is_new & ~hashes.duplicated().to_numpy()]
+            seen.update(hashes)
+            df.to_csv(part_file, mode="w" if header else "a", header=header, index=False)
+            header = False
+            rows += len(df)
+    except Exception as e:
+        logger.error(f"Errore durante il fetch da {api_info['nome']}: {e}")
+        if os.path.exists(part_file):
+            os.remove(part_file)
+        if isinstance(e, HarvestError):
+            raise
+        raise HarvestError(f"{api_info['nome']}: {e}") from e
+    logger.info(f"{api_info['nome']}: {rows} record in {time.perf_counter() - start:.1f}s")
+    if not rows and os.path.exists(part_file):
+        os.remove(part_file)
+    return part_file if rows else None
+
+# Raccolta concorrente da tutte le API e unione in un unico CSV.
+# Se una fonte fallisce il file di output esistente resta invariato e si solleva HarvestError.
+def harvest(sources=API_REGIONALI, output_file=OUTPUT_FILE, page_size=1000, max_workers=8, chunksize=50000):
+    session = create_session(pool_size=max(1, len(sources)))
+    parts = [f"{output_file}.{i}.part" for i in range(len(sources))]
+    results, errors = [], []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sources)))) as executor:
+        futures = [executor.submit(harvest_source, session, source, part, page_size=page_size)
+                   for source, part in zip(sources, parts)]
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except HarvestError as e:
+                errors.append(str(e))
+    parts = [part for part in results if part]
+    if errors:
+        for part in parts:
+            os.remove(part)
+        raise HarvestError("Raccolta interrotta, output non aggiornato: " + "; ".join(errors))
+    if not parts:
+        return 0
+    # Ordine delle fonti come in `sources`, indipendente dall'ordine di completamento
+    parts.sort(key=lambda part: int(part.rsplit(".", 2)[-2]))
+
+    # Le fonti possono avere colonne diverse: l'unione delle colonne diventa l'intestazione
+    columns = []
+    for part in parts:
+        columns += [c for c in pd.read_csv(part, nrows=0).columns if c not in columns]
+
+    # Si scrive su un file temporaneo sostituito solo a unione completata
+    tmp_file = f"{output_file}.tmp"
+    rows = 0
+    header = True
+    for part in parts:
+        for chunk in pd.read_csv(part, chunksize=chunksize, dtype=str):
+            chunk.reindex(columns=columns).to_csv(tmp_file, mode="w" if header else "a", header=header, index=False)
+            header = False
+            rows += len(chunk)
+        os.remove(part)
+    os.replace(tmp_file, output_file)
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Raccolta dei dati dei depuratori dalle API regionali")
+    parser.add_argument("--full", action="store_true", help="Riscarica tutte le fonti invece della sincronizzazione incrementale")
+    args = parser.parse_args()
+
+    if args.full or not os.path.exists(OUTPUT_FILE):
+        try:
+            total = harvest()
+        except HarvestError as e:
+            raise SystemExit(f"Errore: {e}")
+        if total:
+            print(f"Dati normalizzati salvati in '{OUTPUT_FILE}' ({total} record)")
+        else:
+            print("Nessun dato disponibile dalle API")
+    else:
+        from ckan_sync import sync
+        print(f"Sincronizzazione incrementale di '{OUTPUT_FILE}': {sync()}")
+
+# I dati normalizzati sono serviti in sola lettura da query_service.py (FastAPI):
+#     uvicorn query_service:app --port 8000
@@ -3,15 +3,27 @@ import pandas as pd
 import numpy as np
 import folium
 from folium import plugins
-from streamlit_folium import folium_static
+from streamlit_folium import st_folium
 import plotly.express as px
 import plotly.graph_objects as go
 from geopy.geocoders import Nominatim
 from geopy.exc import GeocoderTimedOut
 from datetime import datetime
+from comuni_centroids import get_centroid_index
+from dataset_cache import load_dataset
+from efficiency import compute_efficiency
+from filter_index import FilterIndex
+from geocoding_cache import get_geocoding_cache
+from map_rendering import add_cell_markers, add_fast_markers, use_fast_rendering
+from map_tiles import TileEngine, bounds_from_leaflet
+from olap_cube import Cube
+from schema import SchemaError, compact_dtypes, conform
 import warnings
 warnings.filterwarnings('ignore')
 
+# Versione della pipeline di preprocessing: incrementarla invalida l'archivio dei dataset
+PIPELINE_VERSION = 4
+
 # Page configuration
 st.set_page_config(
     page_title="Dashboard Depuratori ML",
@@ -89,48 +101,64 @@ class DataProcessor:
         }
         return mapping.get(code, f"Tipo {code}")
 
+    @staticmethod
+    def _geocode_remote(location):
+        """Interroga Nominatim per una località"""
+        location_data = DataProcessor.geolocator.geocode(location, timeout=10)
+        if location_data:
+            return location_data.latitude, location_data.longitude
+        return None, None
+
     @staticmethod
     def geocode_location(location):
-        """Effettua la geocodifica per una località"""
+        """Effettua la geocodifica per una località, passando dalla cache su disco"""
         try:
-            location_data = DataProcessor.geolocator.geocode(location, timeout=10)
-            if location_data:
-                return location_data.latitude, location_data.longitude
-            else:
-                return None, None
+            return get_geocoding_cache().lookup(location, DataProcessor._geocode_remote)
         except GeocoderTimedOut:
             return None, None
 
     @staticmethod
-    @st.cache_data(ttl=3600)
     def load_and_process_data(uploaded_file):
-        
-        try:
-            # Leggi il CSV
-            df = pd.read_csv(uploaded_file)
+        """
+        Dataset preprocessato condiviso tra le sessioni (cache in memoria, poi archivio,
+        poi pipeline). Il DataFrame restituito è in sola lettura.
+        """
+        return load_dataset(uploaded_file, "nazionale", PIPELINE_VERSION, DataProcessor._build)
 
-            # Verifica le colonne necessarie
-            required_columns = ['id', 'area_riferimento', 'tipo_trattamento', 'anno', 'valore_osservato']
-            if not all(col in df.columns for col in required_columns):
-                st.error("Il file non contiene tutte le colonne necessarie")
+    @staticmethod
+    def _build(uploaded_file):
+        """Pipeline completa seguita dalla riduzione dei tipi, prima di salvare nell'archivio"""
+        df = DataProcessor._process_data(uploaded_file)
+        return compact_dtypes(df) if df is not None else None
+
+    @staticmethod
+    def _process_data(uploaded_file):
+        try:
+            # Leggi il CSV, verifica le colonne necessarie e converti i tipi secondo lo schema
+            try:
+                df = conform(pd.read_csv(uploaded_file), "nazionale")
+            except SchemaError as e:
+                st.error(f"Il file non contiene tutte le colonne necessarie: {e}")
                 return None
 
             # Mappa i codici dei tipi di trattamento alle descrizioni
             df['tipo_trattamento_desc'] = df['tipo_trattamento'].map(DataProcessor._map_tipo_trattamento)
 
-            # Geocodifica dinamica
-            coordinates = []
-            for area in df['area_riferimento'].unique():
-                lat, lon = DataProcessor.geocode_location(area)
-                coordinates.append({"area_riferimento": area, "LAT": lat, "LON": lon})
+            # Coordinate dai centroidi comunali offline
+            areas = pd.Series(df['area_riferimento'].unique(), name='area_riferimento')
+            coords_df = pd.concat([areas, get_centroid_index().lookup(areas)], axis=1)
+            # L'indice dei centroidi è in float32: coordinate in doppia precisione come nello schema
+            coords_df = coords_df.astype({'LAT': 'float64', 'LON': 'float64'})
+
+            # Geocodifica dinamica solo per le aree assenti dall'indice
+            for i in coords_df.index[coords_df['LAT'].isna()]:
+                lat, lon = DataProcessor.geocode_location(coords_df.at[i, 'area_riferimento'])
+                coords_df.loc[i, ['LAT', 'LON']] = lat, lon
 
-            coords_df = pd.DataFrame(coordinates)
             df = pd.merge(df, coords_df, on="area_riferimento", how="left")
 
-            # Calcola l'efficienza
-            df['EFFICIENCY'] = df.groupby(['area_riferimento', 'anno'])['valore_osservato'].transform(
-                lambda x: (x / x.max() * 100)
-            ).round(2)
+            # Calcola le metriche di efficienza (rispetto al massimo, alla capacità, anno su anno)
+            df = compute_efficiency(df)
 
             # Status default
             df['STATUS'] = 'Attivo'
@@ -141,16 +169,42 @@ class DataProcessor:
             st.error(f"Errore nel caricamento dei dati: {str(e)}")
             return None
 
+@st.cache_resource(max_entries=16)
+def get_tile_engine(_df, dataset_key, filter_key):
+    """Griglia della mappa, precalcolata una volta per versione del dataset e combinazione di filtri"""
+    return TileEngine(_df, value_col='valore_osservato')
+
+@st.cache_resource(max_entries=16)
+def get_filter_index(_df, dataset_key):
+    """Indice dei filtri della sidebar, costruito una volta per versione del dataset"""
+    return FilterIndex(_df, ['anno', 'tipo_trattamento_desc', 'area_riferimento'])
+
+@st.cache_resource(max_entries=16)
+def get_cube(_df, dataset_key):
+    """Cubo pre-aggregato per metriche, grafici e statistiche, costruito una volta per versione del dataset"""
+    return Cube(
+        _df,
+        dims=['anno', 'tipo_trattamento_desc', 'area_riferimento', 'STATUS'],
+        measures=['valore_osservato', 'EFFICIENCY'],
+        sketch_measure='valore_osservato'
+    )
+
 class Dashboard:
     """Gestisce l'interfaccia utente della dashboard"""
 
+    def __init__(self):
+        self.filter_key = None
+        self.filters = {}
+
     def show_filters(self, df):
         """Mostra e gestisce i filtri della dashboard"""
+        index = get_filter_index(df, df.attrs.get('dataset_key'))
+
         with st.sidebar:
             st.markdown("### Filtri Analisi")
 
             # Filtro anno
-            anni = sorted(df['anno'].unique())
+            anni = index.options('anno')
             anno_default = anni[-1] if anni else None
             anno = st.selectbox(
                 "Anno",
@@ -161,31 +215,32 @@ class Dashboard:
             # Filtro tipo trattamento usando le descrizioni
             tipi = st.multiselect(
                 "Tipo Trattamento",
-                options=sorted(df['tipo_trattamento_desc'].unique())
+                options=index.options('tipo_trattamento_desc')
             )
 
             # Filtro area
             aree = st.multiselect(
                 "Area",
-                options=sorted(df['area_riferimento'].unique())
+                options=index.options('area_riferimento')
             )
 
-        # Applicazione filtri
-        mask = df['anno'] == anno
-        if tipi:
-            mask &= df['tipo_trattamento_desc'].isin(tipi)
-        if aree:
-            mask &= df['area_riferimento'].isin(aree)
+        self.filter_key = (anno, tuple(tipi), tuple(aree))
+        self.filters = {
+            'anno': [anno],
+            'tipo_trattamento_desc': tipi,
+            'area_riferimento': aree,
+        }
 
-        return df[mask]
+        # Applicazione filtri: intersezione delle posting list precalcolate
+        return index.apply(df, self.filters)
 
-    def show_metrics(self, df):
+    def show_metrics(self, cube):
         """Mostra le metriche principali"""
-        if len(df) > 0:
-            latest_year = df['anno'].max()
-            total_areas = df['area_riferimento'].nunique()
-            total_value = df['valore_osservato'].sum()
-            avg_efficiency = df['EFFICIENCY'].mean()
+        if cube.count_rows(self.filters) > 0:
+            latest_year = max(cube.members('anno', self.filters))
+            total_areas = len(cube.members('area_riferimento', self.filters))
+            total_value = cube.total(self.filters)
+            avg_efficiency = cube.mean(self.filters, measure='EFFICIENCY')
 
             col1, col2, col3, col4 = st.columns(4)
 
@@ -210,35 +265,64 @@ class Dashboard:
             st.warning("Nessuna coordinata valida disponibile per la visualizzazione sulla mappa.")
             return
 
+        engine = get_tile_engine(df_map, df.attrs.get('dataset_key'), self.filter_key)
+
+        # Viewport restituito dalla mappa al rerun precedente
+        view = st.session_state.get('map_view', {})
+        mode, visible = engine.query(bounds_from_leaflet(view.get('bounds')), view.get('zoom') or 6)
+
         # Centro della mappa sull'Italia
         m = folium.Map(location=[41.8719, 12.5674], zoom_start=6)
-        marker_cluster = plugins.MarkerCluster().add_to(m)
-
-        for _, row in df_map.iterrows():
-            coords = (row['LAT'], row['LON'])
-            popup_info = f"""
-            <div>
-                <b>Area:</b> {row['area_riferimento']}<br>
-                <b>Tipo:</b> {row['tipo_trattamento_desc']}<br>
-                <b>Anno:</b> {row['anno']}<br>
-                <b>Valore:</b> {row['valore_osservato']}<br>
-                <b>Efficienza:</b> {row['EFFICIENCY']}%
-            </div>
-            """
-            folium.Marker(coords, popup=popup_info).add_to(marker_cluster)
-
-        folium_static(m, width=1400, height=600)
-
-    def show_charts(self, df):
+        layer = folium.FeatureGroup(name="Depuratori")
+
+        if mode == "clusters":
+            # Zoom basso: conteggi e valori aggregati per cella della griglia
+            add_cell_markers(layer, visible, value_label="Valore")
+        elif use_fast_rendering(visible):
+            # Molti punti: un unico layer con popup generati nel browser
+            add_fast_markers(layer, visible, {
+                "Area": "area_riferimento",
+                "Tipo": "tipo_trattamento_desc",
+                "Anno": "anno",
+                "Valore": "valore_osservato",
+                "Efficienza (%)": "EFFICIENCY",
+            })
+        else:
+            marker_cluster = plugins.MarkerCluster().add_to(layer)
+
+            for _, row in visible.iterrows():
+                coords = (row['LAT'], row['LON'])
+                popup_info = f"""
+                <div>
+                    <b>Area:</b> {row['area_riferimento']}<br>
+                    <b>Tipo:</b> {row['tipo_trattamento_desc']}<br>
+                    <b>Anno:</b> {row['anno']}<br>
+                    <b>Valore:</b> {row['valore_osservato']}<br>
+                    <b>Efficienza:</b> {row['EFFICIENCY']}%
+                </div>
+                """
+                folium.Marker(coords, popup=popup_info).add_to(marker_cluster)
+
+        # La mappa base resta montata: al cambio di viewport si aggiorna solo il layer
+        state = st_folium(
+            m, key="mappa_nazionale", width=1400, height=600,
+            feature_group_to_add=layer, returned_objects=["bounds", "zoom"]
+        )
+        new_view = {'bounds': (state or {}).get('bounds'), 'zoom': (state or {}).get('zoom')}
+        if new_view['zoom'] is not None and new_view != view:
+            st.session_state['map_view'] = new_view
+            st.rerun()
+
+    def show_charts(self, cube):
         """Mostra i grafici principali"""
-        if len(df) == 0:
+        if cube.count_rows(self.filters) == 0:
             st.warning("Nessun dato disponibile per la visualizzazione dei grafici.")
             return
 
         col1, col2 = st.columns(2)
 
         with col1:
-            df_pie = df.groupby('tipo_trattamento_desc')['valore_osservato'].sum().reset_index()
+            df_pie = cube.aggregate(['tipo_trattamento_desc'], self.filters)['sum'].rename('valore_osservato').reset_index()
             fig_pie = px.pie(
                 df_pie, values='valore_osservato', names='tipo_trattamento_desc',
                 title='Distribuzione per Tipo di Trattamento'
@@ -246,7 +330,7 @@ class Dashboard:
             st.plotly_chart(fig_pie, use_container_width=True)
 
         with col2:
-            df_bar = df.groupby('area_riferimento')['valore_osservato'].sum().reset_index()
+            df_bar = cube.aggregate(['area_riferimento'], self.filters)['sum'].rename('valore_osservato').reset_index()
             fig_bar = px.bar(
                 df_bar, x='area_riferimento', y='valore_osservato',
                 title='Totale Valore per Area'
@@ -269,28 +353,28 @@ def main():
 
             st.title("📊 Dashboard Depuratori")
 
+            cube = get_cube(df, df.attrs.get('dataset_key'))
             filtered_df = dashboard.show_filters(df)
 
-            dashboard.show_metrics(filtered_df)
+            dashboard.show_metrics(cube)
             dashboard.show_map(filtered_df)
-            dashboard.show_charts(filtered_df)
+            dashboard.show_charts(cube)
             
             st.subheader("Dettaglio Dati")
             st.dataframe(
                 filtered_df[[
                     'id', 'area_riferimento', 'tipo_trattamento_desc', 'anno',
-                    'valore_osservato', 'EFFICIENCY'
+                    'valore_osservato', 'EFFICIENCY', 'YOY_CHANGE'
                 ]].sort_values(['anno', 'area_riferimento']),
                 use_container_width=True
             )
 
             st.subheader("Analisi Temporale")
-            trend_df = df.pivot_table(
-                values='valore_osservato',
-                index='anno',
-                columns='tipo_trattamento_desc',
-                aggfunc='sum'
-            ).reset_index()
+            trend_df = (
+                cube.aggregate(['anno', 'tipo_trattamento_desc'])['sum']
+                .unstack('tipo_trattamento_desc')
+                .reset_index()
+            )
 
             fig = px.line(
                 trend_df,
@@ -301,9 +385,10 @@ def main():
             st.plotly_chart(fig, use_container_width=True)
 
             st.subheader("Statistiche Descrittive")
+            # Quartili dallo sketch del cubo (approssimati), le altre statistiche sono esatte
             st.dataframe(
-                df.groupby(['anno', 'tipo_trattamento_desc'])['valore_osservato']
-                .describe()
+                cube.aggregate(['anno', 'tipo_trattamento_desc'], quantiles=(0.25, 0.5, 0.75))
+                [['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']]
                 .round(2),
                 use_container_width=True
             )
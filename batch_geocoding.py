@@ -0,0 +1,267 @@
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import requests
+from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
+from geopy.geocoders import Nominatim
+
+from geocoding_cache import GeocodingCache, normalize_query
+
+logger = logging.getLogger(__name__)
+
+Coordinates = Tuple[Optional[float], Optional[float]]
+
+
+class GeocodingTimeout(Exception):
+    """Errore transitorio del provider (timeout o servizio non disponibile)"""
+
+
+@dataclass
+class GeocodeResult:
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    query: Optional[str] = None  # Indirizzo che ha prodotto il risultato
+    from_cache: bool = False
+
+    @property
+    def found(self) -> bool:
+        return self.lat is not None and self.lon is not None
+
+
+class TokenBucket:
+    """
+    Rate limiter a token bucket. Il tasso si dimezza a ogni timeout
+    (fino a `min_rate`) e torna gradualmente al valore nominale con i successi.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, min_rate: Optional[float] = None):
+        self.nominal_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 8
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self):
+        """Attende finché un token è disponibile"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def penalize(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def reward(self):
+        with self._lock:
+            if self.rate < self.nominal_rate:
+                self._refill()
+                self.rate = min(self.nominal_rate, self.rate * 1.1)
+
+
+class GeocodingProvider(ABC):
+    """Interfaccia dei provider: `geocode` restituisce (lat, lon) o (None, None)"""
+
+    name = "base"
+    rate = 1.0  # Richieste al secondo consentite
+
+    @abstractmethod
+    def geocode(self, query: str) -> Coordinates:
+        """Coordinate della query; GeocodingTimeout per gli errori transitori"""
+
+
+class NominatimProvider(GeocodingProvider):
+    name = "nominatim"
+    rate = 1.0  # Policy di utilizzo di Nominatim: massimo 1 richiesta al secondo
+
+    def __init__(self, user_agent: str = "depuratori_app", timeout: int = 10):
+        self.geolocator = Nominatim(user_agent=user_agent, timeout=timeout)
+
+    def geocode(self, query: str) -> Coordinates:
+        try:
+            location = self.geolocator.geocode(query, exactly_one=True)
+        except (GeocoderTimedOut, GeocoderUnavailable) as e:
+            raise GeocodingTimeout(str(e)) from e
+        if location:
+            return location.latitude, location.longitude
+        return None, None
+
+
+class AzureMapsProvider(GeocodingProvider):
+    name = "azure"
+    url = "https://atlas.microsoft.com/search/address/json"
+
+    def __init__(self, api_key: str, rate: float = 50.0, timeout: int = 10):
+        self.api_key = api_key
+        self.rate = rate
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def geocode(self, query: str) -> Coordinates:
+        params = {
+            "api-version": "1.0",
+            "subscription-key": self.api_key,
+            "query": query + ", Italy",  # Utilizziamo anche "Italy" per migliorare la precisione
+            "countrySet": "IT"
+        }
+        try:
+            response = self.session.get(self.url, params=params, timeout=self.timeout)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            raise GeocodingTimeout(str(e)) from e
+        if response.status_code in (429, 503):
+            raise GeocodingTimeout(f"HTTP {response.status_code}")
+        if response.status_code == 200:
+            results = response.json().get('results', [])
+            if results:
+                position = results[0].get('position', {})
+                return position.get('lat'), position.get('lon')
+        return None, None
+
+
+class OfflineProvider(GeocodingProvider):
+    """Provider locale per test e sviluppo senza rete, con latenza e timeout simulati"""
+
+    name = "offline"
+
+    def __init__(self, coordinates: Dict[str, Coordinates], rate: float = 100.0,
+                 latency: float = 0.0, timeouts: Optional[Dict[str, int]] = None):
+        self.coordinates = {normalize_query(q): c for q, c in coordinates.items()}
+        self.rate = rate
+        self.latency = latency
+        self._timeouts = {normalize_query(q): n for q, n in (timeouts or {}).items()}
+        self._lock = threading.Lock()
+        self.calls: List[str] = []
+
+    def geocode(self, query: str) -> Coordinates:
+        key = normalize_query(query)
+        with self._lock:
+            self.calls.append(query)
+            remaining = self._timeouts.get(key, 0)
+            if remaining:
+                self._timeouts[key] = remaining - 1
+        if self.latency:
+            time.sleep(self.latency)
+        if remaining:
+            raise GeocodingTimeout(f"Timeout simulato per {query}")
+        return self.coordinates.get(key, (None, None))
+
+
+class BatchGeocoder:
+    """
+    Geocodifica un'intera lista di indirizzi con un pool di thread.
+    Ogni elemento è una lista di query in ordine di preferenza (es. indirizzo,
+    poi comune): il fallback avviene nello stesso passaggio, senza un secondo
+    giro sulla lista. Le query identiche vengono risolte una sola volta e i
+    risultati in cache non consumano token né attese.
+    """
+
+    def __init__(self, provider: GeocodingProvider, cache: Optional[GeocodingCache] = None,
+                 max_workers: int = 4, max_retries: int = 3, backoff: float = 1.0):
+        self.provider = provider
+        self.cache = cache
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.limiter = TokenBucket(provider.rate)
+        self.stats = {"cache_hits": 0, "network_calls": 0, "timeouts": 0, "errors": 0}
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _call_provider(self, query: str) -> Optional[Coordinates]:
+        """Chiama il provider con rate limiting e backoff esponenziale sui timeout"""
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            self._count("network_calls")
+            try:
+                result = self.provider.geocode(query)
+                self.limiter.reward()
+                return result
+            except GeocodingTimeout:
+                self._count("timeouts")
+                self.limiter.penalize()
+                if attempt == self.max_retries:
+                    logger.warning(f"Timeout definitivo ({self.provider.name}): {query}")
+                    return None
+                time.sleep(delay)
+                delay *= 2
+            except Exception as e:
+                self._count("errors")
+                logger.error(f"Errore geocoding {query} ({self.provider.name}): {e}")
+                return None
+
+    def _resolve(self, query: str, cached: Dict[str, Coordinates]) -> Tuple[Optional[Coordinates], bool]:
+        """Risolve una query, condividendo le chiamate in corso per la stessa chiave"""
+        key = normalize_query(query)
+        if key in cached:
+            self._count("cache_hits")
+            return cached[key], True
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+
+        if not owner:
+            return future.result(), False
+
+        try:
+            result = self._call_provider(query)
+            # I timeout non vengono memorizzati: la query verrà ritentata al prossimo batch
+            if result is not None and self.cache is not None:
+                self.cache.set(query, *result)
+        except BaseException as e:
+            # Chi attende la stessa query riceve l'errore invece di restare bloccato
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result, False
+
+    def _geocode_candidates(self, candidates: Sequence[str], cached: Dict[str, Coordinates]) -> GeocodeResult:
+        for query in candidates:
+            result, from_cache = self._resolve(query, cached)
+            if result is not None and result[0] is not None:
+                return GeocodeResult(result[0], result[1], query, from_cache)
+        return GeocodeResult()
+
+    def geocode_batch(self, items: Sequence[Sequence[str]]) -> List[GeocodeResult]:
+        """Geocodifica una lista di candidati; i risultati mantengono l'ordine di input"""
+        items = [[q] if isinstance(q, str) else list(q) for q in items]
+        all_queries = [q for candidates in items for q in candidates]
+        cached = self.cache.get_many(all_queries) if self.cache is not None else {}
+        self._inflight = {}
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(lambda c: self._geocode_candidates(c, cached), items))
+
+        found = sum(r.found for r in results)
+        logger.info(
+            f"Geocodifica batch ({self.provider.name}): {found}/{len(items)} trovati in "
+            f"{time.monotonic() - start:.1f}s, {self.stats['network_calls']} chiamate, "
+            f"{self.stats['cache_hits']} dalla cache, {self.stats['timeouts']} timeout"
+        )
+        return results
@@ -0,0 +1,56 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from efficiency import compute_efficiency
+
+
+def make_dataset(n_rows, n_areas=2000, n_years=10, seed=42):
+    """Dataset sintetico con le colonne del CSV nazionale"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'id': np.arange(n_rows),
+        'area_riferimento': pd.Categorical.from_codes(
+            rng.integers(0, n_areas, n_rows), [f"Area {i}" for i in range(n_areas)]
+        ).astype(str),
+        'tipo_trattamento': rng.integers(1, 4, n_rows),
+        'anno': rng.integers(2015, 2015 + n_years, n_rows),
+        'valore_osservato': rng.gamma(2.0, 500.0, n_rows).round(1),
+    })
+
+
+def efficiency_lambda(df):
+    """Implementazione precedente di app.py, usata come riferimento"""
+    return df.groupby(['area_riferimento', 'anno'])['valore_osservato'].transform(
+        lambda x: (x / x.max() * 100)
+    ).round(2)
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark del calcolo EFFICIENCY")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10**5, 10**6, 10**7])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'righe':>10} {'lambda (s)':>12} {'vettoriale (s)':>15} {'+ cap/yoy (s)':>14} {'speed-up':>9}")
+    for n_rows in args.sizes:
+        df = make_dataset(n_rows)
+        expected = efficiency_lambda(df)
+        result = compute_efficiency(df.copy(), series_cols=(), capacity_col=None)['EFFICIENCY']
+        np.testing.assert_allclose(result.to_numpy(), expected.to_numpy())
+
+        t_lambda = best_of(lambda: efficiency_lambda(df), args.repeat)
+        t_vector = best_of(lambda: compute_efficiency(df.copy(), series_cols=(), capacity_col=None), args.repeat)
+        t_full = best_of(lambda: compute_efficiency(df.copy()), args.repeat)
+        print(f"{n_rows:>10,} {t_lambda:>12.3f} {t_vector:>15.3f} {t_full:>14.3f} {t_lambda / t_vector:>8.1f}x")
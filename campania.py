@@ -1,12 +1,21 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import folium
 from folium import plugins
 from streamlit_folium import folium_static
 import logging
-import matplotlib.pyplot as plt
-import seaborn as sns
 from dataclasses import dataclass
+import charts
+from comuni_centroids import get_centroid_index
+from compliance import ComplianceEngine
+from dataset_cache import load_dataset
+from filter_index import FilterIndex
+from inspection_store import KEY_COLUMN, InspectionStore
+from map_rendering import FAST_MAP_THRESHOLD, add_fast_markers, use_fast_rendering
+from reference_data import get_reference
+from schema import compact_dtypes, conform
+from spatial_index import SpatialIndex, with_distance
 
 # Configurazione logging
 logging.basicConfig(level=logging.INFO)
@@ -23,6 +32,8 @@ class AppConfig:
     initial_sidebar_state: str = "expanded"
     map_width: int = 1400
     map_height: int = 600
+    pipeline_version: int = 3
+    fast_map_threshold: int = FAST_MAP_THRESHOLD
 
 class StyleManager:
     @staticmethod
@@ -73,12 +84,55 @@ class StyleManager:
 class DataProcessor:
     @staticmethod
     def load_and_process_data(uploaded_file):
+        """Dataset preprocessato condiviso tra le sessioni; il DataFrame è in sola lettura"""
+        return load_dataset(
+            uploaded_file, "campania", AppConfig.pipeline_version, DataProcessor._build,
+            references=[get_reference("coordinate_campania")],
+        )
+
+    @staticmethod
+    def _build(uploaded_file):
+        """Pipeline completa seguita dalla riduzione dei tipi, prima di salvare nell'archivio"""
+        df = DataProcessor._process_data(uploaded_file)
+        return compact_dtypes(df) if df is not None else None
+
+    @staticmethod
+    @st.cache_resource(max_entries=16)
+    def get_filter_index(_df, dataset_key):
+        """Indice dei filtri della tabella, costruito una volta per versione del dataset"""
+        return FilterIndex(_df, ['Provincia', 'Tipologia_Impianto'])
+
+    @staticmethod
+    @st.cache_resource(max_entries=16)
+    def get_spatial_index(_df, dataset_key):
+        """Indice spaziale delle coordinate, costruito una volta per versione del dataset"""
+        return SpatialIndex(_df)
+
+    @staticmethod
+    @st.cache_resource(max_entries=16)
+    def get_compliance(_df, dataset_key):
+        """Esiti dei prelievi e punteggi di anomalia, calcolati una volta per versione del dataset"""
+        return ComplianceEngine(_df)
+
+    @staticmethod
+    @st.cache_resource(max_entries=16)
+    def get_inspection_store(_df, dataset_key):
+        """Sopralluoghi raggruppati per impianto, costruiti una volta per versione del dataset"""
+        store = InspectionStore(_df)
+        # Vista per impianto: chiave distinta dal dataset dei sopralluoghi per le cache a valle
+        store.latest().attrs['dataset_key'] = f"{dataset_key}-impianti"
+        return store
+
+    @staticmethod
+    def _process_data(uploaded_file):
         try:
-            # Carica il file principale
-            df = pd.read_csv(uploaded_file)
+            # Carica il file principale e lo porta nello schema canonico
+            df = conform(pd.read_csv(uploaded_file), "campania")
             
-            # Carica il file delle coordinate
-            coord_df = pd.read_csv("data/depuratori_campania_con_coordinate.csv")
+            # Coordinate di riferimento, già indicizzate e ricaricate solo se il file cambia
+            coord_index = get_reference("coordinate_campania").get()
+            if coord_index is None:
+                raise FileNotFoundError("data/depuratori_campania_con_coordinate.csv")
             
             # Pulizia dati
             for col in df.columns:
@@ -87,31 +141,24 @@ class DataProcessor:
                     df[col] = df[col].fillna('')
                     
             # Standardizza i nomi dei comuni
-            df['COMUNE'] = df['COMUNE'].str.strip().str.upper()
-            coord_df['COMUNE'] = coord_df['COMUNE'].str.strip().str.upper()
+            df['Comune'] = df['Comune'].str.upper().astype('category')
             
             # Debug: mostra informazioni sui dati
             st.write("Colonne nel file principale:", df.columns.tolist())
             st.write("Numero di righe nel file principale:", len(df))
+            st.write("Validazione schema:", df.attrs['schema_report'])
             
-            # Unisci i dataframe
-            merged_df = pd.merge(
-                df, 
-                coord_df[['COMUNE', 'LAT', 'LON']], 
-                on='COMUNE',
-                how='left'
-            )
+            # Unisci le coordinate per (Comune, Indirizzo), con fallback sul comune
+            merged_df, join_report = coord_index.join(df, comune_col='Comune', indirizzo_col='Indirizzo')
             
             # Debug: mostra informazioni sul merge
             st.write("Numero di righe dopo il merge:", len(merged_df))
-            st.write("Righe con coordinate:", merged_df['LAT'].notna().sum())
+            st.write("Cardinalità del join:", join_report)
+            
+            # Coordinate mancanti dai centroidi comunali offline
+            merged_df, _ = get_centroid_index().fill_missing(merged_df, 'Comune', 'Provincia')
             
-            # Converti campi numerici
-            if 'Potenz. (A.E.)' in merged_df.columns:
-                merged_df['Potenz. (A.E.)'] = pd.to_numeric(
-                    merged_df['Potenz. (A.E.)'].astype(str).str.replace(',', ''), 
-                    errors='coerce'
-                )
+            st.write("Righe con coordinate:", merged_df['LAT'].notna().sum())
             
             return merged_df
             
@@ -149,33 +196,46 @@ class MapVisualizer:
         )
 
         # Aggiungi i marker alla mappa
-        for _, row in df_map.iterrows():
-            popup_content = f"""
-            <div style='min-width: 200px; max-width: 300px;'>
-                <h4 style='margin: 0 0 10px 0;'>{row['COMUNE']}</h4>
-                <table style='width: 100%; border-collapse: collapse;'>
-                    <tr><td><b>Provincia:</b></td><td>{row['PROVINCIA']}</td></tr>
-                    <tr><td><b>Indirizzo:</b></td><td>{row['INDIRIZZO']}</td></tr>
-                    <tr><td><b>Tipologia:</b></td><td>{row['Tipologia Impianto']}</td></tr>
-                    <tr><td><b>Reflui:</b></td><td>{row['Reflui Trattati']}</td></tr>
-                    <tr><td><b>Potenzialità:</b></td><td>{row['Potenz. (A.E.)']}</td></tr>
-                    <tr><td><b>Recettore:</b></td><td>{row['Recettore Finale']}</td></tr>
-                    <tr><td><b>Data Sopralluogo:</b></td><td>{row['Data Sopralluogo']}</td></tr>
-                    <tr><td><b>Esito:</b></td><td>{row['Esito Prelievo']}</td></tr>
-                    <tr><td><b>Note:</b></td><td>{row['NOTE']}</td></tr>
-                </table>
-            </div>
-            """
+        if use_fast_rendering(df_map, AppConfig.fast_map_threshold):
+            add_fast_markers(m, df_map, {
+                "Provincia": "Provincia",
+                "Indirizzo": "Indirizzo",
+                "Tipologia": "Tipologia_Impianto",
+                "Reflui": "Reflui_Trattati",
+                "Potenzialità": "Numero_AE",
+                "Recettore": "Recettore_Finale",
+                "Data Sopralluogo": "Data_Sopralluogo",
+                "Esito": "Esito_Prelievo",
+                "Note": "Note",
+            }, title_col="Comune")
+        else:
+            for _, row in df_map.iterrows():
+                popup_content = f"""
+                <div style='min-width: 200px; max-width: 300px;'>
+                    <h4 style='margin: 0 0 10px 0;'>{row['Comune']}</h4>
+                    <table style='width: 100%; border-collapse: collapse;'>
+                        <tr><td><b>Provincia:</b></td><td>{row['Provincia']}</td></tr>
+                        <tr><td><b>Indirizzo:</b></td><td>{row['Indirizzo']}</td></tr>
+                        <tr><td><b>Tipologia:</b></td><td>{row['Tipologia_Impianto']}</td></tr>
+                        <tr><td><b>Reflui:</b></td><td>{row['Reflui_Trattati']}</td></tr>
+                        <tr><td><b>Potenzialità:</b></td><td>{row['Numero_AE']}</td></tr>
+                        <tr><td><b>Recettore:</b></td><td>{row['Recettore_Finale']}</td></tr>
+                        <tr><td><b>Data Sopralluogo:</b></td><td>{row['Data_Sopralluogo']}</td></tr>
+                        <tr><td><b>Esito:</b></td><td>{row['Esito_Prelievo']}</td></tr>
+                        <tr><td><b>Note:</b></td><td>{row['Note']}</td></tr>
+                    </table>
+                </div>
+                """
 
-            folium.CircleMarker(
-                location=(row['LAT'], row['LON']),
-                radius=8,
-                popup=folium.Popup(popup_content, max_width=300),
-                color='blue',
-                fill=True,
-                fillColor='blue',
-                fillOpacity=0.7
-            ).add_to(m)
+                folium.CircleMarker(
+                    location=(row['LAT'], row['LON']),
+                    radius=8,
+                    popup=folium.Popup(popup_content, max_width=300),
+                    color='blue',
+                    fill=True,
+                    fillColor='blue',
+                    fillOpacity=0.7
+                ).add_to(m)
 
         # Aggiungi controlli alla mappa
         folium.LayerControl().add_to(m)
@@ -190,7 +250,7 @@ class MapVisualizer:
         popup_content = f"""
         <div style='font-family: Arial; padding: 10px; min-width: 300px; max-height: 400px; overflow-y: auto;'>
             <h4 style='margin-bottom: 10px; color: #2C3E50; border-bottom: 2px solid #3498db; padding-bottom: 5px;'>
-                {row['COMUNE']}
+                {row['Comune']}
             </h4>
             <table style='width: 100%; border-collapse: collapse; font-size: 12px;'>
                 <style>
@@ -267,28 +327,41 @@ class Dashboard:
             self._show_welcome_message()
 
     def _show_dashboard_components(self, df: pd.DataFrame):
+        # Ogni riga è un sopralluogo: mappa, statistiche e tabella usano l'ultimo stato di ogni impianto
+        store = DataProcessor.get_inspection_store(df, df.attrs.get('dataset_key'))
+        plants = store.latest()
+
         # Mostra la mappa
-        MapVisualizer.create_map(df)
+        MapVisualizer.create_map(plants)
         
         # Mostra statistiche e grafici
-        self._show_statistics(df)
-        self._show_data_analysis(df)
+        self._show_statistics(plants, store)
+        self._show_data_analysis(plants)
+
+        # Non conformità e anomalie dei prelievi (su tutti i sopralluoghi)
+        self._show_compliance(df)
+
+        # Depuratori nei dintorni dei prelievi non conformi
+        self._show_nearby_failures(plants)
         
         # Mostra tabella dati
-        self._show_data_table(df)
+        self._show_data_table(plants)
+        self._show_inspection_history(store)
 
-    def _show_statistics(self, df: pd.DataFrame):
+    def _show_statistics(self, plants: pd.DataFrame, store: InspectionStore):
         st.subheader("Statistiche Generali")
         
-        col1, col2, col3 = st.columns(3)
+        col1, col2, col3, col4 = st.columns(4)
 
         with col1:
-            st.metric("Totale Depuratori", len(df))
+            st.metric("Totale Depuratori", store.n_plants)
         with col2:
-            st.metric("Comuni Serviti", df['COMUNE'].nunique())
+            st.metric("Sopralluoghi", len(store))
         with col3:
-            if 'Potenz. (A.E.)' in df.columns:
-                total_ae = df['Potenz. (A.E.)'].sum()
+            st.metric("Comuni Serviti", plants['Comune'].nunique())
+        with col4:
+            if 'Numero_AE' in plants.columns:
+                total_ae = plants['Numero_AE'].sum()
                 st.metric("Potenzialità Totale (A.E.)", f"{int(total_ae):,}")
 
     def _show_data_analysis(self, df: pd.DataFrame):
@@ -297,54 +370,119 @@ class Dashboard:
         col1, col2 = st.columns(2)
         
         with col1:
-            if 'PROVINCIA' in df.columns:
-                fig1, ax1 = plt.subplots(figsize=(10, 6))
-                province_counts = df['PROVINCIA'].value_counts()
-                sns.barplot(x=province_counts.values, y=province_counts.index)
-                plt.title("Distribuzione per Provincia")
-                plt.xlabel("Numero di Depuratori")
-                st.pyplot(fig1)
+            if 'Provincia' in df.columns:
+                fig1 = charts.figure("bar_counts", df, 'Provincia', "Distribuzione per Provincia", horizontal=True)
+                st.plotly_chart(fig1, use_container_width=True)
+
+        with col2:
+            if 'Tipologia_Impianto' in df.columns:
+                fig2 = charts.figure("pie_counts", df, 'Tipologia_Impianto', "Distribuzione per Tipologia Impianto")
+                st.plotly_chart(fig2, use_container_width=True)
+
+    def _show_compliance(self, df: pd.DataFrame):
+        engine = DataProcessor.get_compliance(df, df.attrs.get('dataset_key'))
+        if not engine.valutato.any():
+            return
+
+        st.subheader("Non Conformità e Anomalie")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Prelievi Valutati", int(engine.valutato.sum()))
+        with col2:
+            st.metric("Prelievi Non Conformi", int(engine.non_conforme.sum()))
+        with col3:
+            st.metric("Tasso di Non Conformità", f"{engine.rate:.1%}")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            fig = charts.bar(engine.parameter_counts(), "Parametri non conformi", horizontal=True, value_label="Prelievi")
+            st.plotly_chart(fig, use_container_width=True)
+        with col2:
+            gruppo = st.selectbox("Tasso per", ['Comune', 'Recettore_Finale'],
+                                  format_func=lambda c: c.replace('_', ' '))
+            st.caption(f"Ultimi {engine.window_months} mesi; z-score rispetto al tasso regionale")
+            st.dataframe(engine.group_outliers(gruppo), use_container_width=True, hide_index=True)
+
+        st.write("#### Depuratori con criticità (per impianto, per gravità dei parametri non conformi)")
+        st.caption("Prelievi, non conformi e tasso sono calcolati su tutti i sopralluoghi dell'impianto")
+        st.dataframe(engine.problem_plants(), use_container_width=True)
+
+    def _show_nearby_failures(self, df: pd.DataFrame):
+        if 'Esito_Prelievo' not in df.columns:
+            return
+        non_conformi = np.flatnonzero(
+            (df['Esito_Prelievo'].astype(str).str.upper() == 'NON CONFORME').to_numpy() & df['LAT'].notna().to_numpy()
+        )
+        if not len(non_conformi):
+            return
 
+        st.subheader("Depuratori vicini a prelievi non conformi")
+        labels = [f"{df['Comune'].iloc[i]} - {df['Indirizzo'].iloc[i]}" for i in non_conformi]
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            scelta = st.selectbox("Prelievo non conforme", range(len(non_conformi)), format_func=labels.__getitem__)
         with col2:
-            if 'Tipologia Impianto' in df.columns:
-                fig2, ax2 = plt.subplots(figsize=(10, 6))
-                tipo_counts = df['Tipologia Impianto'].value_counts()
-                plt.pie(tipo_counts.values, labels=tipo_counts.index, autopct='%1.1f%%')
-                plt.title("Distribuzione per Tipologia Impianto")
-                st.pyplot(fig2)
+            km = st.slider("Raggio (km)", min_value=1, max_value=50, value=10)
+
+        origine = non_conformi[scelta]
+        index = DataProcessor.get_spatial_index(df, df.attrs.get('dataset_key'))
+        positions, distances = index.within(df['LAT'].iloc[origine], df['LON'].iloc[origine], km)
+        vicini = with_distance(df, positions, distances, exclude=[origine])
+
+        st.write(f"{len(vicini)} depuratori entro {km} km")
+        columns = [c for c in ['Distanza_km', 'Comune', 'Indirizzo', 'Tipologia_Impianto', 'Numero_AE', 'Esito_Prelievo']
+                   if c in vicini.columns]
+        st.dataframe(vicini[columns], use_container_width=True)
 
     def _show_data_table(self, df: pd.DataFrame):
         st.subheader("Tabella Dati")
         
+        index = DataProcessor.get_filter_index(df, df.attrs.get('dataset_key'))
+        
         # Aggiungi filtri
         col1, col2 = st.columns(2)
         
+        provincia_filter = 'Tutte'
+        tipo_filter = 'Tutti'
         with col1:
-            if 'PROVINCIA' in df.columns:
-                # Gestisci valori nulli per provincia
-                provincie = df['PROVINCIA'].dropna().unique()
-                provincie = [p for p in provincie if isinstance(p, str)]
-                province = ['Tutte'] + sorted(provincie)
+            if 'Provincia' in index:
+                province = ['Tutte'] + index.options('Provincia')
                 provincia_filter = st.selectbox('Filtra per Provincia:', province)
 
         with col2:
-            if 'Tipologia Impianto' in df.columns:
-                # Gestisci valori nulli per tipologia
-                tipologie = df['Tipologia Impianto'].dropna().unique()
-                tipologie = [t for t in tipologie if isinstance(t, str)]
-                tipi = ['Tutti'] + sorted(tipologie)
+            if 'Tipologia_Impianto' in index:
+                tipi = ['Tutti'] + index.options('Tipologia_Impianto')
                 tipo_filter = st.selectbox('Filtra per Tipologia:', tipi)
 
-        # Applica i filtri
-        df_filtered = df.copy()
-        if 'PROVINCIA' in df.columns and provincia_filter != 'Tutte':
-            df_filtered = df_filtered[df_filtered['PROVINCIA'] == provincia_filter]
-        if 'Tipologia Impianto' in df.columns and tipo_filter != 'Tutti':
-            df_filtered = df_filtered[df_filtered['Tipologia Impianto'] == tipo_filter]
+        # Applica i filtri con le posting list precalcolate
+        df_filtered = index.apply(df, {
+            'Provincia': [provincia_filter] if provincia_filter != 'Tutte' else None,
+            'Tipologia_Impianto': [tipo_filter] if tipo_filter != 'Tutti' else None,
+        })
 
         # Mostra la tabella filtrata
         st.dataframe(df_filtered, use_container_width=True)
 
+    def _show_inspection_history(self, store: InspectionStore):
+        st.subheader("Storico Sopralluoghi")
+
+        col1, col2 = st.columns(2)
+        with col1:
+            per_mese = store.per_period('M')
+            if not per_mese.empty:
+                fig = charts.bar(per_mese['sopralluoghi'], "Sopralluoghi per mese", value_label="Sopralluoghi")
+                st.plotly_chart(fig, use_container_width=True)
+
+        with col2:
+            plants = store.latest()
+            labels = (plants['Comune'].astype(str) + ' - ' + plants['Indirizzo'].astype(str)).tolist()
+            scelta = st.selectbox("Impianto", range(len(plants)), format_func=labels.__getitem__,
+                                  key='storico_impianto')
+            history = store.history(plants[KEY_COLUMN].iloc[scelta])
+            columns = [c for c in ['Data_Sopralluogo', 'Prelievo', 'Esito_Prelievo', 'Parametri_Non_Conformi', 'Note']
+                       if c in history.columns]
+            st.dataframe(history[columns], use_container_width=True, hide_index=True)
+
     def _show_welcome_message(self):
         st.info(
             """
@@ -0,0 +1,123 @@
+import logging
+from typing import Hashable, Optional
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+
+def counts(df: pd.DataFrame, column: str) -> pd.Series:
+    """Numero di righe per valore, in ordine decrescente (solo valori presenti)"""
+    return df[column].value_counts(sort=True).loc[lambda s: s > 0]
+
+
+def sums(df: pd.DataFrame, by: str, value: str) -> pd.Series:
+    """Somma di `value` per gruppo"""
+    return df.groupby(by, observed=True)[value].sum()
+
+
+def _box_values(df: pd.DataFrame, by: str, value: str) -> pd.DataFrame:
+    # Nuovo DataFrame senza attrs: pandas li confronta nelle copie e un report
+    # salvato negli attrs (es. geocoding_report) farebbe fallire il confronto
+    return pd.DataFrame({by: df[by], value: pd.to_numeric(df[value], errors="coerce").astype("float64")}).dropna()
+
+
+def _box_limits(values: pd.DataFrame, by: str, stats: pd.DataFrame):
+    """Limiti a 1,5 IQR dai quartili, allineati riga per riga ai valori"""
+    iqr = stats["q3"] - stats["q1"]
+    groups = values[by]
+    low = groups.map(stats["q1"] - 1.5 * iqr).astype("float64")
+    high = groups.map(stats["q3"] + 1.5 * iqr).astype("float64")
+    return low, high
+
+
+def box_stats(df: pd.DataFrame, by: str, value: str) -> pd.DataFrame:
+    """
+    Quartili e baffi per gruppo, per un box plot precalcolato. Come in seaborn i baffi
+    arrivano al valore osservato più estremo entro 1,5 IQR dai quartili.
+    """
+    values = _box_values(df, by, value)
+    grouped = values.groupby(by, observed=True)[value]
+    stats = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+    stats.columns = ["q1", "median", "q3"]
+    low, high = _box_limits(values, by, stats)
+    column = values[value]
+    stats["lowerfence"] = column.where(column >= low).groupby(values[by], observed=True).min()
+    stats["upperfence"] = column.where(column <= high).groupby(values[by], observed=True).max()
+    return stats
+
+
+def box_outliers(df: pd.DataFrame, by: str, value: str, stats: pd.DataFrame) -> pd.DataFrame:
+    """Valori oltre 1,5 IQR dai quartili del proprio gruppo, disegnati come punti separati"""
+    values = _box_values(df, by, value)
+    low, high = _box_limits(values, by, stats)
+    return values[(values[value] < low) | (values[value] > high)]
+
+
+def bar(data: pd.Series, title: str, horizontal: bool = False, value_label: str = "Numero") -> go.Figure:
+    """Grafico a barre di una serie già aggregata (indice = etichette)"""
+    labels = data.index.astype(str).tolist()
+    values = data.to_numpy(dtype=float).tolist()
+    if horizontal:
+        bar = go.Bar(x=values, y=labels, orientation="h")
+        axes = dict(xaxis_title=value_label, yaxis=dict(autorange="reversed"))
+    else:
+        bar = go.Bar(x=labels, y=values)
+        axes = dict(yaxis_title=value_label, xaxis_tickangle=-45)
+    return go.Figure(bar, layout=dict(title=title, **axes))
+
+
+def _build(kind: str, df: pd.DataFrame, column: str, title: str,
+           value: Optional[str] = None, horizontal: bool = False) -> go.Figure:
+    if kind == "bar_counts":
+        return bar(counts(df, column), title, horizontal)
+    if kind == "bar_sums":
+        return bar(sums(df, column, value), title, horizontal, value_label=value)
+    if kind == "pie_counts":
+        data = counts(df, column)
+        return go.Figure(
+            go.Pie(labels=data.index.astype(str).tolist(), values=data.tolist(), textinfo="percent"),
+            layout=dict(title=title),
+        )
+    if kind == "box":
+        stats = box_stats(df, column, value)
+        outliers = box_outliers(df, column, value, stats)
+        groups = stats.index.astype(str).tolist()
+        return go.Figure(
+            [
+                go.Box(
+                    x=groups, q1=stats["q1"].tolist(), median=stats["median"].tolist(), q3=stats["q3"].tolist(),
+                    lowerfence=stats["lowerfence"].tolist(), upperfence=stats["upperfence"].tolist(),
+                    name=value, showlegend=False,
+                ),
+                # I valori anomali non passano per go.Box: i quartili sono già precalcolati
+                go.Scatter(
+                    x=outliers[column].astype(str).tolist(), y=outliers[value].tolist(), mode="markers",
+                    marker=dict(size=5, symbol="circle-open"), name="Valori anomali", showlegend=False,
+                ),
+            ],
+            layout=dict(title=title, yaxis_title=value, xaxis_tickangle=-45),
+        )
+    raise ValueError(f"Tipo di grafico non supportato: {kind}")
+
+
+@st.cache_resource(max_entries=128)
+def _cached_figure(_df: pd.DataFrame, dataset_key: str, filter_key: Hashable, kind: str, column: str,
+                   title: str, value: Optional[str], horizontal: bool) -> go.Figure:
+    return _build(kind, _df, column, title, value, horizontal)
+
+
+def figure(kind: str, df: pd.DataFrame, column: str, title: str, value: Optional[str] = None,
+           horizontal: bool = False, filter_key: Hashable = None) -> go.Figure:
+    """
+    Figura Plotly (bar_counts, bar_sums, pie_counts, box) da aggregati calcolati una
+    sola volta per versione del dataset e combinazione di filtri; il rendering è nel browser.
+    """
+    dataset_key = df.attrs.get("dataset_key")
+    if dataset_key is None:
+        # Dataset senza versione: nessuna chiave affidabile per la memoizzazione
+        return _build(kind, df, column, title, value, horizontal)
+    return _cached_figure(df, dataset_key, filter_key, kind, column, title, value, horizontal)
@@ -0,0 +1,253 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from api import API_REGIONALI, OUTPUT_FILE, create_session, iter_pages, normalizza_dati
+
+logger = logging.getLogger(__name__)
+
+# Costanti
+SYNC_STATE_PATH = "data/sync_state.sqlite"
+
+
+@dataclass
+class SourceDelta:
+    nome: str
+    upserts: pd.DataFrame = field(default_factory=pd.DataFrame)
+    deleted_ids: List[int] = field(default_factory=list)
+    hashes: Optional[pd.Series] = None  # Hash per _id dei record visti (solo se cambiati)
+    full_scan: bool = False
+    last_id: Optional[int] = None
+    last_modified: Optional[str] = None
+    skipped: bool = False
+
+
+class SyncState:
+    """Stato della sincronizzazione per fonte: ultimo _id, last_modified, hash dei record e tombstone"""
+
+    def __init__(self, path: str = SYNC_STATE_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sources (
+                nome TEXT PRIMARY KEY,
+                resource_id TEXT,
+                last_modified TEXT,
+                last_id INTEGER,
+                synced_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS records (
+                nome TEXT,
+                id INTEGER,
+                hash INTEGER,
+                PRIMARY KEY (nome, id)
+            );
+            CREATE TABLE IF NOT EXISTS tombstones (
+                nome TEXT,
+                id INTEGER,
+                deleted_at REAL,
+                PRIMARY KEY (nome, id)
+            );
+            """
+        )
+
+    def source(self, nome: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT resource_id, last_modified, last_id FROM sources WHERE nome = ?", (nome,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"resource_id": row[0], "last_modified": row[1], "last_id": row[2]}
+
+    def hashes(self, nome: str) -> pd.Series:
+        with self._lock:
+            rows = self._conn.execute("SELECT id, hash FROM records WHERE nome = ?", (nome,)).fetchall()
+        if not rows:
+            return pd.Series(dtype="int64")
+        ids, hashes = zip(*rows)
+        return pd.Series(hashes, index=pd.Index(ids, name="_id"), dtype="int64")
+
+    def tombstones(self, nome: str) -> pd.DataFrame:
+        with self._lock:
+            return pd.read_sql_query(
+                "SELECT id AS _id, deleted_at FROM tombstones WHERE nome = ?", self._conn, params=(nome,)
+            )
+
+    def commit(self, api_info: dict, delta: SourceDelta):
+        """Registra l'esito di una sincronizzazione andata a buon fine"""
+        nome = api_info["nome"]
+        now = time.time()
+        with self._lock, self._conn:
+            if delta.hashes is not None and len(delta.hashes):
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO records (nome, id, hash) VALUES (?, ?, ?)",
+                    [(nome, int(i), int(h)) for i, h in delta.hashes.items()],
+                )
+                self._conn.executemany(
+                    "DELETE FROM tombstones WHERE nome = ? AND id = ?",
+                    [(nome, int(i)) for i in delta.hashes.index],
+                )
+            if delta.deleted_ids:
+                self._conn.executemany(
+                    "DELETE FROM records WHERE nome = ? AND id = ?", [(nome, int(i)) for i in delta.deleted_ids]
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO tombstones (nome, id, deleted_at) VALUES (?, ?, ?)",
+                    [(nome, int(i), now) for i in delta.deleted_ids],
+                )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sources (nome, resource_id, last_modified, last_id, synced_at) VALUES (?, ?, ?, ?, ?)",
+                (nome, api_info["resource_id"], delta.last_modified, delta.last_id, now),
+            )
+
+
+def resource_last_modified(session, api_info, timeout=30) -> Optional[str]:
+    """Data di ultima modifica della risorsa CKAN (resource_show)"""
+    url = api_info["url"].replace("datastore_search", "resource_show")
+    try:
+        response = session.get(url, params={"id": api_info["resource_id"]}, timeout=timeout)
+        response.raise_for_status()
+        result = response.json().get("result", {})
+        return result.get("last_modified") or result.get("metadata_modified")
+    except Exception as e:
+        logger.warning(f"resource_show non disponibile per {api_info['nome']}: {e}")
+        return None
+
+
+def iter_new_records(session, api_info, last_id: int, page_size=1000, timeout=30) -> Iterator[List[dict]]:
+    """Pagine dei soli record con _id > last_id (datastore_search_sql, paginazione per chiave)"""
+    url = api_info["url"].replace("datastore_search", "datastore_search_sql")
+    while True:
+        sql = (
+            f'SELECT * FROM "{api_info["resource_id"]}" WHERE _id > {int(last_id)} '
+            f'ORDER BY _id LIMIT {int(page_size)}'
+        )
+        response = session.get(url, params={"sql": sql}, timeout=timeout)
+        response.raise_for_status()
+        records = response.json().get("result", {}).get("records", [])
+        if not records:
+            break
+        yield records
+        last_id = max(int(r["_id"]) for r in records)
+        if len(records) < page_size:
+            break
+
+
+def _record_hashes(df: pd.DataFrame) -> pd.Series:
+    """Hash del contenuto di ogni record (escluso _id), indicizzato per _id"""
+    content = df.drop(columns=["_id", "_full_text"], errors="ignore")
+    hashes = pd.util.hash_pandas_object(content.astype(str), index=False).to_numpy().view(np.int64)
+    return pd.Series(hashes, index=pd.Index(df["_id"].astype("int64"), name="_id"))
+
+
+def sync_source(session, api_info, state: SyncState, page_size=1000) -> SourceDelta:
+    """Calcola il delta di una fonte rispetto allo stato salvato"""
+    nome = api_info["nome"]
+    previous = state.source(nome)
+    last_modified = resource_last_modified(session, api_info)
+    if previous and last_modified and previous["last_modified"] == last_modified:
+        logger.info(f"{nome}: risorsa invariata ({last_modified}), nessun download")
+        return SourceDelta(nome, skipped=True, last_id=previous["last_id"], last_modified=last_modified)
+
+    append_only = bool(api_info.get("append_only")) and previous and previous["last_id"] is not None
+    if append_only:
+        pages = iter_new_records(session, api_info, previous["last_id"], page_size=page_size)
+    else:
+        pages = iter_pages(session, api_info, page_size=page_size)
+
+    known = state.hashes(nome)
+    changed, changed_hashes, seen_ids = [], [], []
+    last_id = previous["last_id"] if previous else None
+    for page in pages:
+        df = pd.DataFrame(page)
+        hashes = _record_hashes(df)
+        previous_hashes = known.reindex(hashes.index)
+        is_changed = (previous_hashes.isna() | (previous_hashes != hashes)).to_numpy()
+        changed.append(df[is_changed])
+        changed_hashes.append(hashes[is_changed])
+        seen_ids.append(hashes.index.to_numpy())
+        page_max = int(hashes.index.max())
+        last_id = page_max if last_id is None else max(last_id, page_max)
+
+    delta = SourceDelta(nome, full_scan=not append_only, last_id=last_id, last_modified=last_modified)
+    if changed:
+        delta.upserts = pd.concat(changed, ignore_index=True)
+        delta.hashes = pd.concat(changed_hashes)
+    if delta.full_scan and len(known):
+        # I record non più presenti nella risorsa diventano tombstone
+        seen = np.concatenate(seen_ids) if seen_ids else np.empty(0, dtype=np.int64)
+        delta.deleted_ids = known.index[~known.index.isin(seen)].tolist()
+    logger.info(
+        f"{nome}: {len(delta.upserts)} record nuovi/modificati, {len(delta.deleted_ids)} eliminati"
+        f"{' (solo nuovi _id)' if append_only else ''}"
+    )
+    return delta
+
+
+def apply_deltas(deltas: List[SourceDelta], output_file: str = OUTPUT_FILE) -> pd.DataFrame:
+    """Applica upsert e cancellazioni al dataset salvato, con chiave (Fonte, _id)"""
+    stored = pd.read_csv(output_file, dtype=str) if os.path.exists(output_file) else pd.DataFrame()
+    if not stored.empty and "_id" in stored.columns:
+        stored_keys = pd.MultiIndex.from_arrays([stored["Fonte"], pd.to_numeric(stored["_id"], errors="coerce")])
+    else:
+        stored_keys = pd.MultiIndex.from_arrays([[], []])
+
+    remove, additions = [], []
+    for delta in deltas:
+        upserts = delta.upserts
+        ids = (upserts["_id"].astype("int64").tolist() if "_id" in upserts.columns else []) + list(delta.deleted_ids)
+        remove.extend((delta.nome, i) for i in ids)
+        if not upserts.empty:
+            normalized = normalizza_dati(upserts.drop(columns="_full_text", errors="ignore"))
+            normalized["Fonte"] = delta.nome
+            additions.append(normalized.astype(str).where(normalized.notna()))
+
+    if remove and len(stored_keys):
+        stored = stored[~stored_keys.isin(pd.MultiIndex.from_tuples(remove))]
+    result = pd.concat([stored] + additions, ignore_index=True)
+    tmp_file = f"{output_file}.tmp"
+    result.to_csv(tmp_file, index=False)
+    os.replace(tmp_file, output_file)
+    return result
+
+
+def sync(sources=API_REGIONALI, output_file=OUTPUT_FILE, state_path=SYNC_STATE_PATH,
+         page_size=1000, max_workers=8) -> Dict[str, int]:
+    """Sincronizzazione incrementale di tutte le fonti; restituisce il riepilogo del delta"""
+    state = SyncState(state_path)
+    session = create_session(pool_size=max(1, len(sources)))
+
+    def run(api_info):
+        try:
+            return sync_source(session, api_info, state, page_size=page_size)
+        except Exception as e:
+            logger.error(f"Errore durante la sincronizzazione di {api_info['nome']}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(sources)))) as executor:
+        deltas = list(executor.map(run, sources))
+
+    completed = [(api, d) for api, d in zip(sources, deltas) if d is not None]
+    pending = [d for _, d in completed if not d.skipped and (len(d.upserts) or d.deleted_ids)]
+    if pending or not os.path.exists(output_file):
+        apply_deltas(pending, output_file)
+    # Lo stato si aggiorna solo dopo aver scritto il dataset
+    for api_info, delta in completed:
+        state.commit(api_info, delta)
+
+    return {
+        "fonti_invariate": sum(d.skipped for _, d in completed),
+        "upsert": sum(len(d.upserts) for _, d in completed),
+        "eliminati": sum(len(d.deleted_ids) for _, d in completed),
+        "errori": len(sources) - len(completed),
+    }
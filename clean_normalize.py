@@ -1,59 +1,122 @@
+import argparse
 import csv
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def normalize_dataset(input_file, output_file):
-   """Normalizza un file CSV contenente dati dei depuratori del Veneto"""
-   try:
-       # Lettura del file originale con pandas 
-       df = pd.read_csv(input_file, encoding='utf-8', dtype=str)
+CHUNK_SIZE = 50000
+AE_COLUMN = 'Numero Ab. Equiv. (AE)'
+NUMERIC_COLUMNS = ['SIT_ID', AE_COLUMN]
+CATEGORICAL_COLUMNS = ['TIPO SCARICO', 'TIPO CORPO IDRICO', 'CLASSIFICAZIONE DEPURATORE',
+                       'STATO UNITA\' LOCALE', 'STATO DEPURATORE', 'STATO SCARICO']
 
+def _read_chunks(input_file, chunksize):
+   """Legge il CSV a blocchi di `chunksize` righe, tutte le colonne come testo"""
+   for chunk in pd.read_csv(input_file, encoding='utf-8', dtype=str, chunksize=chunksize):
        # Pulizia colonne
-       df.columns = df.columns.str.strip().str.replace('"', '')
-       
-       # Pulizia valori
-       df = df.apply(lambda x: x.str.strip().str.replace('""', '"') if x.dtype == "object" else x)
-       
-       # Rimozione righe duplicate e vuote
-       df = df.drop_duplicates()
-       df = df.dropna(how='all')
-       
-       # Normalizzazione specifiche colonne
-       if 'Numero Ab. Equiv. (AE)' in df.columns:
-           df['Numero Ab. Equiv. (AE)'] = pd.to_numeric(
-               df['Numero Ab. Equiv. (AE)'].str.replace(',', ''), 
-               errors='coerce'
-           )
-
-       # Fix tipi di dati
-       numeric_columns = ['SIT_ID', 'Numero Ab. Equiv. (AE)']
-       for col in numeric_columns:
-           if col in df.columns:
-               df[col] = pd.to_numeric(df[col], errors='coerce')
-
-       # Standardizzazione valori categorici
-       categorical_columns = ['TIPO SCARICO', 'TIPO CORPO IDRICO', 'CLASSIFICAZIONE DEPURATORE', 
-                            'STATO UNITA\' LOCALE', 'STATO DEPURATORE', 'STATO SCARICO']
-       for col in categorical_columns:
-           if col in df.columns:
-               df[col] = df[col].str.title()
-
-       # Salvataggio file normalizzato
-       df.to_csv(output_file, index=False, encoding='utf-8')
+       chunk.columns = chunk.columns.str.strip().str.replace('"', '')
+       yield chunk
+
+def _strip_values(chunks):
+   """Pulizia valori e rimozione righe vuote, colonna per colonna senza copie dell'intero blocco"""
+   for chunk in chunks:
+       for col in chunk.columns:
+           if chunk[col].dtype == "object":
+               chunk[col] = chunk[col].str.strip().str.replace('""', '"')
+       yield chunk.dropna(how='all')
+
+def _coerce_numeric(chunks):
+   """Fix tipi di dati"""
+   for chunk in chunks:
+       for col in NUMERIC_COLUMNS:
+           if col in chunk.columns:
+               # Separatore delle migliaia rimosso solo dagli abitanti equivalenti, come in origine
+               values = chunk[col].str.replace(',', '') if col == AE_COLUMN else chunk[col]
+               # Sempre float64: il tipo non dipende dalla presenza di mancanti nel singolo blocco
+               chunk[col] = pd.to_numeric(values, errors='coerce').astype('float64')
+       yield chunk
+
+def _title_case(chunks):
+   """Standardizzazione valori categorici"""
+   for chunk in chunks:
+       for col in CATEGORICAL_COLUMNS:
+           if col in chunk.columns:
+               chunk[col] = chunk[col].str.title()
+       yield chunk
+
+def _deduplicate(chunks):
+   """Rimozione righe duplicate anche tra blocchi diversi, tramite hash di riga"""
+   seen = set()
+   for chunk in chunks:
+       hashes = pd.util.hash_pandas_object(chunk, index=False)
+       is_new = ~hashes.duplicated() & ~hashes.isin(seen)
+       seen.update(hashes[is_new].tolist())
+       # Copia esplicita del blocco filtrato: le conversioni successive lo modificano
+       yield chunk[is_new].copy()
+
+def _write_chunks(chunks, output_file, output_format):
+   """Scrive i blocchi in modo incrementale su CSV o Parquet; restituisce righe e colonne scritte"""
+   rows = 0
+   columns = []
+   writer = None
+   try:
+       for chunk in chunks:
+           if output_format == 'parquet':
+               if writer is None:
+                   # Schema esplicito: testo per tutte le colonne tranne quelle numeriche
+                   schema = pa.schema([
+                       (col, pa.float64() if col in NUMERIC_COLUMNS else pa.string()) for col in chunk.columns
+                   ])
+                   writer = pq.ParquetWriter(output_file, schema)
+               writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+           else:
+               chunk.to_csv(output_file, mode='w' if not columns else 'a', header=not columns,
+                            index=False, encoding='utf-8')
+           columns = list(chunk.columns)
+           rows += len(chunk)
+   finally:
+       if writer is not None:
+           writer.close()
+   return rows, columns
+
+def normalize_dataset(input_file, output_file, chunksize=CHUNK_SIZE, output_format='csv'):
+   """
+   Normalizza un file CSV contenente dati dei depuratori.
+   Il file viene elaborato a blocchi con una pipeline di generatori
+   (strip -> deduplica -> conversione numerica -> title-case), quindi la
+   memoria occupata dipende da `chunksize` e non dalla dimensione del file.
+   La deduplica avviene sui valori testuali ripuliti, prima delle conversioni:
+   l'output coincide con quello dell'elaborazione dell'intero file in memoria,
+   con le colonne numeriche sempre in float64.
+   """
+   try:
+       chunks = _read_chunks(input_file, chunksize)
+       chunks = _strip_values(chunks)
+       chunks = _deduplicate(chunks)
+       chunks = _coerce_numeric(chunks)
+       chunks = _title_case(chunks)
+       rows, columns = _write_chunks(chunks, output_file, output_format)
+
        logger.info(f"Dataset normalizzato salvato in: {output_file}")
-       
+
        # Log statistiche
-       logger.info(f"Righe totali: {len(df)}")
-       logger.info(f"Colonne: {', '.join(df.columns)}")
+       logger.info(f"Righe totali: {rows}")
+       logger.info(f"Colonne: {', '.join(columns)}")
+       return rows
 
    except Exception as e:
        logger.error(f"Errore durante la normalizzazione: {e}")
        raise
 
 if __name__ == "__main__":
-   input_file = "data/Elenco_impianti_depurazione_Campania_agg_gen2024.csv"
-   output_file = "data/Elenco_impianti_depurazione_Campania_normalizzato.csv"
-   normalize_dataset(input_file, output_file)
\ No newline at end of file
+   parser = argparse.ArgumentParser(description="Normalizza un file CSV dei depuratori")
+   parser.add_argument("input_file", nargs="?", default="data/Elenco_impianti_depurazione_Campania_agg_gen2024.csv")
+   parser.add_argument("output_file", nargs="?", default="data/Elenco_impianti_depurazione_Campania_normalizzato.csv")
+   parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE, help="Righe per blocco")
+   parser.add_argument("--format", choices=["csv", "parquet"], default="csv", dest="output_format")
+   args = parser.parse_args()
+   normalize_dataset(args.input_file, args.output_file, args.chunksize, args.output_format)
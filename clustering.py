@@ -0,0 +1,145 @@
+import logging
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+
+logger = logging.getLogger(__name__)
+
+# Costanti
+MINIBATCH_THRESHOLD = 20000   # Oltre questo numero di righe si usa MiniBatchKMeans
+SILHOUETTE_SAMPLE = 5000      # Campione per la silhouette (costo quadratico nelle righe)
+K_RANGE = range(2, 9)
+
+
+def _estimator(n_clusters: int, n_rows: int, random_state: int):
+    """KMeans completo per dataset piccoli, MiniBatchKMeans oltre la soglia"""
+    if n_rows > MINIBATCH_THRESHOLD:
+        return MiniBatchKMeans(n_clusters=n_clusters, batch_size=4096, n_init=3, random_state=random_state)
+    return KMeans(n_clusters=n_clusters, n_init="auto", random_state=random_state)
+
+
+class ClusterModel:
+    """
+    Clustering dei depuratori su caratteristiche standardizzate: dimensione
+    (log degli AE, molto asimmetrici), posizione e variabili categoriche in one-hot
+    con peso ridotto. Il modello conserva scala e categorie viste in addestramento,
+    quindi nuove righe si assegnano ai cluster esistenti senza riaddestrare.
+    """
+
+    def __init__(self, n_clusters: int = 3, log_features: Sequence[str] = ("Numero_AE",),
+                 numeric: Sequence[str] = ("LAT", "LON"), categorical: Sequence[str] = (),
+                 categorical_weight: float = 0.5, random_state: int = 42):
+        self.n_clusters = n_clusters
+        self.log_features = list(log_features)
+        self.numeric = list(numeric)
+        self.categorical = list(categorical)
+        self.categorical_weight = categorical_weight
+        self.random_state = random_state
+        self._categories: Dict[str, pd.Index] = {}
+        self._mean: Optional[np.ndarray] = None
+        self._scale: Optional[np.ndarray] = None
+        self.model = None
+        self.labels_: Optional[np.ndarray] = None
+        self.index_: Optional[pd.Index] = None
+
+    @property
+    def feature_names(self) -> List[str]:
+        names = [f"log_{c}" for c in self.log_features] + self.numeric
+        for col in self.categorical:
+            names += [f"{col}={value}" for value in self._categories.get(col, [])]
+        return names
+
+    def usable(self, df: pd.DataFrame) -> pd.Series:
+        """Righe con tutte le caratteristiche numeriche valorizzate"""
+        columns = self.log_features + self.numeric
+        return df[columns].notna().all(axis=1) if columns else pd.Series(True, index=df.index)
+
+    def features(self, df: pd.DataFrame) -> np.ndarray:
+        """Matrice delle caratteristiche scalata con i parametri dell'addestramento"""
+        parts = [np.log1p(df[self.log_features].to_numpy(dtype="float64").clip(min=0))] if self.log_features else []
+        if self.numeric:
+            parts.append(df[self.numeric].to_numpy(dtype="float64"))
+        X = np.hstack(parts) if parts else np.empty((len(df), 0))
+        if self._mean is None:
+            self._mean = X.mean(axis=0)
+            scale = X.std(axis=0)
+            self._scale = np.where(scale > 0, scale, 1.0)
+        X = (X - self._mean) / self._scale
+
+        for col in self.categorical:
+            if col not in self._categories:
+                self._categories[col] = pd.Index(df[col].dropna().astype(str).unique()).sort_values()
+            # Valori mai visti in addestramento: riga di zeri (nessuna categoria)
+            codes = self._categories[col].get_indexer(df[col].astype(str))
+            onehot = np.zeros((len(df), len(self._categories[col])))
+            known = codes >= 0
+            onehot[np.flatnonzero(known), codes[known]] = self.categorical_weight
+            X = np.hstack([X, onehot])
+        return X
+
+    def fit(self, df: pd.DataFrame) -> "ClusterModel":
+        self._mean, self._scale, self._categories = None, None, {}
+        rows = df[self.usable(df)]
+        self.index_ = rows.index
+        if rows.empty:
+            # Nessuna riga con le caratteristiche: modello vuoto, tutte le righe restano senza cluster
+            self.model, self.labels_ = None, np.empty(0, dtype=np.int32)
+            logger.info("Clustering: nessuna riga utilizzabile")
+            return self
+        X = self.features(rows)
+        n_clusters = min(self.n_clusters, len(rows))
+        self.model = _estimator(n_clusters, len(rows), self.random_state)
+        self.labels_ = self.model.fit_predict(X)
+        logger.info(f"Clustering: {type(self.model).__name__} con {n_clusters} cluster su {len(rows)} righe")
+        return self
+
+    def predict(self, df: pd.DataFrame) -> pd.Series:
+        """Cluster delle righe di `df` (anche nuove) senza riaddestrare; -1 se mancano caratteristiche"""
+        labels = pd.Series(-1, index=df.index, dtype="int32")
+        usable = self.usable(df)
+        if self.model is not None and usable.any():
+            labels[usable] = self.model.predict(self.features(df[usable]))
+        return labels
+
+    def update(self, df: pd.DataFrame) -> pd.Series:
+        """Aggiorna i centroidi con nuove righe (solo MiniBatchKMeans) e ne restituisce i cluster"""
+        if isinstance(self.model, MiniBatchKMeans):
+            usable = self.usable(df)
+            if usable.any():
+                self.model.partial_fit(self.features(df[usable]))
+        return self.predict(df)
+
+    def summary(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Numero di depuratori, AE mediani e totali per cluster, ordinati per dimensione"""
+        rows = df.loc[self.index_]
+        grouped = rows.groupby(self.labels_)
+        result = pd.DataFrame({"Depuratori": grouped.size()})
+        for col in self.log_features:
+            result[f"{col} mediano"] = grouped[col].median()
+            result[f"{col} totale"] = grouped[col].sum()
+        for col in self.categorical:
+            result[f"{col} prevalente"] = grouped[col].agg(lambda s: s.mode().iloc[0] if s.notna().any() else None)
+        return result.rename_axis("Cluster").sort_values(f"{self.log_features[0]} mediano" if self.log_features else "Depuratori")
+
+
+def evaluate_k(model: ClusterModel, df: pd.DataFrame, ks: Sequence[int] = K_RANGE,
+               sample: int = SILHOUETTE_SAMPLE) -> pd.DataFrame:
+    """
+    Inerzia (metodo del gomito) e silhouette per ogni numero di cluster in `ks`,
+    sulle stesse caratteristiche scalate del modello. La silhouette è calcolata su
+    un campione per contenere il costo.
+    """
+    X = model.features(df[model.usable(df)])
+    results = []
+    for k in ks:
+        if k >= len(X):
+            break
+        estimator = _estimator(k, len(X), model.random_state)
+        labels = estimator.fit_predict(X)
+        silhouette = silhouette_score(X, labels, sample_size=min(sample, len(X)), random_state=model.random_state) \
+            if len(set(labels)) > 1 else np.nan
+        results.append({"k": k, "inerzia": estimator.inertia_, "silhouette": silhouette})
+    return pd.DataFrame(results, columns=["k", "inerzia", "silhouette"])
@@ -0,0 +1,204 @@
+import logging
+import re
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from inspection_store import KEY_COLUMN, plant_keys
+
+logger = logging.getLogger(__name__)
+
+# Costanti
+ROLLING_MONTHS = 12
+OUTLIER_Z = 3.5          # Soglia dello z-score robusto (mediana/MAD) sulla gravità
+RATE_Z = 2.0             # Soglia dello z-score binomiale sui tassi di gruppo
+MIN_INSPECTIONS = 3      # Gruppi con meno prelievi non vengono segnalati
+
+# Nomi canonici dei parametri: le stesse analisi compaiono scritte in molti modi
+# ("ECOTOX", "Saggio di tossicità acuta con D. Magna", "Escherichiacoli", ...)
+PARAMETER_ALIASES: List[Tuple[str, str]] = [
+    (r"ecotox|tossicit", "Ecotossicità"),
+    (r"escherichia\s*coli", "Escherichia coli"),
+    (r"azoto\s+ammoniacale", "Azoto ammoniacale"),
+    (r"azoto\s+nitroso", "Azoto nitroso"),
+    (r"azoto\s+nitrico", "Azoto nitrico"),
+    (r"solidi\s+sospesi", "Solidi sospesi totali"),
+    (r"^bod", "BOD5"),
+    (r"^cod", "COD"),
+    (r"tensioattivi", "Tensioattivi totali"),
+    (r"cloro\s+attivo", "Cloro attivo"),
+    (r"grassi|olii|oli\b", "Grassi e oli"),
+]
+# Separatori nelle liste di parametri: virgole, " e ", trattini, a capo
+_SEPARATORS = r",|\s+e\s+|\s+-\s+|-(?=[A-Za-z])|\n|;"
+_EMPTY = {"", "/", "-", "nan"}
+
+
+def canonical_parameter(token: str) -> str:
+    """Nome canonico di un parametro; i parametri non riconosciuti restano con la sola iniziale maiuscola"""
+    token = " ".join(token.split()).strip(" .")
+    lower = token.lower()
+    for pattern, name in PARAMETER_ALIASES:
+        if re.search(pattern, lower):
+            return name
+    return lower.capitalize()
+
+
+def parse_parameters(values: pd.Series) -> Tuple[sparse.csr_matrix, List[str]]:
+    """
+    Matrice sparsa riga × parametro (1 = parametro non conforme) dalle liste testuali.
+    La separazione è vettoriale; la normalizzazione dei nomi si applica solo ai token distinti.
+    """
+    tokens = values.astype("string").str.split(_SEPARATORS, regex=True).explode().str.strip()
+    tokens = tokens[tokens.notna() & ~tokens.str.lower().isin(_EMPTY)]
+    unique_tokens = pd.unique(tokens.to_numpy())
+    mapping = pd.Series([canonical_parameter(t) for t in unique_tokens], index=unique_tokens)
+    names = tokens.map(mapping)
+
+    codes, parameters = pd.factorize(names, sort=True)
+    rows = values.index.get_indexer(names.index)
+    matrix = sparse.csr_matrix((np.ones(len(codes), dtype=np.int8), (rows, codes)),
+                               shape=(len(values), len(parameters)))
+    # Lo stesso parametro ripetuto nella stessa riga conta una volta
+    matrix.data[:] = 1
+    return matrix, list(parameters)
+
+
+class ComplianceEngine:
+    """
+    Esiti dei prelievi precalcolati una volta per dataset: matrice sparsa
+    sopralluogo × parametro non conforme, gravità pesata sulla rarità dei parametri,
+    tassi di non conformità per impianto (chiave di inspection_store), comune e
+    recettore su finestre mobili e segnalazione dei valori anomali con z-score vettoriali.
+    """
+
+    def __init__(self, df: pd.DataFrame, esito_col: str = "Esito_Prelievo",
+                 parametri_col: str = "Parametri_Non_Conformi", data_col: str = "Data_Sopralluogo",
+                 window_months: int = ROLLING_MONTHS):
+        self.df = df
+        self.data_col = data_col
+        self.window_months = window_months
+        parametri = df[parametri_col] if parametri_col in df.columns else pd.Series(np.nan, index=df.index)
+        self.matrix, self.parameters = parse_parameters(parametri.reset_index(drop=True))
+
+        esito = df[esito_col].astype("string").str.strip().str.upper() if esito_col in df.columns \
+            else pd.Series(pd.NA, index=df.index, dtype="string")
+        n_parametri = np.asarray(self.matrix.sum(axis=1)).ravel()
+        # Prelievo valutato: esito noto oppure parametri non conformi elencati
+        self.non_conforme = ((esito == "NON CONFORME").fillna(False).to_numpy()) | (n_parametri > 0)
+        self.valutato = (esito.isin(["CONFORME", "NON CONFORME"]).fillna(False).to_numpy()) | (n_parametri > 0)
+
+        # Peso dei parametri: i superamenti rari pesano di più (log della frequenza inversa)
+        frequency = np.asarray(self.matrix.sum(axis=0)).ravel()
+        self.weights = np.log1p(self.valutato.sum() / np.maximum(frequency, 1))
+        self.severity = self.matrix @ self.weights
+        self.n_parametri = n_parametri
+        # Ogni riga è un sopralluogo: gli impianti si riconoscono dalla chiave stabile
+        self.plant_codes, self.plant_ids = pd.factorize(plant_keys(df), sort=True)
+        logger.info(f"Conformità: {int(self.valutato.sum())} prelievi valutati, "
+                    f"{int(self.non_conforme.sum())} non conformi, {len(self.parameters)} parametri")
+
+    @property
+    def rate(self) -> float:
+        """Tasso complessivo di non conformità sui prelievi valutati"""
+        valutati = self.valutato.sum()
+        return float(self.non_conforme[self.valutato].sum() / valutati) if valutati else float("nan")
+
+    def parameter_counts(self) -> pd.Series:
+        """Numero di prelievi non conformi per parametro, in ordine decrescente"""
+        counts = np.asarray(self.matrix.sum(axis=0)).ravel()
+        return pd.Series(counts, index=self.parameters, name="Prelievi").sort_values(ascending=False)
+
+    def plant_rates(self) -> pd.DataFrame:
+        """Prelievi valutati, non conformi, tasso e gravità complessiva per impianto"""
+        n_plants = len(self.plant_ids)
+        codes = self.plant_codes
+        valutati = np.bincount(codes, weights=self.valutato, minlength=n_plants).astype(int)
+        non_conformi = np.bincount(codes, weights=self.non_conforme & self.valutato, minlength=n_plants).astype(int)
+        # Parametri distinti mai superati dall'impianto: matrice impianto × sopralluogo per la matrice dei parametri
+        plant_rows = sparse.csr_matrix((np.ones(len(codes)), (codes, np.arange(len(codes)))),
+                                       shape=(n_plants, len(codes)))
+        parametri = np.asarray(((plant_rows @ self.matrix) > 0).sum(axis=1)).ravel()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            tasso = np.where(valutati > 0, non_conformi / valutati, np.nan)
+        return pd.DataFrame({
+            "Prelievi": valutati,
+            "Non_Conformi": non_conformi,
+            "Tasso": tasso,
+            "Parametri": parametri,
+            "Gravità": np.bincount(codes, weights=self.severity, minlength=n_plants),
+        }, index=pd.Index(self.plant_ids, name=KEY_COLUMN))
+
+    def problem_plants(self, columns: Sequence[str] = ("Comune", "Indirizzo", "Tipologia_Impianto", "Numero_AE"),
+                       top: Optional[int] = None) -> pd.DataFrame:
+        """
+        Impianti con almeno un prelievo non conforme, una riga per impianto, ordinati per
+        gravità complessiva e tasso di non conformità. Lo z-score robusto della gravità
+        (mediana e MAD tra gli impianti non conformi) segnala gli anomali.
+        """
+        rates = self.plant_rates()
+        problems = np.flatnonzero(rates["Non_Conformi"].to_numpy() > 0)
+        severity = rates["Gravità"].to_numpy()[problems]
+        median = np.median(severity) if len(severity) else 0.0
+        mad = np.median(np.abs(severity - median)) if len(severity) else 0.0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = np.where(mad > 0, 0.6745 * (severity - median) / mad, 0.0)
+
+        # Descrizione dell'impianto dalla sua ultima riga nel file
+        last_row = np.full(len(self.plant_ids), -1)
+        np.maximum.at(last_row, self.plant_codes, np.arange(len(self.plant_codes)))
+        result = self.df.iloc[last_row[problems]][[c for c in columns if c in self.df.columns]].copy()
+        result.index = rates.index[problems]
+        result = result.join(rates.iloc[problems])
+        result["Tasso"] = result["Tasso"].round(2)
+        result["Gravità"] = result["Gravità"].round(2)
+        result["Z_robusto"] = np.round(z, 2)
+        result["Anomalo"] = z > OUTLIER_Z
+        result = result.sort_values(["Gravità", "Tasso"], ascending=False, kind="stable")
+        return result.head(top) if top else result
+
+    def rolling_rates(self, by: str) -> pd.DataFrame:
+        """
+        Prelievi valutati, non conformi e tasso per gruppo e mese, sommati sulla finestra
+        mobile degli ultimi `window_months` mesi (solo prelievi con data).
+        """
+        dates = pd.to_datetime(self.df[self.data_col], errors="coerce") if self.data_col in self.df.columns \
+            else pd.Series(pd.NaT, index=self.df.index)
+        frame = pd.DataFrame({
+            by: self.df[by].astype("string").to_numpy(),
+            "mese": dates.dt.to_period("M").to_numpy(),
+            "valutati": self.valutato.astype(int),
+            "non_conformi": (self.non_conforme & self.valutato).astype(int),
+        }).dropna(subset=[by, "mese"])
+        if frame.empty:
+            return pd.DataFrame(columns=[by, "mese", "valutati", "non_conformi", "tasso"])
+
+        monthly = frame.groupby([by, "mese"]).sum()
+        # Griglia completa gruppo × mese: la finestra mobile conta anche i mesi senza prelievi
+        months = pd.period_range(frame["mese"].min(), frame["mese"].max(), freq="M")
+        grid = pd.MultiIndex.from_product([monthly.index.levels[0], months], names=[by, "mese"])
+        monthly = monthly.reindex(grid, fill_value=0)
+        rolling = (monthly.groupby(level=0).rolling(self.window_months, min_periods=1).sum()
+                   .droplevel(0).astype(int))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rolling["tasso"] = rolling["non_conformi"] / rolling["valutati"].where(rolling["valutati"] > 0)
+        return rolling.reset_index()
+
+    def group_outliers(self, by: str, min_inspections: int = MIN_INSPECTIONS) -> pd.DataFrame:
+        """
+        Tasso dell'ultima finestra mobile per gruppo, confrontato con il tasso complessivo
+        tramite z-score binomiale; i gruppi oltre soglia sono segnalati.
+        """
+        rates = self.rolling_rates(by)
+        if rates.empty:
+            return pd.DataFrame(columns=[by, "valutati", "non_conformi", "tasso", "z", "Anomalo"])
+        latest = rates[rates["mese"] == rates["mese"].max()].set_index(by)[["valutati", "non_conformi", "tasso"]]
+        latest = latest[latest["valutati"] > 0]
+        p0 = self.rate
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = (latest["tasso"] - p0) / np.sqrt(p0 * (1 - p0) / latest["valutati"])
+        latest["z"] = z.round(2)
+        latest["Anomalo"] = (latest["z"] > RATE_Z) & (latest["valutati"] >= min_inspections)
+        return latest.sort_values(["Anomalo", "z"], ascending=False).reset_index()
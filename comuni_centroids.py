@@ -0,0 +1,133 @@
+import argparse
+import logging
+import os
+import threading
+from typing import List, Optional, Tuple
+
+import pandas as pd
+
+from geocoding_cache import normalize_keys
+
+logger = logging.getLogger(__name__)
+
+# Costanti
+CENTROID_INDEX_PATH = "data/comuni_centroidi.parquet"
+DEFAULT_SOURCES = [
+    # Coordinate degli impianti: il centroide del comune è la media delle posizioni note
+    ("data/depuratori_campania_con_coordinate.csv",
+     "data/Elenco_impianti_depurazione_Campania_normalizzato.csv"),
+]
+
+
+class ComuneCentroidIndex:
+    """Indice offline dei centroidi comunali, chiave (comune, provincia) normalizzata"""
+
+    def __init__(self, path: str = CENTROID_INDEX_PATH):
+        self.path = path
+        if os.path.exists(path):
+            self._data = pd.read_parquet(path)
+        else:
+            logger.warning(f"Indice dei centroidi comunali non trovato: {path}")
+            self._data = pd.DataFrame(columns=["comune_key", "provincia_key", "LAT", "LON"])
+        # I nomi ripetuti in più province sono ambigui senza la provincia
+        by_comune = self._data.drop_duplicates("comune_key", keep=False)
+        self._by_comune = by_comune[["comune_key", "LAT", "LON"]]
+        self._by_comune_provincia = self._data[["comune_key", "provincia_key", "LAT", "LON"]]
+
+    def __len__(self):
+        return len(self._data)
+
+    def lookup(self, comuni: pd.Series, province: Optional[pd.Series] = None) -> pd.DataFrame:
+        """Restituisce LAT/LON allineati all'indice di `comuni` (NaN se non trovati)"""
+        keys = pd.DataFrame({"comune_key": normalize_keys(comuni)}, index=comuni.index)
+        result = keys.merge(self._by_comune, on="comune_key", how="left")
+        if province is not None:
+            keys["provincia_key"] = normalize_keys(province).values
+            exact = keys.merge(self._by_comune_provincia, on=["comune_key", "provincia_key"], how="left")
+            result["LAT"] = exact["LAT"].fillna(result["LAT"])
+            result["LON"] = exact["LON"].fillna(result["LON"])
+        result.index = comuni.index
+        return result[["LAT", "LON"]]
+
+    def fill_missing(self, df: pd.DataFrame, comune_col: str, provincia_col: Optional[str] = None,
+                     lat_col: str = "LAT", lon_col: str = "LON") -> Tuple[pd.DataFrame, int]:
+        """Riempie le coordinate mancanti con i centroidi; restituisce il numero di righe riempite"""
+        if lat_col not in df.columns:
+            df[lat_col] = float("nan")
+        if lon_col not in df.columns:
+            df[lon_col] = float("nan")
+        missing = df[lat_col].isna() | df[lon_col].isna()
+        if not missing.any() or comune_col not in df.columns:
+            return df, 0
+        province = df.loc[missing, provincia_col] if provincia_col in df.columns else None
+        found = self.lookup(df.loc[missing, comune_col], province).dropna()
+        df.loc[found.index, lat_col] = found["LAT"].astype("float64")
+        df.loc[found.index, lon_col] = found["LON"].astype("float64")
+        logger.info(f"Coordinate da centroidi comunali: {len(found)}/{int(missing.sum())} righe")
+        return df, len(found)
+
+
+_index: Optional[ComuneCentroidIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_centroid_index() -> ComuneCentroidIndex:
+    """Restituisce l'indice dei centroidi, caricato una sola volta per processo"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ComuneCentroidIndex()
+        return _index
+
+
+def build_centroid_index(frames: List[pd.DataFrame], output_file: str = CENTROID_INDEX_PATH) -> pd.DataFrame:
+    """
+    Costruisce l'indice da uno o più DataFrame con colonne COMUNE, PROVINCIA, LAT, LON
+    (es. elenco comuni ISTAT con coordinate, oppure coordinate degli impianti).
+    Le fonti successive non sovrascrivono i comuni già presenti.
+    """
+    # La media è calcolata entro ciascuna fonte; per ogni comune vince la prima fonte che lo contiene
+    index = pd.concat([frame.assign(_fonte=i) for i, frame in enumerate(frames)], ignore_index=True)
+    index = index.dropna(subset=["COMUNE", "LAT", "LON"])
+    index["comune_key"] = normalize_keys(index["COMUNE"])
+    index["provincia_key"] = normalize_keys(index["PROVINCIA"])
+    index = (
+        index.groupby(["comune_key", "provincia_key", "_fonte"], sort=False)
+        .agg(COMUNE=("COMUNE", "first"), PROVINCIA=("PROVINCIA", "first"),
+             LAT=("LAT", "mean"), LON=("LON", "mean"))
+        .reset_index()
+        .sort_values(["comune_key", "_fonte"], kind="stable")
+        .drop_duplicates(["comune_key", "provincia_key"])
+        .drop(columns="_fonte")
+        .astype({"LAT": "float32", "LON": "float32"})
+        .reset_index(drop=True)
+    )
+    index.to_parquet(output_file, index=False, compression="zstd")
+    logger.info(f"Indice centroidi salvato in {output_file}: {len(index)} comuni")
+    return index
+
+
+def _load_plant_coordinates(coord_file: str, plants_file: Optional[str]) -> pd.DataFrame:
+    coords = pd.read_csv(coord_file)
+    if "PROVINCIA" not in coords.columns and plants_file:
+        plants = pd.read_csv(plants_file, usecols=["COMUNE", "PROVINCIA"]).drop_duplicates("COMUNE")
+        coords = coords.merge(plants, on="COMUNE", how="left")
+    return coords[["COMUNE", "PROVINCIA", "LAT", "LON"]]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Costruisce l'indice offline dei centroidi comunali")
+    parser.add_argument(
+        "--istat", help="CSV dei comuni con colonne COMUNE, PROVINCIA, LAT, LON (ha la precedenza)"
+    )
+    parser.add_argument("--output", default=CENTROID_INDEX_PATH)
+    args = parser.parse_args()
+
+    frames = []
+    if args.istat:
+        frames.append(pd.read_csv(args.istat)[["COMUNE", "PROVINCIA", "LAT", "LON"]])
+    for coord_file, plants_file in DEFAULT_SOURCES:
+        if os.path.exists(coord_file):
+            frames.append(_load_plant_coordinates(coord_file, plants_file))
+    build_centroid_index(frames, args.output)
@@ -0,0 +1,77 @@
+import logging
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from geocoding_cache import normalize_keys
+
+logger = logging.getLogger(__name__)
+
+
+class CoordinateIndex:
+    """
+    Coordinate note indicizzate su (comune, indirizzo) normalizzati, con il centroide
+    delle coordinate di ogni comune come fallback. Costruito una volta per file di
+    coordinate e riusato per ogni join.
+    """
+
+    def __init__(self, coord_df: pd.DataFrame, comune_col: str = "COMUNE", indirizzo_col: str = "INDIRIZZO",
+                 lat_col: str = "LAT", lon_col: str = "LON"):
+        coords = pd.DataFrame({
+            "comune_key": normalize_keys(coord_df[comune_col]),
+            "indirizzo_key": normalize_keys(coord_df[indirizzo_col]),
+            "LAT": pd.to_numeric(coord_df[lat_col], errors="coerce"),
+            "LON": pd.to_numeric(coord_df[lon_col], errors="coerce"),
+        }).dropna(subset=["LAT", "LON"])
+
+        self.duplicates = int(coords.duplicated(["comune_key", "indirizzo_key"]).sum())
+        self.by_address = coords.drop_duplicates(["comune_key", "indirizzo_key"]).set_index(["comune_key", "indirizzo_key"])
+        self.by_comune = coords.groupby("comune_key")[["LAT", "LON"]].mean()
+
+    def join(self, df: pd.DataFrame, comune_col: str = "COMUNE", indirizzo_col: str = "INDIRIZZO",
+             lat_col: str = "LAT", lon_col: str = "LON") -> Tuple[pd.DataFrame, Dict[str, int]]:
+        """Aggiunge LAT/LON a `df`; ogni riga di input produce esattamente una riga di output"""
+        comune_keys = normalize_keys(df[comune_col])
+        if indirizzo_col in df.columns:
+            indirizzo_keys = normalize_keys(df[indirizzo_col])
+            address_pos = self.by_address.index.get_indexer(pd.MultiIndex.from_arrays([comune_keys, indirizzo_keys]))
+        else:
+            address_pos = np.full(len(df), -1)
+        comune_pos = self.by_comune.index.get_indexer(comune_keys)
+
+        lat = np.full(len(df), np.nan)
+        lon = np.full(len(df), np.nan)
+        use_comune = (address_pos < 0) & (comune_pos >= 0)
+        use_address = address_pos >= 0
+        lat[use_comune] = self.by_comune["LAT"].to_numpy()[comune_pos[use_comune]]
+        lon[use_comune] = self.by_comune["LON"].to_numpy()[comune_pos[use_comune]]
+        lat[use_address] = self.by_address["LAT"].to_numpy()[address_pos[use_address]]
+        lon[use_address] = self.by_address["LON"].to_numpy()[address_pos[use_address]]
+
+        result = df.drop(columns=[c for c in (lat_col, lon_col) if c in df.columns])
+        result[lat_col] = lat
+        result[lon_col] = lon
+
+        report = {
+            "righe_input": len(df),
+            "righe_output": len(result),
+            "per_indirizzo": int(use_address.sum()),
+            "per_comune": int(use_comune.sum()),
+            "senza_coordinate": int(len(df) - use_address.sum() - use_comune.sum()),
+            "chiavi_duplicate_scartate": self.duplicates,
+        }
+        logger.info(f"Join coordinate: {report}")
+        return result, report
+
+
+def join_coordinates(df: pd.DataFrame, coord_df: pd.DataFrame,
+                     comune_col: str = "COMUNE", indirizzo_col: str = "INDIRIZZO",
+                     lat_col: str = "LAT", lon_col: str = "LON") -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    Aggiunge LAT/LON a `df` con una lookup indicizzata su (comune, indirizzo)
+    normalizzati, con fallback sul centroide delle coordinate note del comune.
+    Ogni riga di input produce esattamente una riga di output.
+    """
+    index = CoordinateIndex(coord_df, comune_col, indirizzo_col, lat_col, lon_col)
+    return index.join(df, comune_col, indirizzo_col, lat_col, lon_col)
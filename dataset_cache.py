@@ -0,0 +1,141 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from dataset_store import DatasetStore, content_hash
+
+logger = logging.getLogger(__name__)
+
+# Costanti
+DEFAULT_BUDGET_MB = int(os.environ.get("DEPURATORI_CACHE_MB", "1024"))
+
+
+def _freeze(df: pd.DataFrame) -> pd.DataFrame:
+    """Rende in sola lettura gli array delle colonne: una scrittura sul posto solleva un errore"""
+    for array in df._mgr.arrays:
+        # Array numpy, oppure i buffer interni degli array pandas (valori, maschera, codici)
+        for values in (array, getattr(array, "_ndarray", None), getattr(array, "_data", None),
+                       getattr(array, "_mask", None), getattr(array, "_codes", None)):
+            if isinstance(values, np.ndarray):
+                values.flags.writeable = False
+    return df
+
+
+class DatasetCache:
+    """
+    Cache LRU dei dataset preprocessati, condivisa da tutte le sessioni del processo
+    (semantica di st.cache_resource). I dati non vengono copiati: gli array delle
+    colonne sono in sola lettura e ogni sessione riceve una copia superficiale, quindi
+    aggiungere o sostituire colonne e attrs non tocca le altre sessioni.
+    La chiave è hash del contenuto + versione della pipeline; oltre il budget in byte
+    vengono scartati i dataset usati meno di recente.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_BUDGET_MB * 2**20):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._building: Dict[str, threading.Lock] = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+        return entry[0].copy(deep=False)
+
+    def put(self, key: str, df: pd.DataFrame):
+        size = int(df.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            logger.warning(f"Dataset {key} ({size / 2**20:.1f} MB) oltre il budget della cache, non conservato")
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (_freeze(df), size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                evicted, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.stats["evictions"] += 1
+                logger.info(f"Cache dataset: scartato {evicted} ({evicted_size / 2**20:.1f} MB)")
+
+    def get_or_load(self, key: str, loader: Callable[[], Optional[pd.DataFrame]]) -> Optional[pd.DataFrame]:
+        """Restituisce il dataset in cache o lo carica una sola volta anche con sessioni concorrenti"""
+        df = self.get(key)
+        if df is not None:
+            return df
+        with self._lock:
+            build_lock = self._building.setdefault(key, threading.Lock())
+        with build_lock:
+            # Un'altra sessione potrebbe averlo caricato nel frattempo
+            df = self.get(key)
+            if df is not None:
+                return df
+            with self._lock:
+                self.stats["misses"] += 1
+            try:
+                df = loader()
+                if df is None:
+                    return None
+                self.put(key, df)
+                # Anche il primo caricamento riceve una copia superficiale in sola lettura
+                return _freeze(df).copy(deep=False)
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def summary(self) -> dict:
+        with self._lock:
+            return dict(self.stats, datasets=len(self._entries), mb=round(self._bytes / 2**20, 1),
+                        budget_mb=round(self.max_bytes / 2**20, 1))
+
+
+_cache: Optional[DatasetCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_dataset_cache() -> DatasetCache:
+    """Restituisce la cache dei dataset, unica per processo"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DatasetCache()
+        return _cache
+
+
+def load_dataset(source, namespace: str, version: int,
+                 build: Callable[[object], Optional[pd.DataFrame]],
+                 references: Sequence = ()) -> Optional[pd.DataFrame]:
+    """
+    Dataset preprocessato da memoria condivisa, archivio su disco o pipeline, in quest'ordine.
+    Le versioni dei file di riferimento usati dalla pipeline (`references`) entrano nella
+    chiave: rigenerare le coordinate produce un nuovo dataset al caricamento successivo.
+    """
+    if references:
+        version = f"{version}-" + "-".join(ref.version for ref in references)
+    key = f"{namespace}-v{version}-{content_hash(source)}"
+    return get_dataset_cache().get_or_load(
+        key, lambda: DatasetStore().get_or_build(source, namespace, version, build, key=key)
+    )
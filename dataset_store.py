@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Callable, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+logger = logging.getLogger(__name__)
+
+# Costanti
+STORE_DIR = "data/store"
+_ATTRS_KEY = b"depuratori_attrs"
+
+
+def content_hash(source) -> str:
+    """SHA-256 del contenuto di un file caricato (UploadedFile/file-like) o di un percorso"""
+    digest = hashlib.sha256()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    elif hasattr(source, "getvalue"):
+        digest.update(source.getvalue())
+    else:
+        position = source.tell()
+        source.seek(0)
+        for block in iter(lambda: source.read(1 << 20), b""):
+            digest.update(block if isinstance(block, bytes) else block.encode())
+        source.seek(position)
+    return digest.hexdigest()
+
+
+def _encode_attrs(attrs: dict) -> bytes:
+    encoded = {}
+    for key, value in attrs.items():
+        if isinstance(value, pd.DataFrame):
+            encoded[key] = {"__dataframe__": json.loads(value.to_json(orient="split"))}
+        else:
+            encoded[key] = value
+    return json.dumps(encoded, default=str).encode()
+
+
+def _decode_attrs(raw: bytes) -> dict:
+    attrs = {}
+    for key, value in json.loads(raw).items():
+        if isinstance(value, dict) and "__dataframe__" in value:
+            value = pd.DataFrame(**value["__dataframe__"])
+        attrs[key] = value
+    return attrs
+
+
+def _arrow_safe(df: pd.DataFrame) -> pd.DataFrame:
+    """Rende esplicito il tipo delle colonne object miste (stringhe + numeri) come stringa"""
+    df = df.copy(deep=False)
+    for col in df.select_dtypes(include=["object"]).columns:
+        values = df[col]
+        kinds = values.dropna().map(type).unique()
+        if len(kinds) > 1 or (len(kinds) == 1 and kinds[0] is not str):
+            df[col] = values.where(values.isna(), values.astype(str))
+    return df
+
+
+class DatasetStore:
+    """
+    Archivio su disco dei dataset già preprocessati, indicizzato per hash del
+    contenuto del file e versione della pipeline. I dataset sono salvati in
+    formato Arrow IPC non compresso e riletti con memory-map: le colonne numeriche
+    senza mancanti non vengono copiate (array in sola lettura), testo, categorie e
+    interi con mancanti vengono convertiti nei tipi pandas.
+    """
+
+    def __init__(self, directory: str = STORE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.arrow")
+
+    def load(self, key: str) -> Optional[pd.DataFrame]:
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            table = feather.read_table(path, memory_map=True)
+            metadata = table.schema.metadata or {}
+            # Un blocco per colonna e senza copie dove il tipo lo consente: le colonne numeriche
+            # senza valori mancanti restano sulle pagine mappate, le altre vengono convertite
+            df = table.to_pandas(split_blocks=True, self_destruct=True)
+            del table
+            if _ATTRS_KEY in metadata:
+                df.attrs = _decode_attrs(metadata[_ATTRS_KEY])
+            return df
+        except Exception as e:
+            logger.warning(f"Dataset preprocessato non leggibile ({path}): {e}")
+            return None
+
+    def save(self, key: str, df: pd.DataFrame):
+        path = self.path_for(key)
+        table = pa.Table.from_pandas(_arrow_safe(df), preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        if df.attrs:
+            metadata[_ATTRS_KEY] = _encode_attrs(df.attrs)
+        table = table.replace_schema_metadata(metadata)
+        # Scrittura atomica: le sessioni concorrenti non vedono mai un file parziale
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, path)
+
+    def get_or_build(self, source, namespace: str, version: int,
+                     build: Callable[[object], Optional[pd.DataFrame]],
+                     key: Optional[str] = None) -> Optional[pd.DataFrame]:
+        """Restituisce il dataset preprocessato per `source`, costruendolo e salvandolo se assente"""
+        key = key or f"{namespace}-v{version}-{content_hash(source)}"
+        start = time.perf_counter()
+        df = self.load(key)
+        if df is not None:
+            logger.info(f"Dataset {key} letto dall'archivio in {time.perf_counter() - start:.3f}s")
+            df.attrs["dataset_key"] = key
+            return df
+
+        df = build(source)
+        if df is not None:
+            try:
+                self.save(key, df)
+                logger.info(f"Dataset {key} preprocessato e salvato in {time.perf_counter() - start:.3f}s")
+            except Exception as e:
+                logger.warning(f"Impossibile salvare il dataset preprocessato {key}: {e}")
+            # Identifica la versione del dataset per le strutture derivate (indici, aggregati)
+            df.attrs["dataset_key"] = key
+        return df
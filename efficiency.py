@@ -0,0 +1,48 @@
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+def compute_efficiency(df: pd.DataFrame,
+                       group_cols: Sequence[str] = ("area_riferimento", "anno"),
+                       value_col: str = "valore_osservato",
+                       year_col: str = "anno",
+                       series_cols: Sequence[str] = ("area_riferimento", "tipo_trattamento"),
+                       capacity_col: Optional[str] = "capacita_progettuale") -> pd.DataFrame:
+    """
+    Calcola in un unico passaggio vettoriale le metriche di efficienza:
+    - EFFICIENCY: valore rispetto al massimo del gruppo (area, anno), in %
+    - CAPACITY_EFFICIENCY: valore rispetto alla capacità progettuale, in % (se disponibile)
+    - YOY_CHANGE: variazione % rispetto all'anno precedente della stessa serie (area, tipo)
+    """
+    group_cols, series_cols = list(group_cols), list(series_cols)
+    values = df[value_col].to_numpy(dtype=float)
+
+    # Massimo del gruppo propagato a ogni riga (kernel cython, nessuna lambda per gruppo)
+    group_max = df.groupby(group_cols, sort=False, observed=True)[value_col].transform("max").to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        efficiency = np.where(group_max > 0, values / group_max * 100, np.nan)
+    df["EFFICIENCY"] = np.round(efficiency, 2)
+
+    if capacity_col and capacity_col in df.columns:
+        capacity = pd.to_numeric(df[capacity_col], errors="coerce").to_numpy(dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            df["CAPACITY_EFFICIENCY"] = np.round(np.where(capacity > 0, values / capacity * 100, np.nan), 2)
+
+    if series_cols and all(col in df.columns for col in series_cols):
+        # Totale per serie e anno, confrontato con lo stesso totale dell'anno precedente;
+        # il confronto avviene sui gruppi e viene poi propagato alle righe tramite i codici di gruppo
+        grouped = df.groupby(series_cols + [year_col], sort=False, observed=True, dropna=False)
+        codes = grouped.ngroup().to_numpy()
+        totals = grouped[value_col].sum().reset_index()
+        previous = totals.rename(columns={value_col: "precedente"})
+        previous[year_col] = previous[year_col] + 1
+        current = totals.merge(previous, on=series_cols + [year_col], how="left")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            yoy = np.where(
+                current["precedente"] > 0, (current[value_col] / current["precedente"] - 1) * 100, np.nan
+            )
+        df["YOY_CHANGE"] = np.round(yoy, 2)[codes]
+
+    return df
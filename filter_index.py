@@ -0,0 +1,100 @@
+import logging
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def _factorize_sorted(values: pd.Series):
+    """Codici e valori distinti ordinati; i valori mancanti hanno codice -1"""
+    try:
+        return pd.factorize(values, sort=True)
+    except TypeError:
+        # Colonne con tipi misti: si ordinano i valori distinti come testo
+        codes, uniques = pd.factorize(values)
+        order = np.argsort(np.asarray(uniques, dtype=str), kind="stable")
+        remap = np.empty(len(order), dtype=np.intp)
+        remap[order] = np.arange(len(order))
+        return np.where(codes >= 0, remap[codes], -1), uniques.take(order)
+
+
+class FilterIndex:
+    """
+    Indice dei filtri della sidebar, costruito una volta per versione del dataset.
+    Per ogni colonna conserva la codifica categorica e, per ogni valore, la lista
+    ordinata delle posizioni di riga (posting list in formato CSR). Un filtro
+    diventa l'intersezione delle posting list selezionate, senza ricalcolare
+    valori distinti né maschere sull'intero DataFrame.
+    """
+
+    def __init__(self, df: pd.DataFrame, columns: Iterable[str]):
+        self.n_rows = len(df)
+        self._options: Dict[str, List] = {}
+        self._lookup: Dict[str, Dict] = {}
+        self._order: Dict[str, np.ndarray] = {}
+        self._offsets: Dict[str, np.ndarray] = {}
+        for col in columns:
+            if col not in df.columns:
+                continue
+            codes, uniques = _factorize_sorted(df[col])
+            codes = np.asarray(codes)
+            valid = codes >= 0
+            # Posizioni raggruppate per codice: le righe del valore i sono order[offsets[i]:offsets[i+1]]
+            self._order[col] = np.flatnonzero(valid)[np.argsort(codes[valid], kind="stable")]
+            self._offsets[col] = np.concatenate(([0], np.cumsum(np.bincount(codes[valid], minlength=len(uniques)))))
+            self._options[col] = list(uniques)
+            self._lookup[col] = {value: i for i, value in enumerate(self._options[col])}
+        logger.info(f"Indice filtri: {self.n_rows} righe, colonne {', '.join(self._options)}")
+
+    def __contains__(self, col: str) -> bool:
+        return col in self._options
+
+    def options(self, col: str) -> List:
+        """Valori distinti ordinati della colonna (esclusi i mancanti)"""
+        return self._options.get(col, [])
+
+    def postings(self, col: str, values: Iterable) -> np.ndarray:
+        """Posizioni ordinate delle righe in cui `col` assume uno dei `values`"""
+        order, offsets, lookup = self._order[col], self._offsets[col], self._lookup[col]
+        parts = [order[offsets[i]:offsets[i + 1]] for i in (lookup.get(v) for v in values) if i is not None]
+        if not parts:
+            return np.empty(0, dtype=np.intp)
+        return np.sort(np.concatenate(parts)) if len(parts) > 1 else parts[0]
+
+    def select(self, filters: Dict[str, Optional[Iterable]]) -> Optional[np.ndarray]:
+        """
+        Intersezione dei filtri attivi ({colonna: valori}); un filtro vuoto o None
+        non restringe. Restituisce None se nessun filtro è attivo.
+        """
+        active = [(col, list(values)) for col, values in filters.items() if values and col in self]
+        if not active:
+            return None
+        # Si parte dalla posting list più corta per ridurre il lavoro
+        lists = sorted((self.postings(col, values) for col, values in active), key=len)
+        positions = lists[0]
+        for other in lists[1:]:
+            if not len(positions) or not len(other):
+                return np.empty(0, dtype=np.intp)
+            # Le posting list sono ordinate: ricerca binaria delle posizioni candidate
+            found = np.minimum(np.searchsorted(other, positions), len(other) - 1)
+            positions = positions[other[found] == positions]
+        return positions
+
+    def apply(self, df: pd.DataFrame, filters: Dict[str, Optional[Iterable]],
+              columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Righe di `df` che soddisfano i filtri, eventualmente solo le colonne `columns`.
+        Senza filtri attivi restituisce `df` stesso e posizioni contigue diventano una
+        slice; altrimenti pandas copia le righe selezionate, quindi si raccolgono solo
+        le colonne che servono.
+        """
+        positions = self.select(filters)
+        if columns is not None:
+            df = df[columns]
+        if positions is None:
+            return df
+        if len(positions) and positions[-1] - positions[0] + 1 == len(positions):
+            return df.iloc[positions[0]:positions[-1] + 1]
+        return df.iloc[positions]
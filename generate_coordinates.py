@@ -1,7 +1,6 @@
 import pandas as pd
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
-import time
+from batch_geocoding import BatchGeocoder, NominatimProvider
+from geocoding_cache import get_geocoding_cache
 
 def create_coordinates_file_campania():
     # Leggi il file CSV della Campania
@@ -10,38 +9,35 @@ def create_coordinates_file_campania():
     # Verifica e modifica le colonne esistenti
     unique_locations = df[['COMUNE', 'INDIRIZZO']].drop_duplicates()
     
-    geolocator = Nominatim(user_agent="campania_depuratori", timeout=30)
+    # Indirizzo completo con fallback sul solo comune, risolti in un unico passaggio
+    candidates = [
+        [
+            f"{row.INDIRIZZO}, {row.COMUNE}, Campania, Italy",
+            f"{row.COMUNE}, Campania, Italy"
+        ]
+        for row in unique_locations.itertuples(index=False)
+    ]
+    
+    geocoder = BatchGeocoder(
+        NominatimProvider(user_agent="campania_depuratori", timeout=30),
+        cache=get_geocoding_cache()
+    )
+    results = geocoder.geocode_batch(candidates)
+    
     coordinates = []
     failed = []
-    
-    for _, row in unique_locations.iterrows():
-        success = False
-        addresses = [
-            f"{row['INDIRIZZO']}, {row['COMUNE']}, Campania, Italy",
-            f"{row['COMUNE']}, Campania, Italy"
-        ]
-        
-        for address in addresses:
-            try:
-                location = geolocator.geocode(address)
-                if location:
-                    coordinates.append({
-                        'COMUNE': row['COMUNE'],
-                        'INDIRIZZO': row['INDIRIZZO'],
-                        'LAT': location.latitude,
-                        'LON': location.longitude
-                    })
-                    print(f"✓ {row['COMUNE']} - {row['INDIRIZZO']}")
-                    success = True
-                    break
-                time.sleep(2)
-            except (GeocoderTimedOut, GeocoderUnavailable):
-                print(f"✗ Errore: {row['COMUNE']} - {row['INDIRIZZO']}")
-                time.sleep(5)
-                continue
-        
-        if not success:
-            failed.append(f"{row['COMUNE']} - {row['INDIRIZZO']}")
+    for row, result in zip(unique_locations.itertuples(index=False), results):
+        if result.found:
+            coordinates.append({
+                'COMUNE': row.COMUNE,
+                'INDIRIZZO': row.INDIRIZZO,
+                'LAT': result.lat,
+                'LON': result.lon
+            })
+            print(f"✓ {row.COMUNE} - {row.INDIRIZZO}")
+        else:
+            print(f"✗ Errore: {row.COMUNE} - {row.INDIRIZZO}")
+            failed.append(f"{row.COMUNE} - {row.INDIRIZZO}")
     
     pd.DataFrame(coordinates).to_csv("data/depuratori_campania_con_coordinate.csv", index=False)
     pd.DataFrame({'Error': failed}).to_csv("data/failed_geocoding_campania.csv", index=False)
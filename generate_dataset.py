@@ -1,6 +1,6 @@
 import pandas as pd
-import requests
-import time
+from batch_geocoding import AzureMapsProvider, BatchGeocoder
+from geocoding_cache import get_geocoding_cache
 
 # Percorso del file
 file_depuratori = "data/Dataset_Normalizzato_ISTAT_Depuratori_Acque.csv"
@@ -10,35 +10,16 @@ output_file = "data/depuratori_con_coordinate.csv"
 api_key = "YOUR_AZURE_MAPS_API_KEY"
 
 # Funzione di geocoding tramite Azure Maps
-def get_coordinates_azure(query, api_key):
-    url = "https://atlas.microsoft.com/search/address/json"
-    params = {
-        "api-version": "1.0",
-        "subscription-key": api_key,
-        "query": query + ", Italy",  # Utilizziamo anche "Italy" per migliorare la precisione
-        "countrySet": "IT"
-    }
-    response = requests.get(url, params=params)
-    if response.status_code == 200:
-        data = response.json()
-        results = data.get('results', [])
-        if results:
-            position = results[0].get('position', {})
-            return position.get('lat'), position.get('lon')
-    return None, None
+def get_coordinates_azure(queries, api_key):
+    """Geocodifica in batch una lista di località, rispettando il rate limit di Azure Maps"""
+    geocoder = BatchGeocoder(AzureMapsProvider(api_key), cache=get_geocoding_cache(), max_workers=8)
+    return [(r.lat, r.lon) for r in geocoder.geocode_batch(list(queries))]
 
 # Carica il dataset dei depuratori
 df_depuratori = pd.read_csv(file_depuratori, encoding="utf-8")
 
-# Lista per memorizzare le coordinate geografiche
-coordinates = []
-
-# Geocoding per ogni depuratore
-for index, row in df_depuratori.iterrows():
-    location = row["area_riferimento"]  # Usa la colonna con la località
-    lat, lon = get_coordinates_azure(location, api_key)
-    coordinates.append((lat, lon))
-    time.sleep(1)  # Evita di superare il limite delle chiamate API
+# Geocoding per ogni depuratore (le località ripetute vengono risolte una sola volta)
+coordinates = get_coordinates_azure(df_depuratori["area_riferimento"].astype(str), api_key)
 
 # Aggiungi le coordinate al dataset
 df_depuratori["Latitude"], df_depuratori["Longitude"] = zip(*coordinates)
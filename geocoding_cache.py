@@ -0,0 +1,133 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Costanti
+DEFAULT_CACHE_PATH = "data/geocoding_cache.sqlite"
+NEGATIVE_TTL = 7 * 24 * 3600  # I risultati negativi vengono ritentati dopo una settimana
+
+Coordinates = Tuple[Optional[float], Optional[float]]
+
+
+def normalize_query(query: str) -> str:
+    """Normalizza un indirizzo/comune/regione per usarlo come chiave di cache"""
+    text = unicodedata.normalize("NFKD", str(query))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w]+", " ", text.lower())
+    return " ".join(text.split())
+
+
+def normalize_keys(values: pd.Series) -> pd.Series:
+    """Versione vettoriale di normalize_query: normalizza solo i valori distinti"""
+    codes, uniques = pd.factorize(values)
+    # I mancanti (codice -1) puntano all'ultima posizione, la chiave vuota
+    keys = np.append(pd.Index(uniques).astype(str).map(normalize_query).to_numpy(dtype=object), "")
+    return pd.Series(keys[codes], index=values.index)
+
+
+class GeocodingCache:
+    """Cache su disco (SQLite) dei risultati di geocodifica, condivisa tra i processi"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, negative_ttl: int = NEGATIVE_TTL):
+        self.path = path
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS geocoding (
+                query TEXT PRIMARY KEY,
+                lat REAL,
+                lon REAL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, query: str) -> Optional[Coordinates]:
+        """Restituisce le coordinate in cache, (None, None) per un negativo valido, None se assente"""
+        return self.get_many([query]).get(normalize_query(query))
+
+    def get_many(self, queries: Iterable[str]) -> Dict[str, Coordinates]:
+        """Legge in un'unica query le voci valide, indicizzate per chiave normalizzata"""
+        keys = list({normalize_query(q) for q in queries})
+        if not keys:
+            return {}
+        now = time.time()
+        results = {}
+        with self._lock:
+            # SQLite limita il numero di parametri per statement
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT query, lat, lon, updated_at FROM geocoding WHERE query IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, lat, lon, updated_at in rows:
+                    if lat is None and now - updated_at > self.negative_ttl:
+                        continue
+                    results[key] = (lat, lon)
+        return results
+
+    def set(self, query: str, lat: Optional[float], lon: Optional[float]):
+        """Registra un risultato; lat/lon None indicano un risultato negativo"""
+        self.set_many({query: (lat, lon)})
+
+    def set_many(self, results: Dict[str, Coordinates]):
+        now = time.time()
+        rows = [(normalize_query(q), lat, lon, now) for q, (lat, lon) in results.items()]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO geocoding (query, lat, lon, updated_at) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def lookup(self, query: str, resolver: Callable[[str], Coordinates]) -> Coordinates:
+        """
+        Restituisce le coordinate dalla cache oppure le risolve con `resolver`.
+        Le eccezioni del resolver (timeout, servizio non disponibile) non vengono
+        memorizzate, così la query verrà ritentata alla prossima richiesta.
+        """
+        cached = self.get(query)
+        if cached is not None:
+            return cached
+        lat, lon = resolver(query)
+        self.set(query, lat, lon)
+        if lat is None:
+            logger.info(f"Geocodifica senza risultato, memorizzata come negativa: {query}")
+        return lat, lon
+
+    def purge_expired(self) -> int:
+        """Elimina i risultati negativi scaduti"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM geocoding WHERE lat IS NULL AND updated_at < ?",
+                (time.time() - self.negative_ttl,),
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+
+_default_cache: Optional[GeocodingCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_geocoding_cache(path: str = DEFAULT_CACHE_PATH) -> GeocodingCache:
+    """Restituisce l'istanza condivisa della cache di geocodifica"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None or _default_cache.path != path:
+            _default_cache = GeocodingCache(path)
+        return _default_cache
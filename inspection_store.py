@@ -0,0 +1,116 @@
+import hashlib
+import logging
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from geocoding_cache import normalize_keys
+
+logger = logging.getLogger(__name__)
+
+# Colonne che identificano un impianto (le altre descrivono il singolo sopralluogo)
+PLANT_KEY_COLUMNS = ("Provincia", "Comune", "Indirizzo")
+KEY_COLUMN = "ID_Impianto"
+
+
+def plant_keys(df: pd.DataFrame, columns: Sequence[str] = PLANT_KEY_COLUMNS) -> pd.Series:
+    """
+    Chiave stabile dell'impianto: hash dei valori normalizzati delle colonne
+    identificative. Non dipende dall'ordine delle righe né dal file, quindi lo
+    stesso impianto ha la stessa chiave in caricamenti e regioni diversi.
+    """
+    columns = [c for c in columns if c in df.columns]
+    parts = [pd.Series(normalize_keys(df[c]), index=df.index) for c in columns]
+    joined = parts[0].str.cat(parts[1:], sep="|") if parts else pd.Series("", index=df.index)
+    # Hash calcolato solo sui valori distinti
+    codes, uniques = pd.factorize(joined)
+    hashed = np.array(["DEP-" + hashlib.sha1(u.encode()).hexdigest()[:10] for u in uniques], dtype=object)
+    return pd.Series(hashed[codes], index=df.index, name=KEY_COLUMN)
+
+
+class InspectionStore:
+    """
+    Sopralluoghi raggruppati per impianto in forma colonnare: righe ordinate per
+    (impianto, data) con gli offset di inizio di ogni impianto, come le posting list
+    di FilterIndex. Stato più recente, stato a una data e storico di un impianto si
+    ottengono con slice e riduzioni vettoriali, senza cicli sulle righe.
+    """
+
+    def __init__(self, df: pd.DataFrame, key_columns: Sequence[str] = PLANT_KEY_COLUMNS,
+                 date_col: str = "Data_Sopralluogo"):
+        self.date_col = date_col
+        keys = plant_keys(df, key_columns)
+        codes, self.keys = pd.factorize(keys, sort=True)
+        dates = pd.to_datetime(df[date_col], errors="coerce") if date_col in df.columns \
+            else pd.Series(pd.NaT, index=df.index)
+        # I sopralluoghi senza data vanno in testa: l'ultimo di ogni impianto è il più recente datato
+        date_values = dates.to_numpy(dtype="datetime64[ns]")
+        sortable = np.where(np.isnat(date_values), np.iinfo(np.int64).min, date_values.view(np.int64))
+        order = np.lexsort((sortable, codes))
+
+        self.inspections = df.iloc[order].reset_index(drop=True)
+        self.inspections.insert(0, KEY_COLUMN, keys.to_numpy()[order])
+        self._codes = codes[order]
+        self._dates = date_values[order]
+        self._offsets = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=len(self.keys)))))
+        # Primo sopralluogo datato di ogni impianto (quelli senza data sono in testa)
+        undated = np.add.reduceat(np.isnat(self._dates).astype(np.intp), self._offsets[:-1]) \
+            if len(self.keys) else np.empty(0, dtype=np.intp)
+        first = self._offsets[:-1] + undated
+        self._first_dated = np.where(first < self._offsets[1:], self._dates[np.minimum(first, len(self._dates) - 1)],
+                                     np.datetime64("NaT"))
+        self._latest: Optional[pd.DataFrame] = None
+        logger.info(f"Sopralluoghi: {len(self.inspections)} righe, {len(self.keys)} impianti")
+
+    @property
+    def n_plants(self) -> int:
+        return len(self.keys)
+
+    def __len__(self):
+        return len(self.inspections)
+
+    def _with_counts(self, positions: np.ndarray, plants: np.ndarray) -> pd.DataFrame:
+        result = self.inspections.iloc[positions].reset_index(drop=True)
+        result["N_Sopralluoghi"] = np.diff(self._offsets)[plants]
+        result["Primo_Sopralluogo"] = self._first_dated[plants]
+        result["Ultimo_Sopralluogo"] = self._dates[positions]
+        return result
+
+    def latest(self) -> pd.DataFrame:
+        """Una riga per impianto con lo stato dell'ultimo sopralluogo (calcolato una volta)"""
+        if self._latest is None:
+            plants = np.arange(len(self.keys))
+            self._latest = self._with_counts(self._offsets[1:] - 1, plants)
+        return self._latest
+
+    def as_of(self, date) -> pd.DataFrame:
+        """Stato di ogni impianto all'ultimo sopralluogo entro `date` (impianti senza sopralluoghi esclusi)"""
+        valid = ~np.isnat(self._dates) & (self._dates <= np.datetime64(pd.Timestamp(date), "ns"))
+        candidates = np.where(valid, np.arange(len(self._dates)), -1)
+        last = np.maximum.reduceat(candidates, self._offsets[:-1]) if len(self.keys) else candidates[:0]
+        plants = np.flatnonzero(last >= 0)
+        return self._with_counts(last[plants], plants)
+
+    def between(self, start=None, end=None) -> pd.DataFrame:
+        """Sopralluoghi nel periodo [start, end], ordinati per impianto e data"""
+        mask = ~np.isnat(self._dates)
+        if start is not None:
+            mask &= self._dates >= np.datetime64(pd.Timestamp(start), "ns")
+        if end is not None:
+            mask &= self._dates <= np.datetime64(pd.Timestamp(end), "ns")
+        return self.inspections[mask]
+
+    def per_period(self, freq: str = "M") -> pd.DataFrame:
+        """Sopralluoghi e impianti distinti visitati per periodo"""
+        dated = ~np.isnat(self._dates)
+        periods = pd.PeriodIndex(self._dates[dated], freq=freq)
+        frame = pd.DataFrame({"periodo": periods, "impianto": self._codes[dated]})
+        return frame.groupby("periodo").agg(sopralluoghi=("impianto", "size"), impianti=("impianto", "nunique"))
+
+    def history(self, key: str) -> pd.DataFrame:
+        """Storico dei sopralluoghi di un impianto, dal più vecchio"""
+        code = self.keys.get_indexer([key])[0]
+        if code < 0:
+            return self.inspections.iloc[0:0]
+        return self.inspections.iloc[self._offsets[code]:self._offsets[code + 1]]
@@ -0,0 +1,99 @@
+import json
+from typing import Dict, Optional
+
+import folium
+import numpy as np
+import pandas as pd
+from folium import plugins
+
+# Oltre questa soglia di righe la mappa usa il rendering lato client
+FAST_MAP_THRESHOLD = 1000
+
+_CALLBACK_TEMPLATE = """
+function (row) {
+    var labels = %(labels)s;
+    var hasTitle = %(has_title)s;
+    var esc = function (v) {
+        return String(v).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+    };
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+        radius: 8, color: '%(color)s', fill: true, fillColor: '%(color)s', fillOpacity: 0.7, weight: 2
+    });
+    marker.bindPopup(function () {
+        var offset = hasTitle ? 3 : 2;
+        var html = "<div style='font-family: Arial; padding: 10px; min-width: 200px;'>";
+        if (hasTitle) {
+            html += "<h4 style='margin-bottom: 10px;'>" + esc(row[2]) + "</h4>";
+        }
+        html += "<table style='width: 100%%;'>";
+        for (var i = 0; i < labels.length; i++) {
+            var value = row[offset + i];
+            if (value !== '') {
+                html += "<tr><td><b>" + esc(labels[i]) + ":</b></td><td>" + esc(value) + "</td></tr>";
+            }
+        }
+        return html + "</table></div>";
+    }, {maxWidth: 300});
+    return marker;
+}
+"""
+
+
+def use_fast_rendering(df: pd.DataFrame, threshold: int = FAST_MAP_THRESHOLD) -> bool:
+    return len(df) > threshold
+
+
+def _as_text(values: pd.Series) -> np.ndarray:
+    """Converte una colonna in testo per il popup; i valori mancanti diventano stringa vuota"""
+    if pd.api.types.is_float_dtype(values):
+        text = values.map(lambda v: f"{v:,.0f}" if float(v).is_integer() else f"{v:,.2f}", na_action="ignore")
+    else:
+        text = values.astype(str).str.strip()
+    return text.where(values.notna(), "").to_numpy(dtype=object)
+
+
+def add_fast_markers(m: folium.Map, df: pd.DataFrame, popup_fields: Dict[str, str],
+                     title_col: Optional[str] = None, color: str = "blue",
+                     lat_col: str = "LAT", lon_col: str = "LON") -> plugins.FastMarkerCluster:
+    """
+    Aggiunge tutti i depuratori come un unico layer FastMarkerCluster.
+    I dati viaggiano come array di colonne e i popup (etichetta -> colonna)
+    vengono generati nel browser solo all'apertura del marker.
+    """
+    lat = pd.to_numeric(df[lat_col], errors="coerce").to_numpy(dtype=float)
+    lon = pd.to_numeric(df[lon_col], errors="coerce").to_numpy(dtype=float)
+    valid = np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+
+    columns = [lat[valid].round(6), lon[valid].round(6)]
+    if title_col is not None:
+        columns.append(_as_text(df.loc[valid, title_col]))
+    columns.extend(_as_text(df.loc[valid, col]) for col in popup_fields.values())
+
+    callback = _CALLBACK_TEMPLATE % {
+        "labels": json.dumps(list(popup_fields.keys())),
+        "has_title": "true" if title_col is not None else "false",
+        "color": color,
+    }
+    cluster = plugins.FastMarkerCluster([], callback=callback)
+    # Le coordinate sono già validate in modo vettoriale: si evita la validazione riga per riga
+    cluster.data = np.column_stack(columns).tolist() if len(columns[0]) else []
+    cluster.add_to(m)
+    return cluster
+
+
+def add_cell_markers(parent, cells: pd.DataFrame, value_label: str = "Valore", color: str = "#2E5E88"):
+    """Aggiunge un cerchio per ogni cella aggregata, con raggio proporzionale ai depuratori contenuti"""
+    if cells.empty:
+        return
+    radius = 8 + 22 * np.sqrt(cells["count"].to_numpy() / cells["count"].max())
+    for lat, lon, count, valore, r in zip(cells["LAT"], cells["LON"], cells["count"], cells["valore"], radius):
+        folium.CircleMarker(
+            location=(lat, lon),
+            radius=float(r),
+            color=color,
+            fill=True,
+            fillColor=color,
+            fillOpacity=0.6,
+            weight=1,
+            tooltip=f"{count:,} depuratori - {value_label}: {valore:,.0f}",
+        ).add_to(parent)
@@ -0,0 +1,102 @@
+import logging
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# (sud, ovest, nord, est)
+Bounds = Tuple[float, float, float, float]
+
+ITALY_BOUNDS: Bounds = (35.5, 6.6, 47.1, 18.6)
+
+
+def cell_size(zoom: int, cell_pixels: int = 64) -> float:
+    """Lato della cella della griglia in gradi: circa `cell_pixels` pixel a schermo al livello di zoom dato"""
+    return 360.0 / (2 ** zoom) * cell_pixels / 256
+
+
+def bounds_from_leaflet(bounds: Optional[dict]) -> Optional[Bounds]:
+    """Converte i bounds restituiti da st_folium nel formato (sud, ovest, nord, est)"""
+    try:
+        sw, ne = bounds["_southWest"], bounds["_northEast"]
+        return sw["lat"], sw["lng"], ne["lat"], ne["lng"]
+    except (TypeError, KeyError):
+        return None
+
+
+class TileEngine:
+    """
+    Indice a griglia su LAT/LON con aggregati precalcolati per livello di zoom.
+    A zoom basso restituisce celle con conteggio, somma del valore e baricentro;
+    a zoom alto (o con pochi punti nel viewport) i singoli depuratori visibili.
+    Il payload dipende quindi dal viewport e non dalla dimensione del dataset.
+    """
+
+    def __init__(self, df: pd.DataFrame, value_col: Optional[str] = None,
+                 min_zoom: int = 4, detail_zoom: int = 11, max_points: int = 1000,
+                 cell_pixels: int = 64, lat_col: str = "LAT", lon_col: str = "LON"):
+        self.value_col = value_col
+        self.min_zoom = min_zoom
+        self.detail_zoom = detail_zoom
+        self.max_points = max_points
+        self.cell_pixels = cell_pixels
+        self.lat_col = lat_col
+        self.lon_col = lon_col
+
+        points = df.dropna(subset=[lat_col, lon_col])
+        order = np.argsort(points[lat_col].to_numpy(), kind="stable")
+        self._points = points.iloc[order]
+        self._lat = self._points[lat_col].to_numpy(dtype=float)
+        self._lon = self._points[lon_col].to_numpy(dtype=float)
+        self._levels: Dict[int, pd.DataFrame] = {
+            zoom: self._aggregate(zoom) for zoom in range(min_zoom, detail_zoom)
+        }
+        logger.info(
+            f"Griglia mappa: {len(self._points)} punti, livelli {min_zoom}-{detail_zoom - 1}, "
+            f"{sum(len(level) for level in self._levels.values())} celle"
+        )
+
+    def __len__(self):
+        return len(self._points)
+
+    def _aggregate(self, zoom: int) -> pd.DataFrame:
+        size = cell_size(zoom, self.cell_pixels)
+        cells = pd.DataFrame({
+            "cy": np.floor(self._lat / size).astype(np.int64),
+            "cx": np.floor(self._lon / size).astype(np.int64),
+            "LAT": self._lat,
+            "LON": self._lon,
+            "valore": self._points[self.value_col].to_numpy(dtype=float) if self.value_col else 0.0,
+        })
+        # Il baricentro della cella (non il suo centro) posiziona il cluster dove sono i punti
+        return cells.groupby(["cy", "cx"], sort=True).agg(
+            count=("LAT", "size"), valore=("valore", "sum"), LAT=("LAT", "mean"), LON=("LON", "mean")
+        ).reset_index()
+
+    def _point_slice(self, bounds: Bounds) -> np.ndarray:
+        south, west, north, east = bounds
+        start = np.searchsorted(self._lat, south, side="left")
+        stop = np.searchsorted(self._lat, north, side="right")
+        positions = np.arange(start, stop)
+        lon = self._lon[start:stop]
+        return positions[(lon >= west) & (lon <= east)]
+
+    def count_in(self, bounds: Bounds) -> int:
+        return len(self._point_slice(bounds))
+
+    def query(self, bounds: Optional[Bounds], zoom: int) -> Tuple[str, pd.DataFrame]:
+        """
+        Restituisce ("points", righe del dataset nel viewport) oppure
+        ("clusters", celle con count/valore/LAT/LON) per il livello di zoom.
+        """
+        bounds = bounds or ITALY_BOUNDS
+        positions = self._point_slice(bounds)
+        if zoom >= self.detail_zoom or len(positions) <= self.max_points:
+            return "points", self._points.iloc[positions]
+
+        level = self._levels[int(np.clip(zoom, self.min_zoom, self.detail_zoom - 1))]
+        south, west, north, east = bounds
+        visible = level["LAT"].between(south, north) & level["LON"].between(west, east)
+        return "clusters", level[visible]
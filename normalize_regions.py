@@ -0,0 +1,181 @@
+import argparse
+import glob
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from clean_normalize import CHUNK_SIZE, normalize_dataset
+from reference_data import get_reference
+from schema import PLANT_SCHEMA, SOURCE_MAPPINGS, conform
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+OUTPUT_FILE = "data/depuratori_nazionale_normalizzato.parquet"
+
+# Tipi Arrow delle colonne canoniche nel dataset nazionale (le categorie diventano testo)
+_ARROW_TYPES = {
+    "category": pa.string(), "string": pa.string(), "datetime": pa.timestamp("ns"),
+    "Int8": pa.int8(), "Int16": pa.int16(), "Int32": pa.int32(),
+    "float32": pa.float32(), "float64": pa.float64(),
+}
+
+
+def _words(text):
+    return " " + re.sub(r"[^a-z]+", " ", text.lower()).strip() + " "
+
+
+def load_regions():
+    """Elenco delle regioni dall'archivio di stato aggiornamento"""
+    archivio = get_reference("stato_archivio").get()
+    return archivio["Regione"].tolist() if archivio is not None else []
+
+
+def detect_region(path, regions):
+    """Riconosce la regione dal nome del file (es. ..._Campania_... -> CAMPANIA)"""
+    name = _words(os.path.splitext(os.path.basename(path))[0])
+    # Le denominazioni più lunghe prima, per non confondere nomi composti
+    for region in sorted(regions, key=len, reverse=True):
+        if _words(region) in name:
+            return region
+    return None
+
+
+def collect_inputs(patterns):
+    """Espande directory e pattern glob nella lista dei CSV da normalizzare"""
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*.csv")
+        files.extend(sorted(glob.glob(pattern)))
+    return list(dict.fromkeys(files))
+
+
+def _normalize_file(args):
+    """Eseguita nel processo worker: normalizza un file regionale in un Parquet parziale"""
+    input_file, part_file, chunksize = args
+    start = time.perf_counter()
+    rows = normalize_dataset(input_file, part_file, chunksize=chunksize, output_format="parquet")
+    return rows, time.perf_counter() - start
+
+
+def source_for(region):
+    """Mappatura delle colonne da usare per la regione (None se la regione non ne ha una)"""
+    source = region.lower() if region else None
+    return source if source in SOURCE_MAPPINGS and source not in ("ckan", "nazionale") else None
+
+
+def _conformed_fields(schema, source):
+    """Campi Arrow di un Parquet parziale dopo conform: colonne canoniche con il tipo dello schema"""
+    if source is None:
+        return list(schema.remove_metadata())
+    mapping = SOURCE_MAPPINGS[source]
+    canonical = {f.name: f for f in PLANT_SCHEMA}
+    fields = []
+    for field in schema.remove_metadata():
+        name = mapping.get(field.name, field.name)
+        fields.append(pa.field(name, _ARROW_TYPES[canonical[name].dtype]) if name in canonical else field)
+    return fields
+
+
+def _merged_schema(parts):
+    """Schema unione: colonne canoniche nell'ordine dello schema, poi le extra, poi `regione`"""
+    fields = {}
+    for part, region in parts:
+        for field in _conformed_fields(pq.read_schema(part), source_for(region)):
+            fields.setdefault(field.name, field)
+    order = [f.name for f in PLANT_SCHEMA if f.name in fields]
+    order += [name for name in fields if name not in order and name != "regione"]
+    return pa.schema([fields[name] for name in order] + [pa.field("regione", pa.string())])
+
+
+def _to_schema(table, schema):
+    """Colonne nell'ordine e nel tipo dello schema unione; quelle assenti nella parte restano nulle"""
+    arrays = [table.column(field.name).cast(field.type) if field.name in table.column_names
+              else pa.nulls(table.num_rows, field.type) for field in schema]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _merge_parts(parts, output_file):
+    """
+    Unisce i Parquet parziali a batch nello schema canonico: ogni parte passa per
+    conform con la mappatura della propria regione, così la stessa grandezza finisce
+    nella stessa colonna qualunque sia l'intestazione regionale.
+    """
+    schema = _merged_schema(parts)
+
+    rows = 0
+    writer = pq.ParquetWriter(output_file, schema) if output_file.endswith(".parquet") else None
+    try:
+        for part, region in parts:
+            source = source_for(region)
+            if source is None:
+                logger.warning(f"{region}: nessuna mappatura delle colonne, intestazioni originali")
+            for batch in pq.ParquetFile(part).iter_batches():
+                df = batch.to_pandas()
+                if source is not None:
+                    df = conform(df, source)
+                df["regione"] = region
+                table = _to_schema(pa.Table.from_pandas(df, preserve_index=False), schema)
+                if writer is not None:
+                    writer.write_table(table)
+                else:
+                    table.to_pandas().to_csv(output_file, mode="w" if rows == 0 else "a", header=rows == 0, index=False)
+                rows += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def normalize_regions(inputs, output_file=OUTPUT_FILE, workers=None, chunksize=CHUNK_SIZE):
+    """Normalizza in parallelo i file regionali e li unisce in un unico dataset nazionale"""
+    regions = load_regions()
+    files = collect_inputs(inputs)
+    if not files:
+        logger.warning("Nessun file da normalizzare")
+        return pd.DataFrame()
+
+    tmp_dir = tempfile.mkdtemp(prefix="normalize_regions_")
+    try:
+        tasks = [(f, os.path.join(tmp_dir, f"{i}.parquet"), chunksize) for i, f in enumerate(files)]
+        start = time.perf_counter()
+        # Un processo per file: la normalizzazione è CPU-bound e non condivide stato
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_normalize_file, tasks))
+        elapsed = time.perf_counter() - start
+
+        report = pd.DataFrame({
+            "file": [os.path.basename(f) for f in files],
+            "regione": [detect_region(f, regions) or os.path.splitext(os.path.basename(f))[0] for f in files],
+            "righe": [rows for rows, _ in results],
+            "secondi": [round(seconds, 2) for _, seconds in results],
+        })
+        parts = [(part, region) for (_, part, _), region, rows in zip(tasks, report["regione"], report["righe"]) if rows]
+        total = _merge_parts(parts, output_file) if parts else 0
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print(report.to_string(index=False))
+    serial = report["secondi"].sum()
+    print(f"\nTotale: {total} righe in {output_file} - normalizzazione {elapsed:.2f}s "
+          f"(somma dei tempi per file {serial:.2f}s, speed-up {serial / elapsed if elapsed else 0:.1f}x)")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Normalizza in parallelo i CSV regionali in un dataset nazionale")
+    parser.add_argument("inputs", nargs="+", help="Directory o pattern glob dei CSV regionali")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="File di output (.parquet o .csv)")
+    parser.add_argument("--workers", type=int, default=None, help="Processi worker (default: numero di CPU)")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE, help="Righe per blocco")
+    args = parser.parse_args()
+    normalize_regions(args.inputs, args.output, args.workers, args.chunksize)
@@ -0,0 +1,146 @@
+import logging
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Numero di intervalli dello sketch dei quantili (equi-profondità sull'intero dataset)
+SKETCH_BINS = 256
+
+
+class Cube:
+    """
+    Cubo pre-aggregato costruito una volta per dataset. Per ogni combinazione
+    osservata delle dimensioni conserva conteggi, somme, somme dei quadrati,
+    minimo e massimo delle misure, più un istogramma della misura principale su
+    intervalli comuni a tutte le celle (sketch dei quantili, sommabile tra celle).
+    Le metriche e i grafici della dashboard si ottengono sommando le celle
+    selezionate, senza tornare alle righe.
+    """
+
+    def __init__(self, df: pd.DataFrame, dims: Sequence[str], measures: Sequence[str],
+                 sketch_measure: Optional[str] = None, bins: int = SKETCH_BINS):
+        self.dims = [d for d in dims if d in df.columns]
+        self.measures = [m for m in measures if m in df.columns]
+        self.sketch_measure = sketch_measure if sketch_measure in self.measures else None
+        self.n_rows = len(df)
+
+        grouped = df.groupby(self.dims, observed=True, dropna=False, sort=True)
+        codes = grouped.ngroup().to_numpy()
+        n_cells = grouped.ngroups
+        sizes = grouped.size()
+        self.cells = sizes.index.to_frame(index=False)
+        self._rows = sizes.to_numpy()
+
+        self._stats: Dict[str, Dict[str, np.ndarray]] = {}
+        for measure in self.measures:
+            values = df[measure].to_numpy(dtype="float64", na_value=np.nan)
+            valid = ~np.isnan(values)
+            cell, x = codes[valid], values[valid]
+            stats = {
+                "count": np.bincount(cell, minlength=n_cells),
+                "sum": np.bincount(cell, weights=x, minlength=n_cells),
+                "sumsq": np.bincount(cell, weights=x * x, minlength=n_cells),
+                "min": np.full(n_cells, np.inf),
+                "max": np.full(n_cells, -np.inf),
+            }
+            np.minimum.at(stats["min"], cell, x)
+            np.maximum.at(stats["max"], cell, x)
+            self._stats[measure] = stats
+
+            if measure == self.sketch_measure:
+                # Intervalli di uguale popolazione sull'intero dataset: errore uniforme sui quantili
+                edges = np.unique(np.quantile(x, np.linspace(0, 1, bins + 1))) if len(x) else np.array([0.0, 1.0])
+                if len(edges) < 2:
+                    # Un solo valore distinto (una riga o colonna costante): intervallo degenere [v, v]
+                    edges = np.repeat(edges, 2)
+                bin_of = np.clip(np.searchsorted(edges, x, side="right") - 1, 0, max(len(edges) - 2, 0))
+                width = max(len(edges) - 1, 1)
+                self._edges = edges
+                self._hist = np.bincount(cell * width + bin_of, minlength=n_cells * width).reshape(n_cells, width)
+        logger.info(f"Cubo: {self.n_rows} righe -> {n_cells} celle su {', '.join(self.dims)}")
+
+    def select(self, filters: Optional[Dict[str, Optional[Iterable]]] = None) -> np.ndarray:
+        """Maschera delle celle che soddisfano i filtri ({dimensione: valori}); vuoto/None = tutte"""
+        mask = np.ones(len(self.cells), dtype=bool)
+        for dim, values in (filters or {}).items():
+            if values is None or dim not in self.dims:
+                continue
+            values = list(values)
+            if values:
+                mask &= self.cells[dim].isin(values).to_numpy()
+        return mask
+
+    def _quantiles(self, hist: np.ndarray, qs: Sequence[float]) -> np.ndarray:
+        """Quantili approssimati da un istogramma (interpolazione lineare nell'intervallo)"""
+        total = hist.sum()
+        if total == 0:
+            return np.full(len(qs), np.nan)
+        cumulative = np.cumsum(hist)
+        result = []
+        for q in qs:
+            target = q * total
+            i = min(int(np.searchsorted(cumulative, target, side="left")), len(hist) - 1)
+            before = cumulative[i - 1] if i else 0
+            fraction = (target - before) / hist[i] if hist[i] else 0.0
+            result.append(self._edges[i] + fraction * (self._edges[i + 1] - self._edges[i]))
+        return np.array(result)
+
+    def aggregate(self, by: Sequence[str] = (), filters=None, measure: Optional[str] = None,
+                  quantiles: Sequence[float] = ()) -> pd.DataFrame:
+        """
+        Statistiche di `measure` per le dimensioni `by` sulle celle selezionate:
+        count, sum, mean, std, min, max e i quantili richiesti (colonne '25%', '50%', ...).
+        """
+        measure = measure or self.sketch_measure or self.measures[0]
+        by = list(by)
+        mask = self.select(filters)
+        stats = self._stats[measure]
+        cells = pd.DataFrame({name: values[mask] for name, values in stats.items()})
+        if by:
+            keys = self.cells.loc[mask, by].reset_index(drop=True)
+            grouped = pd.concat([keys, cells], axis=1).groupby(by, observed=True, dropna=False, sort=True)
+            result = grouped.agg(count=("count", "sum"), sum=("sum", "sum"), sumsq=("sumsq", "sum"),
+                                 min=("min", "min"), max=("max", "max"))
+            group_codes = grouped.ngroup().to_numpy()
+        else:
+            result = pd.DataFrame({
+                "count": [cells["count"].sum()], "sum": [cells["sum"].sum()], "sumsq": [cells["sumsq"].sum()],
+                "min": [cells["min"].min()], "max": [cells["max"].max()],
+            })
+            group_codes = np.zeros(len(cells), dtype=np.intp)
+
+        count = result["count"].to_numpy(dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result["mean"] = np.where(count > 0, result["sum"] / count, np.nan)
+            variance = (result["sumsq"] - result["sum"] ** 2 / count) / (count - 1)
+            result["std"] = np.where(count > 1, np.sqrt(np.clip(variance, 0, None)), np.nan)
+        result["min"] = result["min"].where(count > 0)
+        result["max"] = result["max"].where(count > 0)
+
+        if quantiles and measure == self.sketch_measure:
+            # Gli istogrammi delle celle si sommano per gruppo (stesso ordine di `result`)
+            hist = np.zeros((len(result), self._hist.shape[1]), dtype=np.int64)
+            np.add.at(hist, group_codes, self._hist[mask])
+            values = np.vstack([self._quantiles(h, quantiles) for h in hist]) if len(hist) else np.empty((0, len(quantiles)))
+            for j, q in enumerate(quantiles):
+                # Lo sketch è approssimato: i quantili restano entro i valori osservati del gruppo
+                result[f"{q:.0%}"] = np.clip(values[:, j], result["min"], result["max"])
+        return result.drop(columns="sumsq")
+
+    def total(self, filters=None, measure: Optional[str] = None) -> float:
+        return float(self.aggregate(filters=filters, measure=measure)["sum"].iloc[0])
+
+    def mean(self, filters=None, measure: Optional[str] = None) -> float:
+        return float(self.aggregate(filters=filters, measure=measure)["mean"].iloc[0])
+
+    def members(self, dim: str, filters=None) -> List:
+        """Valori della dimensione presenti nelle celle selezionate"""
+        mask = self.select(filters)
+        return self.cells.loc[mask, dim].dropna().unique().tolist()
+
+    def count_rows(self, filters=None) -> int:
+        """Numero di righe del dataset nelle celle selezionate"""
+        return int(self._rows[self.select(filters)].sum())
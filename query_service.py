@@ -0,0 +1,278 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+
+from filter_index import FilterIndex
+from reference_data import ReferenceFile
+from schema import compact_dtypes, conform
+from spatial_index import SpatialIndex, with_distance
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Costanti
+DATASET_PATH = os.environ.get("DEPURATORI_DATASET", "depuratori_normalizzati.csv")
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 5000
+RESPONSE_CACHE_SIZE = 1024
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# Parametri di query -> colonne canoniche filtrabili
+FILTERS = {
+    "regione": "regione",
+    "provincia": "Provincia",
+    "comune": "Comune",
+    "tipo": "Tipologia_Impianto",
+    "stato": "Stato_Depuratore",
+}
+# Dimensioni ammesse per gli aggregati
+DIMENSIONS = {"regione": "regione", "provincia": "Provincia", "comune": "Comune", "tipo": "Tipologia_Impianto"}
+MEASURES = ["Numero_AE", "Capacita_Progettuale", "Volume_Trattato", "Fanghi_Prodotti"]
+
+
+class PlantDataset:
+    """
+    Dataset normalizzato dei depuratori caricato una volta e indicizzato in memoria:
+    posting list per i filtri categorici e indice spaziale per bounding box, raggio e
+    vicini più prossimi. Le righe filtrate mantengono l'ordine del file.
+    """
+
+    def __init__(self, path: str):
+        if path.endswith(".parquet"):
+            df = pd.read_parquet(path)
+        else:
+            df = pd.read_csv(path, low_memory=False)
+        # Il file è già nello schema canonico: conform ripristina solo i tipi compatti
+        self.df = compact_dtypes(conform(df, "ckan")).reset_index(drop=True)
+        self.index = FilterIndex(self.df, [col for col in FILTERS.values() if col in self.df.columns])
+        for col in ("LAT", "LON"):
+            if col not in self.df.columns:
+                self.df[col] = np.nan
+        self.spatial = SpatialIndex(self.df)
+        logger.info(f"Dataset {path}: {len(self.df)} righe, {len(self.spatial)} con coordinate")
+
+    def check(self, filters: Dict[str, Optional[Sequence[str]]], dimension: Optional[str] = None):
+        """
+        Filtri e dimensione devono esistere nel dataset caricato: una colonna assente
+        darebbe un risultato vuoto indistinguibile da una selezione senza righe.
+        """
+        if dimension is not None and DIMENSIONS[dimension] not in self.df.columns:
+            raise HTTPException(status_code=404, detail=f"Dimensione non disponibile nel dataset: {dimension}")
+        missing = [name for name, values in filters.items() if values and FILTERS[name] not in self.index]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Filtri non disponibili nel dataset: {', '.join(missing)}")
+
+    def select(self, filters: Dict[str, Optional[Sequence[str]]],
+               bbox: Optional[Tuple[float, float, float, float]] = None) -> np.ndarray:
+        """Posizioni ordinate delle righe che soddisfano filtri ({parametro: valori}) e bbox"""
+        self.check(filters)
+        columns = {FILTERS[name]: values for name, values in filters.items()}
+        positions = self.index.select(columns)
+        if bbox is not None:
+            in_box = self.spatial.bbox(*bbox)
+            positions = in_box if positions is None else np.intersect1d(positions, in_box, assume_unique=True)
+        return np.arange(len(self.df)) if positions is None else positions
+
+    def plants(self, positions: np.ndarray, offset: int, limit: int) -> pd.DataFrame:
+        return self.df.iloc[positions[offset:offset + limit]]
+
+    def near(self, lat: float, lon: float, km: Optional[float], k: int) -> pd.DataFrame:
+        """Depuratori entro `km` dal punto (al più `k`) o, senza raggio, i `k` più vicini"""
+        if km is None:
+            positions, distances = self.spatial.nearest(lat, lon, k)
+        else:
+            positions, distances = self.spatial.within(lat, lon, km)
+            positions, distances = positions[:k], distances[:k]
+        return with_distance(self.df, positions, distances)
+
+    def aggregate(self, dimension: str, positions: np.ndarray) -> pd.DataFrame:
+        """Numero di impianti e somme delle misure per valore della dimensione"""
+        self.check({}, dimension)
+        column = DIMENSIONS[dimension]
+        rows = self.df.iloc[positions]
+        grouped = rows.groupby(column, observed=True)
+        result = grouped.size().rename("impianti").to_frame()
+        measures = [m for m in MEASURES if m in rows.columns]
+        if measures:
+            result = result.join(grouped[measures].sum().astype("float64"))
+        return result.rename_axis(dimension).reset_index().sort_values("impianti", ascending=False, kind="stable")
+
+
+def _encode_json(df: pd.DataFrame, total: int, offset: int, limit: int) -> bytes:
+    items = df.to_json(orient="records", date_format="iso", force_ascii=False)
+    return f'{{"total":{total},"offset":{offset},"limit":{limit},"items":{items}}}'.encode()
+
+
+def _encode_arrow(df: pd.DataFrame) -> bytes:
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+class QueryService:
+    """
+    Risposte del servizio con ETag derivato da versione del dataset e query canonica.
+    I corpi già codificati sono conservati in una cache LRU: le query ripetute non
+    toccano il DataFrame. Se il file cambia, cambia la versione e quindi la chiave.
+    """
+
+    def __init__(self, path: str = DATASET_PATH, cache_size: int = RESPONSE_CACHE_SIZE):
+        self.dataset = ReferenceFile(path, PlantDataset)
+        self.cache_size = cache_size
+        self._responses: "OrderedDict[str, Tuple[bytes, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def current(self) -> Tuple[PlantDataset, str]:
+        dataset = self.dataset.get()
+        if dataset is None:
+            raise HTTPException(status_code=503, detail=f"Dataset non disponibile: {self.dataset.path}")
+        return dataset, self.dataset.version
+
+    def respond(self, request: Request, key: Tuple, fmt: str, build) -> Response:
+        """Risposta (eventualmente 304) per la query `key`; `build(dataset)` produce (corpo, totale)"""
+        dataset, version = self.current()
+        etag = '"' + hashlib.sha1(repr((version, fmt) + key).encode()).hexdigest()[:20] + '"'
+        with self._lock:
+            cached = self._responses.get(etag)
+            if cached is not None:
+                self._responses.move_to_end(etag)
+        if cached is None:
+            cached = build(dataset)
+            with self._lock:
+                self._responses[etag] = cached
+                while len(self._responses) > self.cache_size:
+                    self._responses.popitem(last=False)
+
+        body, total = cached
+        headers = {"ETag": etag, "X-Total-Count": str(total), "Cache-Control": "no-cache"}
+        if etag in {tag.strip() for tag in request.headers.get("if-none-match", "").split(",")}:
+            return Response(status_code=304, headers=headers)
+        media_type = ARROW_MEDIA_TYPE if fmt == "arrow" else "application/json"
+        return Response(content=body, media_type=media_type, headers=headers)
+
+
+def _format(request: Request, fmt: Optional[str]) -> str:
+    if fmt is None:
+        fmt = "arrow" if ARROW_MEDIA_TYPE in request.headers.get("accept", "") else "json"
+    if fmt not in ("json", "arrow"):
+        raise HTTPException(status_code=400, detail="Formato non supportato: usare json o arrow")
+    return fmt
+
+
+def _bbox(value: Optional[str]) -> Optional[Tuple[float, float, float, float]]:
+    """Bounding box 'min_lon,min_lat,max_lon,max_lat'"""
+    if not value:
+        return None
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in value.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox deve essere min_lon,min_lat,max_lon,max_lat")
+    if min_lon > max_lon or min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="bbox con minimi maggiori dei massimi")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def _filters(regione, provincia, comune, tipo, stato) -> Dict[str, Tuple[str, ...]]:
+    values = {"regione": regione, "provincia": provincia, "comune": comune, "tipo": tipo, "stato": stato}
+    # Ordinati: la stessa selezione in ordine diverso condivide ETag e cache
+    return {name: tuple(sorted(v)) for name, v in values.items() if v}
+
+
+service = QueryService()
+app = FastAPI(title="Depuratori - servizio di interrogazione", version="1.0")
+
+
+@app.get("/salute")
+def salute():
+    dataset, version = service.current()
+    return {"versione": version, "righe": len(dataset.df), "ricaricamenti": service.dataset.reloads}
+
+
+@app.get("/depuratori")
+def depuratori(
+    request: Request,
+    regione: Optional[List[str]] = Query(None),
+    provincia: Optional[List[str]] = Query(None),
+    comune: Optional[List[str]] = Query(None),
+    tipo: Optional[List[str]] = Query(None),
+    stato: Optional[List[str]] = Query(None),
+    bbox: Optional[str] = Query(None, description="min_lon,min_lat,max_lon,max_lat"),
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+    format: Optional[str] = Query(None, description="json (default) o arrow"),
+):
+    """Elenco paginato dei depuratori filtrati"""
+    fmt = _format(request, format)
+    filters, box = _filters(regione, provincia, comune, tipo, stato), _bbox(bbox)
+
+    def build(dataset: PlantDataset):
+        positions = dataset.select(filters, box)
+        page = dataset.plants(positions, offset, limit)
+        body = _encode_arrow(page) if fmt == "arrow" else _encode_json(page, len(positions), offset, limit)
+        return body, len(positions)
+
+    return service.respond(request, ("depuratori", tuple(filters.items()), box, limit, offset), fmt, build)
+
+
+@app.get("/aggregati/{dimensione}")
+def aggregati(
+    request: Request,
+    dimensione: str,
+    regione: Optional[List[str]] = Query(None),
+    provincia: Optional[List[str]] = Query(None),
+    comune: Optional[List[str]] = Query(None),
+    tipo: Optional[List[str]] = Query(None),
+    stato: Optional[List[str]] = Query(None),
+    bbox: Optional[str] = Query(None, description="min_lon,min_lat,max_lon,max_lat"),
+    limit: int = Query(MAX_LIMIT, ge=1, le=MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+    format: Optional[str] = Query(None, description="json (default) o arrow"),
+):
+    """Numero di impianti e somme di AE, capacità, volume e fanghi per provincia, comune o tipo"""
+    if dimensione not in DIMENSIONS:
+        raise HTTPException(status_code=404, detail=f"Dimensione non supportata: {dimensione}")
+    fmt = _format(request, format)
+    filters, box = _filters(regione, provincia, comune, tipo, stato), _bbox(bbox)
+
+    def build(dataset: PlantDataset):
+        result = dataset.aggregate(dimensione, dataset.select(filters, box))
+        page = result.iloc[offset:offset + limit]
+        body = _encode_arrow(page) if fmt == "arrow" else _encode_json(page, len(result), offset, limit)
+        return body, len(result)
+
+    return service.respond(request, ("aggregati", dimensione, tuple(filters.items()), box, limit, offset), fmt, build)
+
+
+@app.get("/vicini")
+def vicini(
+    request: Request,
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    km: Optional[float] = Query(None, gt=0, description="Raggio in km; senza raggio i k più vicini"),
+    k: int = Query(10, ge=1, le=MAX_LIMIT),
+    format: Optional[str] = Query(None, description="json (default) o arrow"),
+):
+    """Depuratori più vicini a un punto, ordinati per distanza (colonna Distanza_km)"""
+    fmt = _format(request, format)
+
+    def build(dataset: PlantDataset):
+        result = dataset.near(lat, lon, km, k)
+        body = _encode_arrow(result) if fmt == "arrow" else _encode_json(result, len(result), 0, k)
+        return body, len(result)
+
+    return service.respond(request, ("vicini", lat, lon, km, k), fmt, build)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", "8000")))
@@ -0,0 +1,113 @@
+import hashlib
+import logging
+import os
+import threading
+from typing import Callable, Dict, Generic, Optional, Tuple, TypeVar
+
+import pandas as pd
+
+from coordinate_join import CoordinateIndex
+from schema import rename_columns
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class ReferenceFile(Generic[T]):
+    """
+    File di riferimento (coordinate, archivi ausiliari) letto una volta e tenuto in
+    memoria nella forma indicizzata restituita da `parse`. A ogni accesso si controlla
+    mtime e dimensione; se cambiano si confronta l'hash del contenuto e solo allora si
+    rilegge il file. Durante la rilettura le altre sessioni continuano a usare la
+    versione precedente, che viene sostituita in modo atomico.
+    """
+
+    def __init__(self, path: str, parse: Callable[[str], T]):
+        self.path = path
+        self.parse = parse
+        self._state: Tuple[Optional[Tuple[float, int]], Optional[str], Optional[T]] = (None, None, None)
+        self._reload_lock = threading.Lock()
+        self.reloads = 0
+
+    @property
+    def version(self) -> str:
+        """Hash breve del contenuto caricato ('assente' se il file non esiste)"""
+        self.get()
+        digest = self._state[1]
+        return digest[:12] if digest else "assente"
+
+    def _stat(self) -> Optional[Tuple[float, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _digest(self) -> str:
+        digest = hashlib.sha256()
+        with open(self.path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def get(self) -> Optional[T]:
+        """Contenuto corrente del file; None se il file non esiste"""
+        stamp, digest, value = self._state
+        current = self._stat()
+        if current == stamp and (value is not None or current is None):
+            return value
+
+        # Solo una sessione ricarica; le altre usano la versione già in memoria, se presente
+        if not self._reload_lock.acquire(blocking=value is None):
+            return value
+        try:
+            stamp, digest, value = self._state
+            current = self._stat()
+            if current == stamp and (value is not None or current is None):
+                return value
+            if current is None:
+                if stamp is not None or value is None:
+                    logger.warning(f"File di riferimento non trovato: {self.path}")
+                self._state = (None, None, None)
+                return None
+            new_digest = self._digest()
+            if new_digest != digest or value is None:
+                value = self.parse(self.path)
+                self.reloads += 1
+                logger.info(f"File di riferimento caricato: {self.path} ({new_digest[:12]})")
+            self._state = (current, new_digest, value)
+            return value
+        finally:
+            self._reload_lock.release()
+
+
+def _parse_veneto_coordinates(path: str) -> pd.DataFrame:
+    """Coordinate del Veneto indicizzate per SIT_ID"""
+    df = pd.read_csv(path, usecols=["SIT_ID", "LAT", "LON"])
+    df["SIT_ID"] = pd.to_numeric(df["SIT_ID"], errors="coerce")
+    df = df.dropna(subset=["SIT_ID"]).drop_duplicates("SIT_ID")
+    return df.set_index(df["SIT_ID"].astype("int64"))[["LAT", "LON"]]
+
+
+def _parse_campania_coordinates(path: str) -> CoordinateIndex:
+    """Coordinate della Campania indicizzate per (comune, indirizzo) normalizzati"""
+    return CoordinateIndex(rename_columns(pd.read_csv(path), "campania"), comune_col="Comune", indirizzo_col="Indirizzo")
+
+
+def _parse_stato_archivio(path: str) -> pd.DataFrame:
+    """Stato di aggiornamento dell'archivio per regione"""
+    df = pd.read_csv(path, sep=";")
+    df["Regione"] = df["Regione"].str.strip()
+    return df.set_index("Regione", drop=False)
+
+
+REFERENCE_FILES: Dict[str, ReferenceFile] = {
+    "coordinate_veneto": ReferenceFile("data/depuratori_con_coordinate.csv", _parse_veneto_coordinates),
+    "coordinate_campania": ReferenceFile("data/depuratori_campania_con_coordinate.csv", _parse_campania_coordinates),
+    "stato_archivio": ReferenceFile("data/stato_aggiornamento_archivio.csv", _parse_stato_archivio),
+}
+
+
+def get_reference(name: str) -> ReferenceFile:
+    return REFERENCE_FILES[name]
@@ -0,0 +1,261 @@
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaError(ValueError):
+    """Il file non contiene le colonne obbligatorie dello schema"""
+
+
+@dataclass(frozen=True)
+class Field:
+    name: str
+    dtype: str  # category, string, Int8/Int16/Int32, float32/float64, datetime
+    required: bool = False
+    domain: Optional[Tuple[str, ...]] = None  # Valori ammessi: gli altri diventano mancanti
+    case: Optional[str] = None  # upper/title, applicato prima del controllo del dominio
+
+
+# Schema canonico degli impianti di depurazione (un impianto per riga)
+PLANT_SCHEMA: List[Field] = [
+    Field("ID_Sito", "Int32"),
+    Field("Provincia", "category"),
+    Field("Comune", "category"),
+    Field("Indirizzo", "string"),
+    Field("Nome_Depuratore", "string"),
+    Field("Tipologia_Impianto", "category"),
+    Field("Reflui_Trattati", "category"),
+    Field("Tipo_Scarico", "category"),
+    Field("Tipo_Corpo_Idrico", "category"),
+    Field("Nome_Corpo_Idrico", "string"),
+    Field("Recettore_Finale", "category"),
+    Field("Classificazione_Depuratore", "category"),
+    Field("Numero_AE", "Int32"),
+    Field("Capacita_Progettuale", "float32"),
+    Field("Volume_Trattato", "float32"),
+    Field("Fanghi_Prodotti", "float32"),
+    Field("Stato_Unita_Locale", "category"),
+    Field("Stato_Depuratore", "category"),
+    Field("Stato_Scarico", "category"),
+    Field("Data_Sopralluogo", "datetime"),
+    Field("Prelievo", "category", domain=("SI", "NO"), case="upper"),
+    Field("Riferimento_Normativo", "category"),
+    Field("Esito_Prelievo", "category"),
+    Field("Parametri_Non_Conformi", "string"),
+    Field("Note", "string"),
+    # Le coordinate restano in doppia precisione: servono per join e CSV senza artefatti
+    Field("LAT", "float64"),
+    Field("LON", "float64"),
+]
+
+# Schema delle osservazioni nazionali (un valore per area, tipo di trattamento e anno)
+MEASUREMENT_SCHEMA: List[Field] = [
+    Field("id", "Int32", required=True),
+    Field("area_riferimento", "category", required=True),
+    Field("tipo_trattamento", "Int8", required=True),
+    Field("anno", "Int16", required=True),
+    Field("valore_osservato", "float32", required=True),
+    Field("capacita_progettuale", "float32"),
+]
+
+# Colonne di origine -> nome canonico, per fonte
+SOURCE_MAPPINGS: Dict[str, Dict[str, str]] = {
+    "veneto": {
+        "PROVINCIA": "Provincia",
+        "COMUNE": "Comune",
+        "SIT_ID": "ID_Sito",
+        "DENOMINAZIONE UNITA' LOCALE": "Nome_Depuratore",
+        "TIPO SCARICO": "Tipo_Scarico",
+        "TIPO CORPO IDRICO": "Tipo_Corpo_Idrico",
+        "NOME CORPO IDRICO RECETTORE": "Nome_Corpo_Idrico",
+        "CLASSIFICAZIONE DEPURATORE": "Classificazione_Depuratore",
+        "Numero Ab. Equiv. (AE)": "Numero_AE",
+        "STATO UNITA' LOCALE": "Stato_Unita_Locale",
+        "STATO DEPURATORE": "Stato_Depuratore",
+        "STATO SCARICO": "Stato_Scarico",
+    },
+    "campania": {
+        "PROVINCIA": "Provincia",
+        "COMUNE": "Comune",
+        "INDIRIZZO": "Indirizzo",
+        "Tipologia Impianto": "Tipologia_Impianto",
+        "Reflui Trattati": "Reflui_Trattati",
+        "Potenz. (A.E.)": "Numero_AE",
+        "Corpo  Recettore": "Nome_Corpo_Idrico",
+        "Recettore Finale": "Recettore_Finale",
+        "Data Sopralluogo": "Data_Sopralluogo",
+        "PRELIEVO": "Prelievo",
+        "Riferimento normativo": "Riferimento_Normativo",
+        "Esito Prelievo": "Esito_Prelievo",
+        "Parametri non conformi": "Parametri_Non_Conformi",
+        "NOTE": "Note",
+    },
+    "ckan": {
+        "Denominazione": "Nome_Depuratore",
+        "Comune": "Comune",
+        # Intestazioni del datastore di ARPA Campania, le stesse del file regionale
+        "PROVINCIA": "Provincia",
+        "COMUNE": "Comune",
+        "INDIRIZZO": "Indirizzo",
+        "Tipologia Impianto": "Tipologia_Impianto",
+        "Reflui Trattati": "Reflui_Trattati",
+        "Potenz. (A.E.)": "Numero_AE",
+        "Corpo  Recettore": "Nome_Corpo_Idrico",
+        "Recettore Finale": "Recettore_Finale",
+        "Data Sopralluogo": "Data_Sopralluogo",
+        "PRELIEVO": "Prelievo",
+        "Riferimento normativo": "Riferimento_Normativo",
+        "Esito Prelievo": "Esito_Prelievo",
+        "Parametri non conformi": "Parametri_Non_Conformi",
+        "NOTE": "Note",
+        "Latitudine": "LAT",
+        "Longitudine": "LON",
+        "Potenzialita_Progettuale": "Capacita_Progettuale",
+        "Volume_Trattato": "Volume_Trattato",
+        "Fanghi_Prodotti": "Fanghi_Prodotti",
+        "Stato": "Stato_Depuratore",
+    },
+    "nazionale": {},
+}
+
+SOURCE_SCHEMAS: Dict[str, List[Field]] = {
+    "veneto": PLANT_SCHEMA,
+    "campania": PLANT_SCHEMA,
+    "ckan": PLANT_SCHEMA,
+    "nazionale": MEASUREMENT_SCHEMA,
+}
+
+_INT_RANGES = {"Int8": np.iinfo(np.int8), "Int16": np.iinfo(np.int16), "Int32": np.iinfo(np.int32)}
+
+
+def required_columns(source: str) -> List[str]:
+    """Colonne canoniche obbligatorie per la fonte"""
+    return [f.name for f in SOURCE_SCHEMAS[source] if f.required]
+
+
+def rename_columns(df: pd.DataFrame, source: str) -> pd.DataFrame:
+    """Rinomina le colonne di origine nei nomi canonici, senza conversioni di tipo"""
+    columns = df.columns.str.strip().str.replace('"', '')
+    return df.set_axis(columns, axis=1).rename(columns=SOURCE_MAPPINGS[source])
+
+
+def _cast_text(values: pd.Series, field: Field) -> pd.Series:
+    text = values.astype("string").str.strip()
+    if field.case == "upper":
+        text = text.str.upper()
+    elif field.case == "title":
+        text = text.str.title()
+    return text.astype(object).where(text.notna(), np.nan)
+
+
+def _cast_numeric(values: pd.Series, field: Field) -> pd.Series:
+    if values.dtype == object or pd.api.types.is_string_dtype(values):
+        values = values.astype("string").str.replace(",", "", regex=False).str.strip()
+    numbers = pd.to_numeric(values, errors="coerce")
+    if field.dtype in ("float32", "float64"):
+        return numbers.astype(field.dtype)
+
+    limits = _INT_RANGES[field.dtype]
+    present = numbers.dropna()
+    if ((present % 1 == 0) & present.between(limits.min, limits.max)).all():
+        return numbers.astype(field.dtype)
+    logger.warning(f"{field.name}: valori non interi o fuori scala per {field.dtype}, mantenuto float64")
+    return numbers.astype("float64")
+
+
+def _cast(values: pd.Series, field: Field) -> pd.Series:
+    if field.dtype in ("category", "string"):
+        text = _cast_text(values, field)
+        if field.dtype == "string":
+            return text
+        # Le stringhe vuote non sono una categoria
+        return text.mask(text == "").astype("category")
+    if field.dtype == "datetime":
+        return pd.to_datetime(values, errors="coerce")
+    return _cast_numeric(values, field)
+
+
+def conform(df: pd.DataFrame, source: str, keep_extra: bool = True) -> pd.DataFrame:
+    """
+    Porta un file regionale nello schema canonico in un solo passaggio:
+    rinomina le colonne della fonte, converte ogni colonna nota nel tipo compatto
+    dello schema (category, Int*, float32) e valida dominio e colonne obbligatorie.
+    Il riepilogo della validazione è in df.attrs['schema_report'].
+    """
+    schema = SOURCE_SCHEMAS[source]
+    df = rename_columns(df, source)
+
+    missing = [name for name in required_columns(source) if name not in df.columns]
+    if missing:
+        raise SchemaError(f"Colonne obbligatorie mancanti ({source}): {', '.join(missing)}")
+
+    columns = {}
+    not_converted, out_of_domain = {}, {}
+    for field in schema:
+        if field.name not in df.columns:
+            continue
+        raw = df[field.name]
+        values = _cast(raw, field)
+        if field.domain is not None:
+            outside = values.notna() & ~values.isin(field.domain)
+            if outside.any():
+                out_of_domain[field.name] = int(outside.sum())
+                values = values.mask(outside)
+            if field.dtype == "category":
+                values = values.astype(pd.CategoricalDtype(field.domain))
+        lost = int((raw.notna() & values.isna()).sum()) - out_of_domain.get(field.name, 0)
+        if lost:
+            not_converted[field.name] = lost
+        columns[field.name] = values
+
+    known = [f.name for f in schema if f.name in columns]
+    extra = [c for c in df.columns if c not in columns] if keep_extra else []
+    result = pd.DataFrame(columns, index=df.index)[known]
+    if extra:
+        result = pd.concat([result, df[extra]], axis=1)
+    result.attrs = dict(df.attrs)
+    result.attrs["schema_report"] = {
+        "fonte": source,
+        "colonne_canoniche": len(known),
+        "colonne_extra": extra,
+        "non_convertiti": not_converted,
+        "fuori_dominio": out_of_domain,
+    }
+    logger.info(f"Schema {source}: {len(known)} colonne canoniche, {len(extra)} extra, "
+                f"non convertiti {not_converted or '-'}, fuori dominio {out_of_domain or '-'}")
+    return result
+
+
+
+def compact_dtypes(df: pd.DataFrame, category_ratio: float = 0.5,
+                   keep_float64: Tuple[str, ...] = ("LAT", "LON")) -> pd.DataFrame:
+    """
+    Riduce la memoria del DataFrame caricato: testo ripetuto -> category,
+    float64 -> float32 (tranne le coordinate), interi -> il tipo più piccolo.
+    Il confronto della memoria prima/dopo è in df.attrs['memory_report'].
+    """
+    before = int(df.memory_usage(deep=True).sum())
+    for col in df.columns:
+        values = df[col]
+        if values.dtype == object:
+            # Solo colonne di sole stringhe con valori ripetuti: category non conviene per testo libero
+            if (pd.api.types.infer_dtype(values, skipna=True) == "string"
+                    and values.nunique() <= category_ratio * len(values)):
+                df[col] = values.astype("category")
+        elif values.dtype == "float64" and col not in keep_float64:
+            df[col] = values.astype("float32")
+        elif pd.api.types.is_integer_dtype(values) and not isinstance(values.dtype, pd.api.extensions.ExtensionDtype):
+            df[col] = pd.to_numeric(values, downcast="integer")
+    after = int(df.memory_usage(deep=True).sum())
+    df.attrs["memory_report"] = {
+        "prima_mb": round(before / 2**20, 3),
+        "dopo_mb": round(after / 2**20, 3),
+        "riduzione": round(before / after, 1) if after else None,
+    }
+    logger.info(f"Memoria del dataset: {before / 2**20:.2f} MB -> {after / 2**20:.2f} MB")
+    return df
@@ -0,0 +1,93 @@
+import logging
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+logger = logging.getLogger(__name__)
+
+# Raggio terrestre medio usato per convertire le distanze angolari
+EARTH_RADIUS_KM = 6371.0088
+
+
+class SpatialIndex:
+    """
+    Indice spaziale sulle coordinate di un dataset, costruito una volta per versione.
+    Le query per raggio e per vicini più prossimi usano una BallTree con metrica
+    haversine; le query su bounding box usano le coordinate ordinate per latitudine.
+    Tutte le query restituiscono posizioni di riga del DataFrame indicizzato (iloc).
+    """
+
+    def __init__(self, df: pd.DataFrame, lat_col: str = "LAT", lon_col: str = "LON", leaf_size: int = 40):
+        lat = pd.to_numeric(df[lat_col], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        lon = pd.to_numeric(df[lon_col], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        self.positions = np.flatnonzero(~np.isnan(lat) & ~np.isnan(lon))
+        # Senza coordinate non si costruisce l'albero (BallTree rifiuta zero punti): query vuote
+        self._tree = BallTree(np.radians(np.column_stack([lat[self.positions], lon[self.positions]])),
+                              leaf_size=leaf_size, metric="haversine") if len(self.positions) else None
+
+        by_lat = np.argsort(lat[self.positions], kind="stable")
+        self._by_lat = self.positions[by_lat]
+        self._lat = lat[self._by_lat]
+        self._lon = lon[self._by_lat]
+        logger.info(f"Indice spaziale: {len(self.positions)} punti su {len(df)} righe")
+
+    def __len__(self):
+        return len(self.positions)
+
+    def bbox(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> np.ndarray:
+        """Posizioni ordinate delle righe dentro il rettangolo (estremi inclusi)"""
+        if not len(self):
+            return np.empty(0, dtype=np.intp)
+        start = np.searchsorted(self._lat, min_lat, side="left")
+        stop = np.searchsorted(self._lat, max_lat, side="right")
+        lon = self._lon[start:stop]
+        return np.sort(self._by_lat[start:stop][(lon >= min_lon) & (lon <= max_lon)])
+
+    def within(self, lat, lon, km: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Righe entro `km` chilometri da uno o più punti; con più punti conta la
+        distanza dal più vicino. Restituisce (posizioni, distanze in km) per distanza crescente.
+        """
+        points = self._points(lat, lon)
+        if not len(self) or not len(points):
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        found, distances = self._tree.query_radius(points, r=km / EARTH_RADIUS_KM, return_distance=True)
+        idx = np.concatenate(found)
+        dist = np.concatenate(distances) * EARTH_RADIUS_KM
+        # Per ogni riga si tiene la distanza minima tra i punti di partenza
+        order = np.lexsort((dist, idx))
+        idx, dist = idx[order], dist[order]
+        first = np.r_[True, idx[1:] != idx[:-1]]
+        idx, dist = idx[first], dist[first]
+        by_distance = np.argsort(dist, kind="stable")
+        return self.positions[idx[by_distance]], dist[by_distance]
+
+    def nearest(self, lat: float, lon: float, k: int = 5) -> Tuple[np.ndarray, np.ndarray]:
+        """Le `k` righe più vicine al punto: (posizioni, distanze in km) per distanza crescente"""
+        k = min(k, len(self))
+        points = self._points(lat, lon)
+        # Indice vuoto o punto senza coordinate: nessun vicino, come in within
+        if k <= 0 or not len(points):
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        distances, found = self._tree.query(points[:1], k=k)
+        return self.positions[found[0]], distances[0] * EARTH_RADIUS_KM
+
+    @staticmethod
+    def _points(lat, lon) -> np.ndarray:
+        lat = np.atleast_1d(np.asarray(lat, dtype="float64"))
+        lon = np.atleast_1d(np.asarray(lon, dtype="float64"))
+        valid = ~np.isnan(lat) & ~np.isnan(lon)
+        return np.radians(np.column_stack([lat[valid], lon[valid]]))
+
+
+def with_distance(df: pd.DataFrame, positions: np.ndarray, distances: np.ndarray,
+                  exclude: Optional[Sequence[int]] = None) -> pd.DataFrame:
+    """Righe di `df` alle posizioni date con la colonna Distanza_km, esclusi eventuali punti di partenza"""
+    if exclude is not None and len(exclude):
+        keep = ~np.isin(positions, exclude)
+        positions, distances = positions[keep], distances[keep]
+    result = df.iloc[positions].copy()
+    result.insert(0, "Distanza_km", np.round(distances, 2))
+    return result
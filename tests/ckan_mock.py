@@ -0,0 +1,115 @@
+"""Server CKAN simulato in locale (http.server in un thread) per i test di raccolta e sincronizzazione."""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+BASE = "/api/3/action/"
+ACTION = BASE + "datastore_search"
+
+
+def make_records(n, prefix, start=0):
+    return [
+        {"_id": i + 1, "Denominazione": f"{prefix}-{i}", "Comune": f"Comune {i % 7}",
+         "Latitudine": 40 + i / 10000, "Longitudine": 14 + i / 10000, "Potenzialita_Progettuale": i}
+        for i in range(start, start + n)
+    ]
+
+
+class MockCkan:
+    """
+    Risorse CKAN in memoria, con datastore_search, datastore_search_sql e resource_show.
+    Per ogni risorsa:
+    - records: elenco dei record
+    - links: True per indicare la pagina successiva in _links.next, False per il solo offset
+    - fail_at: offset a cui rispondere 404 (interruzione a metà paginazione)
+    - flaky: numero di risposte 503 prima di rispondere correttamente (per i retry)
+    - delay: secondi di attesa per pagina (per verificare la concorrenza)
+    - total: totale dichiarato, se diverso dal numero di record
+    - last_modified: data restituita da resource_show
+    """
+
+    def __init__(self, resources):
+        self.resources = resources
+        self.requests = []  # (resource_id, offset, istante) delle richieste a datastore_search
+        self.calls = []     # (azione, resource_id) di tutte le richieste
+        self.lock = threading.Lock()
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                action = parsed.path[len(BASE):] if parsed.path.startswith(BASE) else parsed.path
+                query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                if action == "datastore_search_sql":
+                    return self._search_sql(query["sql"])
+                resource_id = query.get("resource_id", query.get("id"))
+                offset = int(query.get("offset", 0))
+                limit = int(query.get("limit", 100))
+                resource = mock.resources.get(resource_id)
+                with mock.lock:
+                    mock.calls.append((action, resource_id))
+                    if action == "datastore_search":
+                        mock.requests.append((resource_id, offset, time.monotonic()))
+                    flaky = resource is not None and resource.get("flaky", 0) > 0
+                    if flaky:
+                        resource["flaky"] -= 1
+                if resource is None or action not in ("datastore_search", "resource_show"):
+                    return self._send(404, {"success": False})
+                if flaky:
+                    return self._send(503, {"success": False})
+                if action == "resource_show":
+                    return self._send(200, {"success": True, "result": {
+                        "id": resource_id, "last_modified": resource.get("last_modified")}})
+                if resource.get("fail_at") is not None and offset >= resource["fail_at"]:
+                    return self._send(404, {"success": False})
+                time.sleep(resource.get("delay", 0))
+
+                records = resource["records"]
+                result = {"records": records[offset:offset + limit], "total": resource.get("total", len(records))}
+                if resource.get("links"):
+                    next_query = urlencode({"resource_id": resource_id, "limit": limit, "offset": offset + limit})
+                    result["_links"] = {"start": f"{ACTION}?{parsed.query}", "next": f"{ACTION}?{next_query}"}
+                self._send(200, {"success": True, "result": result})
+
+            def _search_sql(self, sql):
+                # Solo la forma usata da ckan_sync: WHERE _id > N ORDER BY _id LIMIT M
+                resource_id = re.search(r'FROM "([^"]+)"', sql).group(1)
+                last_id = int(re.search(r"_id > (\d+)", sql).group(1))
+                limit = int(re.search(r"LIMIT (\d+)", sql).group(1))
+                with mock.lock:
+                    mock.calls.append(("datastore_search_sql", resource_id))
+                resource = mock.resources.get(resource_id)
+                if resource is None:
+                    return self._send(404, {"success": False})
+                records = sorted((r for r in resource["records"] if r["_id"] > last_id), key=lambda r: r["_id"])
+                self._send(200, {"success": True, "result": {"records": records[:limit]}})
+
+            def _send(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}{ACTION}"
+
+    def source(self, resource_id, nome=None, **options):
+        return {"nome": nome or resource_id, "url": self.url, "resource_id": resource_id, **options}
+
+    def requests_for(self, resource_id):
+        return [r for r in self.requests if r[0] == resource_id]
+
+    def actions_for(self, resource_id):
+        return [action for action, rid in self.calls if rid == resource_id]
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+# I moduli del progetto sono file al livello principale del repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def ckan():
+    """Avvia server CKAN simulati (tests/ckan_mock.py) e li arresta a fine test"""
+    from ckan_mock import MockCkan
+
+    servers = []
+
+    def start(resources):
+        server = MockCkan(resources)
+        server.thread.start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.server.shutdown()
+        server.server.server_close()
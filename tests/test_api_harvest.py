@@ -0,0 +1,80 @@
+"""Raccolta CKAN di api.py contro un server CKAN simulato in locale (http.server in un thread)."""
+import time
+
+import pandas as pd
+import pytest
+
+import api
+from ckan_mock import make_records
+
+
+@pytest.mark.parametrize("links", [True, False], ids=["links_next", "offset"])
+def test_iter_pages_reads_all_pages(ckan, links):
+    server = ckan({"r": {"records": make_records(2500, "r"), "links": links}})
+    pages = list(api.iter_pages(api.create_session(), server.source("r"), page_size=1000))
+
+    assert [len(p) for p in pages] == [1000, 1000, 500]
+    assert [r["_id"] for p in pages for r in p] == list(range(1, 2501))
+    assert [offset for _, offset, _ in server.requests_for("r")] == [0, 1000, 2000]
+
+
+def test_harvest_merges_parallel_sources(ckan, tmp_path):
+    server = ckan({
+        "a": {"records": make_records(1500, "a"), "links": True, "delay": 0.3},
+        "b": {"records": make_records(1200, "b"), "links": False, "delay": 0.3},
+    })
+    output = tmp_path / "out.csv"
+    start = time.perf_counter()
+    rows = api.harvest([server.source("a", "Fonte A"), server.source("b", "Fonte B")],
+                       output_file=str(output), page_size=500)
+    elapsed = time.perf_counter() - start
+
+    df = pd.read_csv(output)
+    assert rows == len(df) == 2700
+    assert df["Fonte"].value_counts().to_dict() == {"Fonte A": 1500, "Fonte B": 1200}
+    # Tre pagine per fonte da 0,3 s: in sequenza sarebbero circa 1,8 s
+    assert elapsed < 1.5
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_retry_with_backoff_on_transient_errors(ckan):
+    server = ckan({"r": {"records": make_records(300, "r"), "flaky": 2}})
+    session = api.create_session(retries=3, backoff=0.2)
+    pages = list(api.iter_pages(session, server.source("r"), page_size=1000))
+
+    assert sum(len(p) for p in pages) == 300
+    times = [t for _, _, t in server.requests_for("r")]
+    assert len(times) == 3
+    # Attesa crescente tra i tentativi (backoff esponenziale di urllib3)
+    assert times[2] - times[1] >= 0.3
+
+
+def test_retries_exhausted_raise(ckan):
+    server = ckan({"r": {"records": make_records(300, "r"), "flaky": 10}})
+    with pytest.raises(api.HarvestError):
+        list(api.iter_pages(api.create_session(retries=1, backoff=0), server.source("r")))
+
+
+@pytest.mark.parametrize("links", [True, False], ids=["links_next", "offset"])
+def test_failure_mid_pagination_keeps_existing_output(ckan, tmp_path, links):
+    server = ckan({
+        "ok": {"records": make_records(800, "ok")},
+        "broken": {"records": make_records(2500, "broken"), "links": links, "fail_at": 1000},
+    })
+    output = tmp_path / "out.csv"
+    output.write_text("contenuto precedente\n")
+
+    with pytest.raises(api.HarvestError, match="broken"):
+        api.harvest([server.source("ok"), server.source("broken")], output_file=str(output), page_size=1000)
+
+    assert output.read_text() == "contenuto precedente\n"
+    assert not list(tmp_path.glob("*.part"))
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_short_read_against_total_raises(ckan):
+    # La risorsa dichiara più record di quanti ne restituisca
+    server = ckan({"r": {"records": make_records(1500, "r"), "total": 2000}})
+
+    with pytest.raises(api.HarvestError, match="1500 record su 2000"):
+        list(api.iter_pages(api.create_session(), server.source("r"), page_size=1000))
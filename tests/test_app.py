@@ -0,0 +1,33 @@
+import io
+import os
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.chdir(ROOT)  # indice dei centroidi in data/
+    import app
+    # Nessuna chiamata di rete per le aree assenti dall'indice
+    monkeypatch.setattr(app.DataProcessor, "geocode_location", staticmethod(lambda location: (45.4375, 12.3358)))
+    return app
+
+
+def test_national_coordinates_are_double_precision(app):
+    csv = io.StringIO(
+        "id,area_riferimento,tipo_trattamento,anno,valore_osservato\n"
+        "1,AGROPOLI,1,2022,100\n"
+        "2,AIROLA,2,2022,200\n"
+        "3,VENEZIA,3,2023,300\n"
+    )
+    df = app.DataProcessor._build(csv)
+
+    assert df["LAT"].dtype == "float64" and df["LON"].dtype == "float64"
+    by_area = df.set_index("area_riferimento")
+    # Centroidi dall'indice offline, VENEZIA dal geocoder
+    assert by_area.loc["AGROPOLI", "LAT"] == pytest.approx(40.3469, abs=1e-4)
+    assert by_area.loc["VENEZIA", ["LAT", "LON"]].tolist() == [45.4375, 12.3358]
+    assert by_area["tipo_trattamento_desc"].tolist() == ["Primario", "Secondario", "Terziario"]
@@ -0,0 +1,98 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from batch_geocoding import BatchGeocoder, GeocodingProvider, OfflineProvider, TokenBucket
+from geocoding_cache import GeocodingCache
+
+COORDINATES = {"Via Roma 1, Napoli": (40.85, 14.27), "Salerno": (40.68, 14.77)}
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=20.0, capacity=1.0)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # Il primo token è disponibile subito, i successivi uno ogni 1/20 di secondo
+    assert time.monotonic() - start >= 5 / 20 * 0.9
+
+
+def test_token_bucket_penalize_and_reward():
+    bucket = TokenBucket(rate=8.0)
+    bucket.penalize()
+    bucket.penalize()
+    assert bucket.rate == 2.0
+    for _ in range(100):
+        bucket.reward()
+    assert bucket.rate == 8.0
+
+
+def test_identical_queries_resolved_once():
+    provider = OfflineProvider(COORDINATES, latency=0.05)
+    geocoder = BatchGeocoder(provider, max_workers=8)
+    results = geocoder.geocode_batch(["via roma 1,  napoli"] * 8 + ["Via Roma 1, Napoli"])
+
+    assert len(provider.calls) == 1
+    assert all((r.lat, r.lon) == (40.85, 14.27) for r in results)
+
+
+def test_fallback_and_cache_write_through(tmp_path):
+    cache = GeocodingCache(str(tmp_path / "cache.sqlite"))
+    provider = OfflineProvider(COORDINATES)
+    results = BatchGeocoder(provider, cache).geocode_batch([["Via Ignota 3, Salerno", "Salerno"]])
+
+    assert (results[0].lat, results[0].lon, results[0].query) == (40.68, 14.77, "Salerno")
+    assert cache.get("Salerno") == (40.68, 14.77)
+    assert cache.get("Via Ignota 3, Salerno") == (None, None)
+
+    # Secondo batch: tutto dalla cache, nessuna chiamata al provider
+    again = OfflineProvider(COORDINATES)
+    results = BatchGeocoder(again, cache).geocode_batch([["Via Ignota 3, Salerno", "Salerno"]])
+    assert again.calls == [] and results[0].from_cache
+
+
+def test_timeouts_are_retried_and_not_cached(tmp_path):
+    cache = GeocodingCache(str(tmp_path / "cache.sqlite"))
+    provider = OfflineProvider(COORDINATES, timeouts={"Salerno": 1, "Via Roma 1, Napoli": 5})
+    geocoder = BatchGeocoder(provider, cache, max_retries=2, backoff=0.01)
+    salerno, napoli = geocoder.geocode_batch(["Salerno", "Via Roma 1, Napoli"])
+
+    assert salerno.found and not napoli.found
+    assert geocoder.stats["timeouts"] == 1 + 3
+    assert cache.get("Via Roma 1, Napoli") is None
+
+
+def test_owner_failure_propagates_to_waiters():
+    class ReadOnlyCache:
+        def set(self, query, lat, lon):
+            raise sqlite3.OperationalError("attempt to write a readonly database")
+
+    provider = OfflineProvider(COORDINATES, latency=0.05)
+    geocoder = BatchGeocoder(provider, ReadOnlyCache(), max_workers=4)
+    errors = []
+
+    def run():
+        try:
+            geocoder._resolve("Salerno", {})
+        except sqlite3.OperationalError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, daemon=True) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=2)
+
+    # Una sola chiamata; chi attendeva la stessa query riceve l'errore invece di bloccarsi
+    assert not any(thread.is_alive() for thread in threads)
+    assert len(provider.calls) == 1 and len(errors) == 4
+
+
+def test_provider_must_implement_geocode():
+    class Incomplete(GeocodingProvider):
+        name = "incompleto"
+
+    with pytest.raises(TypeError):
+        Incomplete()
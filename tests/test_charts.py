@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+import charts
+
+
+def test_box_whiskers_stop_at_most_extreme_value_within_fences():
+    df = pd.DataFrame({
+        "Provincia": pd.Categorical(["VR"] * 8 + ["PD"] * 4 + ["RO"]),
+        "Numero_AE": [1, 2, 3, 4, 5, 6, 7, 100, 10, 11, 12, np.nan, np.nan],
+    })
+    stats = charts.box_stats(df, "Provincia", "Numero_AE")
+
+    # Per VR: q1 = 2,75 e q3 = 6,25, limite superiore 11,5; il baffo si ferma a 7, non a 11,5
+    assert stats.loc["VR", ["lowerfence", "upperfence"]].tolist() == [1.0, 7.0]
+    assert stats.loc["PD", ["lowerfence", "upperfence"]].tolist() == [10.0, 12.0]
+    assert "RO" not in stats.index
+
+    outliers = charts.box_outliers(df, "Provincia", "Numero_AE", stats)
+    assert outliers["Numero_AE"].tolist() == [100.0]
+
+    fig = charts.figure("box", df, "Provincia", "AE per Provincia", value="Numero_AE")
+    box, points = fig.data
+    assert list(box.upperfence) == stats["upperfence"].tolist()
+    assert list(points.x) == ["VR"] and list(points.y) == [100.0]
+
+
+def test_box_with_dataframe_in_attrs():
+    df = pd.DataFrame({"Provincia": ["VR", "VR", "PD", "PD"], "Numero_AE": [100, 200, 300, None]})
+    df.attrs["geocoding_report"] = pd.DataFrame({"Comune": ["Verona"], "Trovato": [True]})
+
+    fig = charts.figure("box", df, "Provincia", "AE per Provincia", value="Numero_AE")
+    assert list(fig.data[0].x) == ["PD", "VR"]
+    assert list(fig.data[0].median) == [300.0, 150.0]
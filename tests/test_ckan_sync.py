@@ -0,0 +1,113 @@
+"""Sincronizzazione incrementale di ckan_sync.py contro il server CKAN simulato."""
+import pandas as pd
+import pytest
+
+import ckan_sync
+from ckan_mock import make_records
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return {"output_file": str(tmp_path / "depuratori.csv"), "state_path": str(tmp_path / "stato.sqlite")}
+
+
+def _stored(paths):
+    df = pd.read_csv(paths["output_file"])
+    return df.set_index(["Fonte", "_id"]).sort_index()
+
+
+def test_first_sync_downloads_everything(ckan, paths):
+    server = ckan({"r": {"records": make_records(250, "r"), "last_modified": "2024-01-01T00:00:00"}})
+    summary = ckan_sync.sync([server.source("r", "Fonte R")], page_size=100, **paths)
+
+    assert summary == {"fonti_invariate": 0, "upsert": 250, "eliminati": 0, "errori": 0}
+    stored = _stored(paths)
+    assert len(stored) == 250 and stored.loc[("Fonte R", 1), "Nome_Depuratore"] == "r-0"
+    assert ckan_sync.SyncState(paths["state_path"]).source("Fonte R")["last_id"] == 250
+
+
+def test_unchanged_resource_is_skipped(ckan, paths):
+    server = ckan({"r": {"records": make_records(250, "r"), "last_modified": "2024-01-01T00:00:00"}})
+    ckan_sync.sync([server.source("r")], page_size=100, **paths)
+    before = open(paths["output_file"]).read()
+    searches = len(server.requests_for("r"))
+
+    summary = ckan_sync.sync([server.source("r")], page_size=100, **paths)
+
+    assert summary["fonti_invariate"] == 1 and summary["upsert"] == 0
+    # Solo resource_show: nessuna pagina scaricata e dataset invariato
+    assert len(server.requests_for("r")) == searches
+    assert server.actions_for("r")[-1] == "resource_show"
+    assert open(paths["output_file"]).read() == before
+
+
+def test_changed_and_new_records_are_upserted(ckan, paths):
+    resource = {"records": make_records(250, "r"), "last_modified": "2024-01-01T00:00:00"}
+    server = ckan({"r": resource, "s": {"records": make_records(30, "s")}})
+    sources = [server.source("r", "Fonte R"), server.source("s", "Fonte S")]
+    ckan_sync.sync(sources, page_size=100, **paths)
+
+    resource["records"][9]["Denominazione"] = "rinominato"
+    resource["records"] += make_records(5, "r", start=250)
+    resource["last_modified"] = "2024-02-01T00:00:00"
+    summary = ckan_sync.sync(sources, page_size=100, **paths)
+
+    # Fonte S non ha last_modified: viene riletta ma nessun record risulta cambiato
+    assert summary["upsert"] == 6 and summary["eliminati"] == 0
+    stored = _stored(paths)
+    assert len(stored) == 285 and stored.index.is_unique
+    assert stored.loc[("Fonte R", 10), "Nome_Depuratore"] == "rinominato"
+    assert stored.loc[("Fonte R", 255), "Nome_Depuratore"] == "r-254"
+
+
+def test_deleted_records_become_tombstones(ckan, paths):
+    resource = {"records": make_records(100, "r"), "last_modified": "1"}
+    server = ckan({"r": resource})
+    ckan_sync.sync([server.source("r")], page_size=40, **paths)
+
+    removed = resource["records"].pop(41)
+    resource["last_modified"] = "2"
+    summary = ckan_sync.sync([server.source("r")], page_size=40, **paths)
+
+    state = ckan_sync.SyncState(paths["state_path"])
+    assert summary["eliminati"] == 1
+    assert state.tombstones("r")["_id"].tolist() == [42]
+    assert 42 not in state.hashes("r").index
+    assert len(_stored(paths)) == 99 and ("r", 42) not in _stored(paths).index
+
+    # Il record ricompare: torna nel dataset e la tombstone viene rimossa
+    resource["records"].insert(41, removed)
+    resource["last_modified"] = "3"
+    ckan_sync.sync([server.source("r")], page_size=40, **paths)
+    assert state.tombstones("r").empty and len(_stored(paths)) == 100
+
+
+def test_append_only_source_reads_new_ids(ckan, paths):
+    resource = {"records": make_records(120, "r"), "last_modified": "1"}
+    server = ckan({"r": resource})
+    source = server.source("r", append_only=True)
+    ckan_sync.sync([source], page_size=50, **paths)
+
+    resource["records"] += make_records(30, "r", start=120)
+    resource["last_modified"] = "2"
+    summary = ckan_sync.sync([source], page_size=50, **paths)
+
+    assert summary["upsert"] == 30
+    assert server.actions_for("r").count("datastore_search_sql") == 1
+    assert len(_stored(paths)) == 150
+    assert ckan_sync.SyncState(paths["state_path"]).source("r")["last_id"] == 150
+
+
+def test_failed_source_keeps_its_state(ckan, paths):
+    resource = {"records": make_records(100, "r"), "last_modified": "1"}
+    server = ckan({"r": resource, "ok": {"records": make_records(10, "ok")}})
+    ckan_sync.sync([server.source("r")], page_size=40, **paths)
+
+    resource["records"][0]["Denominazione"] = "modificato"
+    resource["last_modified"] = "2"
+    resource["fail_at"] = 40
+    summary = ckan_sync.sync([server.source("r"), server.source("ok")], page_size=40, **paths)
+
+    assert summary["errori"] == 1 and summary["upsert"] == 10
+    assert ckan_sync.SyncState(paths["state_path"]).source("r")["last_modified"] == "1"
+    assert _stored(paths).loc[("r", 1), "Nome_Depuratore"] == "r-0"
@@ -0,0 +1,82 @@
+"""Normalizzazione a blocchi confrontata con l'implementazione precedente (tutto il file in memoria)."""
+import os
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from clean_normalize import normalize_dataset
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CAMPANIA = os.path.join(ROOT, "data/Elenco_impianti_depurazione_Campania_agg_gen2024.csv")
+
+
+def normalize_reference(input_file, output_file):
+    """Implementazione precedente di clean_normalize.normalize_dataset, usata come riferimento"""
+    df = pd.read_csv(input_file, encoding='utf-8', dtype=str)
+    df.columns = df.columns.str.strip().str.replace('"', '')
+    df = df.apply(lambda x: x.str.strip().str.replace('""', '"') if x.dtype == "object" else x)
+    df = df.drop_duplicates()
+    df = df.dropna(how='all')
+    if 'Numero Ab. Equiv. (AE)' in df.columns:
+        df['Numero Ab. Equiv. (AE)'] = pd.to_numeric(
+            df['Numero Ab. Equiv. (AE)'].str.replace(',', ''), errors='coerce'
+        )
+    for col in ['SIT_ID', 'Numero Ab. Equiv. (AE)']:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    for col in ['TIPO SCARICO', 'TIPO CORPO IDRICO', 'CLASSIFICAZIONE DEPURATORE',
+                'STATO UNITA\' LOCALE', 'STATO DEPURATORE', 'STATO SCARICO']:
+        if col in df.columns:
+            df[col] = df[col].str.title()
+    df.to_csv(output_file, index=False, encoding='utf-8')
+
+
+@pytest.fixture
+def veneto_csv(tmp_path):
+    """File in stile Veneto con duplicati a distanza (in blocchi diversi) e varianti che non sono duplicati"""
+    header = ' "SIT_ID" ,COMUNE,Numero Ab. Equiv. (AE),STATO DEPURATORE,TIPO SCARICO,NOTE\n'
+    rows = [
+        '1,Belluno,"1,200",ATTIVO,acque superficiali,"Vasca ""A"""',
+        '2,Feltre, 800 ,attivo,SUOLO,',
+        '1,Belluno,"1,200",ATTIVO,acque superficiali,"Vasca ""A"""',
+        '3,Padova,1200,Attivo,acque superficiali,',
+        ',,,,,',
+        '4,Rovigo,n.d.,in costruzione,,',
+        '1,Belluno,1200,Attivo,acque superficiali,"Vasca ""A"""',
+        '"1,005",Adria,50,ATTIVO,SUOLO,',
+        ' 2 ,Feltre,800,attivo,SUOLO,',
+        ',,,,,',
+        '3,Padova,1200,Attivo,acque superficiali,',
+    ]
+    path = tmp_path / "veneto.csv"
+    path.write_text(header + "\n".join(rows * 3) + "\n", encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("chunksize", [1, 4, 7, 50000])
+def test_campania_output_matches_reference(tmp_path, chunksize):
+    normalize_reference(CAMPANIA, tmp_path / "riferimento.csv")
+    rows = normalize_dataset(CAMPANIA, str(tmp_path / "blocchi.csv"), chunksize=chunksize)
+
+    assert (tmp_path / "blocchi.csv").read_bytes() == (tmp_path / "riferimento.csv").read_bytes()
+    assert rows == len(pd.read_csv(tmp_path / "riferimento.csv"))
+
+
+@pytest.mark.parametrize("chunksize", [1, 2, 5, 50000])
+def test_duplicates_across_chunks_match_reference(veneto_csv, tmp_path, chunksize):
+    normalize_reference(veneto_csv, tmp_path / "riferimento.csv")
+    rows = normalize_dataset(veneto_csv, str(tmp_path / "blocchi.csv"), chunksize=chunksize)
+
+    assert (tmp_path / "blocchi.csv").read_text() == (tmp_path / "riferimento.csv").read_text()
+    assert rows == 6
+
+
+def test_parquet_output_matches_reference(veneto_csv, tmp_path):
+    normalize_reference(veneto_csv, tmp_path / "riferimento.csv")
+    normalize_dataset(veneto_csv, str(tmp_path / "blocchi.parquet"), chunksize=3, output_format="parquet")
+
+    table = pq.read_table(tmp_path / "blocchi.parquet")
+    assert str(table.schema.field("SIT_ID").type) == "double"
+    assert str(table.schema.field("COMUNE").type) == "string"
+    assert table.to_pandas().to_csv(index=False) == (tmp_path / "riferimento.csv").read_text()
@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+
+from clustering import ClusterModel
+
+
+def test_fit_without_usable_rows_returns_empty_model():
+    df = pd.DataFrame({"Numero_AE": [np.nan, 500.0], "LAT": [45.1, np.nan], "LON": [11.2, 12.0]})
+    model = ClusterModel(n_clusters=3).fit(df)
+
+    assert model.model is None and len(model.labels_) == 0 and model.index_.empty
+    assert model.predict(df).tolist() == [-1, -1]
+    assert model.update(df).tolist() == [-1, -1]
+
+
+def test_predict_assigns_new_rows_to_trained_clusters():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "Numero_AE": np.r_[rng.integers(50, 200, 20), rng.integers(50000, 90000, 20)].astype(float),
+        "LAT": rng.uniform(45, 46, 40), "LON": rng.uniform(11, 12, 40),
+    })
+    model = ClusterModel(n_clusters=2).fit(df)
+
+    assert len(model.labels_) == 40
+    assert (model.predict(df).to_numpy() == model.labels_).all()
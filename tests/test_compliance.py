@@ -0,0 +1,28 @@
+import pandas as pd
+
+from compliance import ComplianceEngine, parse_parameters
+
+
+def test_parse_parameters_normalises_aliases():
+    matrix, parameters = parse_parameters(pd.Series([
+        "ECOTOX", "Saggio di tossicità acuta con D. Magna, Escherichiacoli", "/", None, "BOD5 , COD e BOD",
+    ]))
+    assert parameters == ["BOD5", "COD", "Ecotossicità", "Escherichia coli"]
+    assert matrix.toarray().sum(axis=1).tolist() == [1, 2, 0, 0, 2]
+
+
+def test_problem_plants_one_row_per_plant():
+    df = pd.DataFrame({
+        "Provincia": ["NA", "NA", "NA", "SA"],
+        "Comune": ["NAPOLI", "Napoli ", "NAPOLI", "SALERNO"],
+        "Indirizzo": ["Via Roma", "via roma", "Via Roma", "Via Po"],
+        "Data_Sopralluogo": pd.to_datetime(["2024-01-10", "2024-02-10", "2024-03-10", "2024-01-15"]),
+        "Esito_Prelievo": ["Non Conforme", "Conforme", "Non Conforme", "Non Conforme"],
+        "Parametri_Non_Conformi": ["COD", "/", "COD, BOD5", "Escherichia coli"],
+    })
+    plants = ComplianceEngine(df).problem_plants()
+
+    assert len(plants) == 2 and plants.index.is_unique
+    napoli = plants[plants["Comune"].str.upper().str.strip() == "NAPOLI"].iloc[0]
+    assert (napoli["Prelievi"], napoli["Non_Conformi"], napoli["Parametri"]) == (3, 2, 2)
+    assert napoli["Tasso"] == 0.67
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from comuni_centroids import ComuneCentroidIndex, build_centroid_index
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / "centroidi.parquet")
+    build_centroid_index([pd.DataFrame({
+        "COMUNE": ["Napoli", "NAPOLI", "San Marco", "San Marco", "Forlì", None],
+        "PROVINCIA": ["NA", "na", "CE", "SA", "FC", "NA"],
+        "LAT": [40.84, 40.86, 41.10, 40.30, 44.22, 41.0],
+        "LON": [14.24, 14.26, 14.10, 15.20, 12.04, 14.0],
+    })], path)
+    return ComuneCentroidIndex(path)
+
+
+def test_build_averages_per_comune_and_provincia(index, tmp_path):
+    data = pd.read_parquet(tmp_path / "centroidi.parquet")
+
+    assert len(index) == 4
+    napoli = data[data["comune_key"] == "napoli"].iloc[0]
+    assert (napoli["COMUNE"], napoli["provincia_key"]) == ("Napoli", "na")
+    assert napoli["LAT"] == pytest.approx(40.85, abs=1e-4)
+    assert data["LAT"].dtype == "float32"
+
+
+def test_first_source_takes_precedence(tmp_path):
+    istat = pd.DataFrame({"COMUNE": ["Napoli"], "PROVINCIA": ["NA"], "LAT": [40.85], "LON": [14.27]})
+    impianti = pd.DataFrame({
+        "COMUNE": ["NAPOLI", "Caserta"], "PROVINCIA": ["na", "CE"], "LAT": [41.5, 41.07], "LON": [15.0, 14.33],
+    })
+    data = build_centroid_index([istat, impianti], str(tmp_path / "c.parquet")).set_index("comune_key")
+
+    # Le fonti successive non modificano i comuni già presenti, ma aggiungono i nuovi
+    assert data.loc["napoli", "LAT"] == pytest.approx(40.85, abs=1e-4)
+    assert data.loc["caserta", "LAT"] == pytest.approx(41.07, abs=1e-4)
+
+
+def test_lookup_with_and_without_provincia(index):
+    comuni = pd.Series(["napoli ", "San Marco", "San Marco", "FORLI", "Ignoto", None], index=list("abcdef"))
+    province = pd.Series(["NA", "SA", None, "FC", "NA", None], index=comuni.index)
+
+    # Senza provincia un nome presente in più province è ambiguo
+    by_comune = index.lookup(comuni)
+    assert by_comune.index.tolist() == list("abcdef")
+    assert by_comune.loc["a", "LAT"] == pytest.approx(40.85, abs=1e-4)
+    assert by_comune.loc["d", "LON"] == pytest.approx(12.04, abs=1e-4)
+    assert by_comune.loc[["b", "c", "e", "f"]].isna().all(axis=None)
+
+    with_provincia = index.lookup(comuni, province)
+    assert with_provincia.loc["b", "LAT"] == pytest.approx(40.30, abs=1e-4)
+    assert with_provincia.loc[["c", "e", "f"]].isna().all(axis=None)
+
+
+def test_fill_missing_only_fills_missing_rows(index):
+    df = pd.DataFrame({
+        "COMUNE": ["Napoli", "San Marco", "Napoli", "Ignoto"],
+        "PROVINCIA": ["NA", "CE", "NA", "NA"],
+        "LAT": [np.nan, np.nan, 1.0, np.nan],
+        "LON": [np.nan, np.nan, 2.0, np.nan],
+    }, index=[10, 20, 30, 40])
+    df, filled = index.fill_missing(df, "COMUNE", "PROVINCIA")
+
+    assert filled == 2
+    assert df["LAT"].dtype == "float64" and df["LON"].dtype == "float64"
+    assert df.loc[10, "LAT"] == pytest.approx(40.85, abs=1e-4)
+    assert df.loc[20, "LON"] == pytest.approx(14.10, abs=1e-4)
+    assert df.loc[30, ["LAT", "LON"]].tolist() == [1.0, 2.0]
+    assert df.loc[40, ["LAT", "LON"]].isna().all()
+
+
+def test_fill_missing_adds_coordinate_columns(index):
+    df, filled = index.fill_missing(pd.DataFrame({"COMUNE": ["Forlì", "Ignoto"]}), "COMUNE")
+
+    assert filled == 1
+    assert df["LAT"].iloc[0] == pytest.approx(44.22, abs=1e-4) and np.isnan(df["LAT"].iloc[1])
+
+
+def test_missing_index_file(tmp_path):
+    index = ComuneCentroidIndex(str(tmp_path / "assente.parquet"))
+    df = pd.DataFrame({"COMUNE": ["Napoli"], "LAT": [np.nan], "LON": [np.nan]})
+
+    assert len(index) == 0
+    assert index.fill_missing(df, "COMUNE")[1] == 0
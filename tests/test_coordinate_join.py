@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from coordinate_join import CoordinateIndex, join_coordinates
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COORDINATE = pd.DataFrame({
+    "COMUNE": ["Napoli", "napoli", "Napoli", "Salerno", "Salerno", "Avellino"],
+    "INDIRIZZO": ["Via Roma 1", "VIA ROMA, 1", "Via Toledo 5", "Via Porto", "Via Mare", "Via Nuova"],
+    "LAT": [40.80, 40.90, 40.84, 40.60, 40.70, "n.d."],
+    "LON": [14.20, 14.30, 14.25, 14.70, 14.80, 14.79],
+})
+
+
+def test_one_output_row_per_input_row():
+    impianti = pd.DataFrame({
+        "COMUNE": ["NAPOLI", "Napoli", "Salerno", "Caserta", None, "Avellino"],
+        "INDIRIZZO": ["via roma 1", "Via Sconosciuta", "Via Porto", "Via Roma 1", "Via Roma 1", "Via Nuova"],
+        "LAT": [0.0] * 6,
+        "Nome": list("abcdef"),
+    }, index=[5, 4, 3, 2, 1, 0])
+    result, report = join_coordinates(impianti, COORDINATE)
+
+    assert len(result) == len(impianti) and result.index.tolist() == [5, 4, 3, 2, 1, 0]
+    assert result["Nome"].tolist() == list("abcdef")
+    # Chiave (comune, indirizzo) duplicata: vale la prima coordinata
+    assert result.loc[5, ["LAT", "LON"]].tolist() == [40.80, 14.20]
+    # Indirizzo sconosciuto: centroide delle coordinate note del comune
+    assert result.loc[4, "LAT"] == pytest.approx((40.80 + 40.90 + 40.84) / 3)
+    assert result.loc[3, ["LAT", "LON"]].tolist() == [40.60, 14.70]
+    # Comune assente o coordinate non numeriche: nessuna coordinata
+    assert result.loc[[2, 1, 0], ["LAT", "LON"]].isna().all(axis=None)
+    assert report == {
+        "righe_input": 6, "righe_output": 6, "per_indirizzo": 2, "per_comune": 1,
+        "senza_coordinate": 3, "chiavi_duplicate_scartate": 1,
+    }
+
+
+def test_join_without_address_column_uses_comune():
+    index = CoordinateIndex(COORDINATE)
+    result, report = index.join(pd.DataFrame({"COMUNE": ["Salerno", "Benevento"]}))
+
+    assert result["LAT"].iloc[0] == pytest.approx(40.65)
+    assert np.isnan(result["LAT"].iloc[1])
+    assert (report["per_indirizzo"], report["per_comune"]) == (0, 1)
+
+
+def test_index_is_reusable_across_joins():
+    index = CoordinateIndex(COORDINATE)
+    first, _ = index.join(pd.DataFrame({"COMUNE": ["Napoli"], "INDIRIZZO": ["Via Toledo 5"]}))
+    second, _ = index.join(pd.DataFrame({"COMUNE": ["Salerno"], "INDIRIZZO": ["Via Mare"]}))
+
+    assert first[["LAT", "LON"]].iloc[0].tolist() == [40.84, 14.25]
+    assert second[["LAT", "LON"]].iloc[0].tolist() == [40.70, 14.80]
+
+
+def test_campania_join_keeps_row_count():
+    impianti = pd.read_csv(os.path.join(ROOT, "data/Elenco_impianti_depurazione_Campania_normalizzato.csv"))
+    coordinate = pd.read_csv(os.path.join(ROOT, "data/depuratori_campania_con_coordinate.csv"))
+    result, report = join_coordinates(impianti, coordinate)
+
+    assert len(result) == report["righe_output"] == len(impianti)
+    assert report["per_indirizzo"] + report["per_comune"] + report["senza_coordinate"] == len(impianti)
+    assert report["per_indirizzo"] > 0
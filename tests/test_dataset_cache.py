@@ -0,0 +1,85 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataset_cache import DatasetCache
+
+
+def _frame(rows=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "LAT": rng.uniform(45, 46, rows),
+        "Numero_AE": pd.array(rng.integers(10, 10000, rows), dtype="Int32"),
+        "Provincia": pd.Categorical(rng.choice(["VR", "PD"], rows)),
+        "Comune": rng.choice(["Verona", "Padova"], rows).astype(object),
+    })
+
+
+def test_eviction_by_byte_budget():
+    size = int(_frame().memory_usage(deep=True).sum())
+    cache = DatasetCache(max_bytes=int(size * 2.5))
+    for key in ("a", "b"):
+        cache.put(key, _frame())
+    cache.get("a")  # "a" diventa il più recente: si scarta "b"
+    cache.put("c", _frame())
+
+    assert cache.get("b") is None and cache.get("a") is not None and cache.get("c") is not None
+    assert cache.nbytes == 2 * size <= cache.max_bytes
+    assert cache.stats["evictions"] == 1
+
+
+def test_dataset_over_budget_is_not_kept():
+    cache = DatasetCache(max_bytes=1024)
+    df = cache.get_or_load("grande", lambda: _frame())
+
+    assert len(df) == 1000 and len(cache) == 0 and cache.nbytes == 0
+
+
+def test_concurrent_sessions_load_once():
+    cache = DatasetCache()
+    calls = []
+
+    def loader():
+        calls.append(threading.get_ident())
+        time.sleep(0.1)
+        return _frame()
+
+    results = [None] * 8
+
+    def session(i):
+        results[i] = cache.get_or_load("veneto", loader)
+
+    threads = [threading.Thread(target=session, args=(i,), daemon=True) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert len(calls) == 1 and cache.stats["misses"] == 1
+    # Stessi dati per tutte le sessioni, senza copie
+    assert all(np.shares_memory(r["LAT"].to_numpy(), results[0]["LAT"].to_numpy()) for r in results)
+
+
+@pytest.mark.parametrize("column, value", [("LAT", 0.0), ("Numero_AE", 1), ("Provincia", "PD"), ("Comune", "Rovigo")])
+def test_shared_frames_are_read_only(column, value):
+    cache = DatasetCache()
+    first = cache.get_or_load("veneto", _frame)
+    before = first[column].iloc[0]
+
+    with pytest.raises((ValueError, AssertionError)):
+        first.loc[0, column] = value
+    assert cache.get("veneto")[column].iloc[0] == before
+
+
+def test_column_and_attrs_changes_stay_in_the_session():
+    cache = DatasetCache()
+    session = cache.get_or_load("veneto", _frame)
+    session["LAT"] = 0.0
+    session["Nuova"] = 1
+    session.attrs["dataset_key"] = "modificato"
+
+    other = cache.get("veneto")
+    assert other["LAT"].min() > 45 and "Nuova" not in other.columns and "dataset_key" not in other.attrs
@@ -0,0 +1,82 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataset_store import DatasetStore, content_hash
+
+
+@pytest.fixture
+def frame():
+    df = pd.DataFrame({
+        "Numero_AE": pd.array([1200, None, 300], dtype="Int32"),
+        "Volume": np.array([1.5, 2.5, 3.5], dtype="float32"),
+        "LAT": [45.1, np.nan, 45.3],
+        "anno": np.array([2022, 2023, 2023], dtype="int16"),
+        "Provincia": pd.Categorical(["VR", "PD", "VR"]),
+        "Indirizzo": pd.array(["Via Roma", None, "Via Po"], dtype="string"),
+        "Note": ["a", "b", "c"],
+        "Data": pd.to_datetime(["2024-01-10", None, "2024-03-01"]),
+    })
+    df.attrs = {
+        "schema_report": {"fonte": "veneto", "non_convertiti": {"Numero_AE": 1}},
+        "geocoding_report": pd.DataFrame({"Comune": ["Verona"], "Trovato": [True]}),
+    }
+    return df
+
+
+def test_round_trip_keeps_dtypes_and_attrs(tmp_path, frame):
+    store = DatasetStore(str(tmp_path))
+    store.save("chiave", frame)
+    loaded = store.load("chiave")
+
+    pd.testing.assert_frame_equal(loaded, frame)
+    assert loaded.attrs["schema_report"] == frame.attrs["schema_report"]
+    pd.testing.assert_frame_equal(loaded.attrs["geocoding_report"], frame.attrs["geocoding_report"])
+
+
+def test_numeric_columns_are_read_from_the_memory_map(tmp_path, frame):
+    store = DatasetStore(str(tmp_path))
+    store.save("chiave", frame)
+    loaded = store.load("chiave")
+
+    # Senza mancanti la colonna punta alle pagine mappate (sola lettura); con mancanti viene convertita
+    assert not loaded["Volume"].to_numpy().flags.writeable
+    assert not loaded["anno"].to_numpy().flags.writeable
+    assert loaded["LAT"].to_numpy().flags.writeable
+
+
+def test_mixed_object_columns_are_saved_as_text(tmp_path):
+    store = DatasetStore(str(tmp_path))
+    store.save("misto", pd.DataFrame({"codice": ["A1", 7, None]}))
+
+    assert store.load("misto")["codice"].tolist() == ["A1", "7", None]
+
+
+def test_get_or_build_builds_once_per_content(tmp_path, frame):
+    store = DatasetStore(str(tmp_path))
+    calls = []
+
+    def build(source):
+        calls.append(source.getvalue())
+        return frame.copy()
+
+    first = store.get_or_build(io.BytesIO(b"a;b\n1;2\n"), "veneto", 3, build)
+    again = store.get_or_build(io.BytesIO(b"a;b\n1;2\n"), "veneto", 3, build)
+    other = store.get_or_build(io.BytesIO(b"a;b\n1;3\n"), "veneto", 3, build)
+
+    assert len(calls) == 2
+    assert first.attrs["dataset_key"] == again.attrs["dataset_key"] != other.attrs["dataset_key"]
+    assert first.attrs["dataset_key"] == "veneto-v3-" + content_hash(io.BytesIO(b"a;b\n1;2\n"))
+    pd.testing.assert_frame_equal(again, frame)
+
+
+def test_unreadable_file_is_rebuilt(tmp_path, frame):
+    store = DatasetStore(str(tmp_path))
+    with open(store.path_for("rotto"), "wb") as f:
+        f.write(b"non arrow")
+
+    assert store.load("rotto") is None
+    assert store.get_or_build(io.BytesIO(b"x"), "veneto", 1, lambda s: frame.copy(), key="rotto") is not None
+    assert store.load("rotto") is not None
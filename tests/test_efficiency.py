@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from bench_efficiency import efficiency_lambda, make_dataset
+from efficiency import compute_efficiency
+
+
+def _yoy_reference(df):
+    """Variazione annua calcolata serie per serie, come riferimento"""
+    result = pd.Series(np.nan, index=df.index)
+    for _, serie in df.groupby(["area_riferimento", "tipo_trattamento"]):
+        totals = serie.groupby("anno")["valore_osservato"].sum()
+        for anno, rows in serie.groupby("anno").groups.items():
+            if anno - 1 in totals.index and totals[anno - 1] > 0:
+                result[rows] = round((totals[anno] / totals[anno - 1] - 1) * 100, 2)
+    return result
+
+
+def test_efficiency_matches_groupwise_lambda():
+    df = make_dataset(5000, n_areas=50, n_years=5)
+    expected = efficiency_lambda(df)
+    result = compute_efficiency(df.copy(), series_cols=(), capacity_col=None)
+
+    pd.testing.assert_series_equal(result["EFFICIENCY"], expected, check_names=False)
+    assert "YOY_CHANGE" not in result and "CAPACITY_EFFICIENCY" not in result
+
+
+def test_yoy_change_matches_per_series_reference():
+    df = make_dataset(3000, n_areas=20, n_years=4, seed=7)
+    # Un anno mancante interrompe la serie: nessuna variazione per l'anno successivo
+    df = df[~((df["area_riferimento"] == "Area 3") & (df["anno"] == 2016))]
+    result = compute_efficiency(df.copy())
+
+    pd.testing.assert_series_equal(result["YOY_CHANGE"], _yoy_reference(df), check_names=False)
+    assert result.loc[(df["area_riferimento"] == "Area 3") & (df["anno"] == 2017), "YOY_CHANGE"].isna().all()
+    assert result.loc[df["anno"] == 2015, "YOY_CHANGE"].isna().all()
+
+
+def test_zero_and_missing_values():
+    df = pd.DataFrame({
+        "area_riferimento": ["A", "A", "B", "B", "C"],
+        "tipo_trattamento": [1, 1, 1, 1, 1],
+        "anno": [2022, 2023, 2022, 2023, 2022],
+        "valore_osservato": [0.0, 50.0, 40.0, np.nan, 10.0],
+        "capacita_progettuale": [100, 200, "n.d.", 0, 20],
+    })
+    result = compute_efficiency(df)
+
+    # Massimo del gruppo nullo: efficienza non definita invece di una divisione per zero
+    assert np.isnan(result["EFFICIENCY"].iloc[0])
+    assert result["EFFICIENCY"].iloc[[1, 2, 4]].tolist() == [100.0, 100.0, 100.0]
+    assert np.isnan(result["EFFICIENCY"].iloc[3])
+    assert result["CAPACITY_EFFICIENCY"].iloc[[0, 1, 4]].tolist() == [0.0, 25.0, 50.0]
+    assert result["CAPACITY_EFFICIENCY"].iloc[[2, 3]].isna().all()
+    # Totale precedente nullo: variazione non definita; i mancanti contano come zero nel totale
+    assert np.isnan(result["YOY_CHANGE"].iloc[1])
+    assert result["YOY_CHANGE"].iloc[3] == pytest.approx(-100.0)
+
+
+def test_custom_columns():
+    df = pd.DataFrame({"regione": ["X", "X", "Y"], "anno": [2020, 2020, 2020], "v": [5.0, 10.0, 3.0]})
+    result = compute_efficiency(df, group_cols=["regione"], value_col="v", series_cols=(), capacity_col=None)
+
+    assert result["EFFICIENCY"].tolist() == [50.0, 100.0, 100.0]
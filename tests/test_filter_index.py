@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from filter_index import FilterIndex
+
+COLUMNS = ["Provincia", "Stato", "anno"]
+
+
+@pytest.fixture
+def df():
+    rng = np.random.default_rng(0)
+    n = 5000
+    frame = pd.DataFrame({
+        "Provincia": pd.Categorical(rng.choice(["VR", "PD", "VI", "TV", None], n)),
+        "Stato": rng.choice(["Attivo", "Dismesso", "In costruzione"], n).astype(object),
+        "anno": rng.choice([2020, 2021, 2022, 2023], n),
+        "valore": rng.random(n),
+    })
+    frame.loc[::97, "Stato"] = np.nan
+    return frame
+
+
+@pytest.mark.parametrize("filters", [
+    {"Provincia": ["VR"]},
+    {"Provincia": ["VR", "PD"], "Stato": ["Attivo"]},
+    {"Provincia": ["VI"], "Stato": ["Dismesso", "In costruzione"], "anno": [2021, 2023]},
+    {"Provincia": ["XX"], "anno": [2022]},
+    {"Provincia": [], "Stato": None, "anno": [2020]},
+])
+def test_select_and_apply_match_boolean_mask(df, filters):
+    index = FilterIndex(df, COLUMNS)
+    mask = np.ones(len(df), dtype=bool)
+    for col, values in filters.items():
+        if values:
+            mask &= df[col].isin(values).to_numpy()
+
+    assert index.select(filters).tolist() == np.flatnonzero(mask).tolist()
+    pd.testing.assert_frame_equal(index.apply(df, filters), df[mask])
+    pd.testing.assert_frame_equal(index.apply(df, filters, columns=["anno", "valore"]), df.loc[mask, ["anno", "valore"]])
+
+
+def test_options_are_sorted_without_missing(df):
+    index = FilterIndex(df, COLUMNS + ["assente"])
+
+    assert index.options("Provincia") == ["PD", "TV", "VI", "VR"]
+    assert index.options("Stato") == ["Attivo", "Dismesso", "In costruzione"]
+    assert "assente" not in index and index.options("assente") == []
+
+
+def test_no_active_filter_returns_frame_itself(df):
+    index = FilterIndex(df, COLUMNS)
+
+    assert index.select({"Provincia": None}) is None
+    assert index.apply(df, {"Provincia": []}) is df
+
+
+def test_contiguous_selection_is_a_slice():
+    df = pd.DataFrame({"anno": [2020] * 3 + [2021] * 4 + [2022] * 3, "valore": np.arange(10.0)})
+    filtered = FilterIndex(df, ["anno"]).apply(df, {"anno": [2021]})
+
+    assert filtered["valore"].tolist() == [3.0, 4.0, 5.0, 6.0]
+    assert np.shares_memory(filtered["valore"].to_numpy(), df["valore"].to_numpy())
@@ -0,0 +1,115 @@
+import pandas as pd
+import pytest
+
+from geocoding_cache import GeocodingCache, get_geocoding_cache, normalize_keys, normalize_query
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return GeocodingCache(str(tmp_path / "cache.sqlite"))
+
+
+def test_normalize_query():
+    assert normalize_query("  Sant'Agnello, (NA) ") == "sant agnello na"
+    assert normalize_query("CASTEL SAN GIORGIO") == normalize_query("castel  san giorgio")
+    assert normalize_query("Forlì") == normalize_query("Forli")
+
+
+def test_normalize_keys_matches_normalize_query():
+    values = pd.Series(["Forlì", None, "forli", "Napoli", "Forlì"], index=[5, 6, 7, 8, 9])
+    keys = normalize_keys(values)
+
+    assert keys.index.tolist() == values.index.tolist()
+    assert keys.tolist() == ["forli", "", "forli", "napoli", "forli"]
+
+
+def test_get_and_set_use_normalised_keys(cache):
+    assert cache.get("Napoli") is None
+    cache.set("Napoli", 40.85, 14.27)
+    cache.set("Comune senza risultato", None, None)
+
+    assert cache.get(" NAPOLI ") == (40.85, 14.27)
+    assert cache.get("comune senza risultato") == (None, None)
+    assert cache.get_many(["Napoli", "Salerno", "Comune senza risultato"]) == {
+        "napoli": (40.85, 14.27), "comune senza risultato": (None, None),
+    }
+    assert cache.get_many([]) == {}
+
+
+def test_cache_is_shared_on_disk(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    GeocodingCache(path).set("Salerno", 40.68, 14.77)
+
+    assert GeocodingCache(path).get("Salerno") == (40.68, 14.77)
+
+
+def test_get_many_beyond_parameter_batch(cache):
+    cache.set_many({f"Comune {i}": (40.0 + i / 1000, 14.0) for i in range(1200)})
+
+    found = cache.get_many(f"Comune {i}" for i in range(1300))
+    assert len(found) == 1200
+    assert found["comune 1199"] == (41.199, 14.0)
+
+
+def test_lookup_resolves_only_once(cache):
+    calls = []
+
+    def resolver(query):
+        calls.append(query)
+        return (41.0, 14.5) if query == "Caserta" else (None, None)
+
+    assert cache.lookup("Caserta", resolver) == (41.0, 14.5)
+    assert cache.lookup("caserta", resolver) == (41.0, 14.5)
+    # Anche i negativi restano in cache finché non scadono
+    assert cache.lookup("Ignoto", resolver) == (None, None)
+    assert cache.lookup("Ignoto", resolver) == (None, None)
+    assert calls == ["Caserta", "Ignoto"]
+
+
+def test_resolver_errors_are_not_cached(cache):
+    def failing(query):
+        raise TimeoutError("servizio non disponibile")
+
+    with pytest.raises(TimeoutError):
+        cache.lookup("Avellino", failing)
+    assert cache.get("Avellino") is None
+    assert cache.lookup("Avellino", lambda q: (40.91, 14.79)) == (40.91, 14.79)
+
+
+def test_negative_results_expire(tmp_path, monkeypatch):
+    cache = GeocodingCache(str(tmp_path / "cache.sqlite"), negative_ttl=60)
+    clock = [1000.0]
+    monkeypatch.setattr("geocoding_cache.time.time", lambda: clock[0])
+    cache.set("Ignoto", None, None)
+    cache.set("Benevento", 41.13, 14.78)
+
+    clock[0] += 30
+    assert cache.get("Ignoto") == (None, None)
+    assert cache.purge_expired() == 0
+
+    # Scaduto il TTL il negativo viene ritentato; i positivi non scadono
+    clock[0] += 60
+    assert cache.get("Ignoto") is None
+    assert cache.get("Benevento") == (41.13, 14.78)
+    calls = []
+    assert cache.lookup("Ignoto", lambda q: calls.append(q) or (41.5, 14.0)) == (41.5, 14.0)
+    assert calls == ["Ignoto"]
+
+
+def test_purge_expired_removes_only_stale_negatives(tmp_path, monkeypatch):
+    cache = GeocodingCache(str(tmp_path / "cache.sqlite"), negative_ttl=60)
+    clock = [1000.0]
+    monkeypatch.setattr("geocoding_cache.time.time", lambda: clock[0])
+    cache.set_many({"A": (None, None), "B": (None, None), "C": (40.0, 14.0)})
+    clock[0] += 120
+    cache.set("D", None, None)
+
+    assert cache.purge_expired() == 2
+    assert cache.get_many(["A", "B", "C", "D"]) == {"c": (40.0, 14.0), "d": (None, None)}
+
+
+def test_shared_instance_per_path(tmp_path):
+    first = get_geocoding_cache(str(tmp_path / "a.sqlite"))
+
+    assert get_geocoding_cache(str(tmp_path / "a.sqlite")) is first
+    assert get_geocoding_cache(str(tmp_path / "b.sqlite")) is not first
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from inspection_store import KEY_COLUMN, InspectionStore, plant_keys
+
+SOPRALLUOGHI = pd.DataFrame({
+    "Provincia": ["NA", "NA", "SA", "NA", "SA", "AV", "NA"],
+    "Comune": ["Napoli", "NAPOLI ", "Salerno", "Napoli", "Salerno", "Avellino", "Pozzuoli"],
+    "Indirizzo": ["Via Roma 1", "via roma, 1", "Via Porto", "Via Roma 1", "Via Porto", "Via Nuova", "Via Lago"],
+    "Data_Sopralluogo": ["2023-05-01", "2024-02-10", "2023-11-20", None, "2022-01-15", "2024-03-01", None],
+    "Esito_Prelievo": ["Conforme", "Non conforme", "Conforme", "Conforme", "Non conforme", "Conforme", "Conforme"],
+})
+
+
+@pytest.fixture
+def store():
+    return InspectionStore(SOPRALLUOGHI)
+
+
+def test_plant_keys_are_stable_and_normalised():
+    keys = plant_keys(SOPRALLUOGHI)
+
+    assert keys.name == KEY_COLUMN and keys.str.match(r"^DEP-[0-9a-f]{10}$").all()
+    # Stesso impianto con maiuscole, spazi e punteggiatura diversi
+    assert keys[0] == keys[1] == keys[3]
+    assert keys[2] == keys[4] and keys.nunique() == 4
+    # La chiave non dipende dall'ordine delle righe né dalle altre righe del file
+    shuffled = SOPRALLUOGHI.iloc[::-1]
+    assert plant_keys(shuffled).tolist() == keys.iloc[::-1].tolist()
+    assert plant_keys(SOPRALLUOGHI.iloc[[2]]).iloc[0] == keys[2]
+
+
+def test_latest_matches_groupwise_reference(store):
+    latest = store.latest().set_index(KEY_COLUMN)
+    reference = SOPRALLUOGHI.assign(**{KEY_COLUMN: plant_keys(SOPRALLUOGHI)})
+    reference["Data_Sopralluogo"] = pd.to_datetime(reference["Data_Sopralluogo"])
+    dated = reference.dropna(subset=["Data_Sopralluogo"])
+    expected = dated.loc[dated.groupby(KEY_COLUMN)["Data_Sopralluogo"].idxmax()].set_index(KEY_COLUMN)
+
+    assert store.n_plants == len(latest) == 4 and len(store) == 7
+    assert latest.loc[expected.index, "Esito_Prelievo"].tolist() == expected["Esito_Prelievo"].tolist()
+    napoli = latest.loc[plant_keys(SOPRALLUOGHI)[0]]
+    assert (napoli["N_Sopralluoghi"], napoli["Ultimo_Sopralluogo"]) == (3, pd.Timestamp("2024-02-10"))
+    assert napoli["Primo_Sopralluogo"] == pd.Timestamp("2023-05-01")
+    # Impianto con soli sopralluoghi senza data: compare con date mancanti
+    pozzuoli = latest.loc[plant_keys(SOPRALLUOGHI)[6]]
+    assert pd.isna(pozzuoli["Ultimo_Sopralluogo"]) and pd.isna(pozzuoli["Primo_Sopralluogo"])
+    assert store.latest() is store.latest()
+
+
+def test_as_of(store):
+    keys = plant_keys(SOPRALLUOGHI)
+    state = store.as_of("2023-12-31").set_index(KEY_COLUMN)
+
+    assert sorted(state.index) == sorted([keys[0], keys[2]])
+    assert state.loc[keys[0], "Ultimo_Sopralluogo"] == pd.Timestamp("2023-05-01")
+    assert state.loc[keys[2], "Esito_Prelievo"] == "Conforme"
+    assert store.as_of("2021-01-01").empty
+    assert len(store.as_of("2030-01-01")) == 3
+
+
+def test_between(store):
+    period = store.between("2023-01-01", "2023-12-31")
+
+    assert period["Data_Sopralluogo"].tolist() == ["2023-05-01", "2023-11-20"]
+    assert len(store.between(start="2024-01-01")) == 2
+    assert len(store.between()) == 5
+
+
+def test_per_period(store):
+    yearly = store.per_period("Y")
+
+    assert yearly.index.astype(str).tolist() == ["2022", "2023", "2024"]
+    assert yearly["sopralluoghi"].tolist() == [1, 2, 2]
+    assert yearly["impianti"].tolist() == [1, 2, 2]
+
+
+def test_history(store):
+    key = plant_keys(SOPRALLUOGHI)[0]
+    history = store.history(key)
+
+    # Dal più vecchio; i sopralluoghi senza data in testa
+    assert (history[KEY_COLUMN] == key).all()
+    assert history["Data_Sopralluogo"].tolist() == [None, "2023-05-01", "2024-02-10"]
+    assert store.history("DEP-inesistente").empty
+
+
+def test_without_dates_or_rows():
+    store = InspectionStore(SOPRALLUOGHI.drop(columns="Data_Sopralluogo"))
+    assert store.n_plants == 4 and store.between().empty
+    assert store.latest()["Ultimo_Sopralluogo"].isna().all()
+
+    empty = InspectionStore(SOPRALLUOGHI.iloc[0:0])
+    assert len(empty) == 0 and empty.latest().empty and empty.as_of("2024-01-01").empty
+    assert np.size(empty.keys) == 0
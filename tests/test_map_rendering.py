@@ -0,0 +1,57 @@
+import folium
+import numpy as np
+import pandas as pd
+from folium import plugins
+
+from map_rendering import FAST_MAP_THRESHOLD, add_cell_markers, add_fast_markers, use_fast_rendering
+
+
+def _plants(n):
+    return pd.DataFrame({"LAT": np.linspace(40, 41, n), "LON": np.linspace(14, 15, n)})
+
+
+def test_fast_rendering_threshold():
+    assert not use_fast_rendering(_plants(FAST_MAP_THRESHOLD))
+    assert use_fast_rendering(_plants(FAST_MAP_THRESHOLD + 1))
+    assert use_fast_rendering(_plants(11), threshold=10)
+
+
+def test_fast_markers_skip_invalid_coordinates():
+    df = pd.DataFrame({
+        "LAT": [40.1234567, np.nan, 95.0, "41.5", 40.9],
+        "LON": [14.2, 14.3, 14.4, "n.d.", 14.6],
+        "Nome": [" Impianto A ", "B", "C", "D", "E <Sud>"],
+        "AE": [12000.0, 1.0, 2.0, 3.0, 1500.5],
+        "Stato": ["Attivo", "x", "y", "z", None],
+    })
+    m = folium.Map()
+    cluster = add_fast_markers(m, df, {"Abitanti equivalenti": "AE", "Stato": "Stato"}, title_col="Nome", color="red")
+
+    assert isinstance(cluster, plugins.FastMarkerCluster)
+    # Righe con coordinate mancanti, non numeriche o fuori intervallo vengono scartate
+    assert cluster.data == [
+        [40.123457, 14.2, "Impianto A", "12,000", "Attivo"],
+        [40.9, 14.6, "E <Sud>", "1,500.50", ""],
+    ]
+    html = m.get_root().render()
+    assert '["Abitanti equivalenti", "Stato"]' in html
+    assert "var hasTitle = true" in html and "fillColor: 'red'" in html
+
+
+def test_fast_markers_without_title_or_valid_rows():
+    df = pd.DataFrame({"LAT": [np.nan], "LON": [np.nan], "Comune": ["Napoli"]})
+    cluster = add_fast_markers(folium.Map(), df, {"Comune": "Comune"})
+
+    assert cluster.data == []
+    assert "var hasTitle = false" in cluster._parent.get_root().render()
+
+
+def test_cell_markers_scale_with_count():
+    cells = pd.DataFrame({"LAT": [40.0, 41.0], "LON": [14.0, 15.0], "count": [100, 25], "valore": [5000.0, 800.0]})
+    group = folium.FeatureGroup()
+    add_cell_markers(group, cells, value_label="AE")
+
+    markers = list(group._children.values())
+    assert [marker.options["radius"] for marker in markers] == [30.0, 19.0]
+    add_cell_markers(group, cells.iloc[:0])
+    assert len(group._children) == 2
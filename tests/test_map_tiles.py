@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from map_tiles import ITALY_BOUNDS, TileEngine, bounds_from_leaflet, cell_size
+
+
+@pytest.fixture
+def plants():
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({
+        "LAT": rng.uniform(40, 42, 5000),
+        "LON": rng.uniform(13, 16, 5000),
+        "AE": rng.integers(100, 10000, 5000).astype(float),
+    })
+    df.loc[::100, "LON"] = np.nan
+    return df
+
+
+def test_bounds_from_leaflet():
+    bounds = {"_southWest": {"lat": 40.1, "lng": 13.2}, "_northEast": {"lat": 41.3, "lng": 15.4}}
+
+    assert bounds_from_leaflet(bounds) == (40.1, 13.2, 41.3, 15.4)
+    assert bounds_from_leaflet(None) is None
+    assert bounds_from_leaflet({"_southWest": {"lat": 40.1}}) is None
+
+
+def test_cell_size_halves_per_zoom_level():
+    assert cell_size(4) == 2 * cell_size(5)
+    assert cell_size(0, cell_pixels=256) == 360.0
+
+
+def test_low_zoom_returns_clusters_conserving_totals(plants):
+    engine = TileEngine(plants, value_col="AE", max_points=500)
+    valid = plants.dropna(subset=["LAT", "LON"])
+
+    assert len(engine) == len(valid)
+    for zoom in range(4, 11):
+        kind, cells = engine.query(None, zoom)
+        assert kind == "clusters"
+        assert cells["count"].sum() == len(valid)
+        assert cells["valore"].sum() == pytest.approx(valid["AE"].sum())
+    # Più celle (e più piccole) al crescere dello zoom
+    assert len(engine.query(ITALY_BOUNDS, 6)[1]) < len(engine.query(ITALY_BOUNDS, 9)[1])
+
+
+def test_cluster_position_is_cell_centroid():
+    df = pd.DataFrame({"LAT": [40.1, 40.3, 40.2], "LON": [14.1, 14.3, 14.2]})
+    kind, cells = TileEngine(df, max_points=0).query(None, 4)
+
+    assert kind == "clusters" and len(cells) == 1
+    assert cells[["count", "LAT", "LON"]].iloc[0].tolist() == pytest.approx([3, 40.2, 14.2])
+    assert cells["valore"].iloc[0] == 0
+
+
+def test_points_in_viewport_at_detail_zoom(plants):
+    engine = TileEngine(plants, value_col="AE", max_points=100)
+    bounds = (40.5, 13.5, 41.0, 14.5)
+    kind, points = engine.query(bounds, 11)
+
+    inside = plants["LAT"].between(40.5, 41.0) & plants["LON"].between(13.5, 14.5)
+    assert kind == "points"
+    assert sorted(points.index) == sorted(plants.index[inside])
+    assert engine.count_in(bounds) == int(inside.sum())
+
+
+def test_few_visible_points_skip_clustering(plants):
+    engine = TileEngine(plants, max_points=1000)
+    bounds = (40.0, 13.0, 40.2, 13.3)
+    kind, points = engine.query(bounds, 5)
+
+    assert kind == "points" and 0 < len(points) <= 1000
+    assert points["LAT"].between(40.0, 40.2).all() and points["LON"].between(13.0, 13.3).all()
@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+
+import normalize_regions
+
+
+@pytest.fixture
+def regional_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(normalize_regions, "load_regions", lambda: ["VENETO", "CAMPANIA", "EMILIA ROMAGNA"])
+    pd.DataFrame({
+        "SIT_ID": ["11", "12"],
+        "PROVINCIA": ["VR", "PD"],
+        "COMUNE": ["Verona", "Padova"],
+        "Numero Ab. Equiv. (AE)": ["1,200", "500"],
+        "STATO DEPURATORE": ["attivo", "dismesso"],
+    }).to_csv(tmp_path / "depuratori_Veneto.csv", index=False)
+    pd.DataFrame({
+        "PROVINCIA": ["CASERTA", "SALERNO", "SALERNO"],
+        "COMUNE": ["ORTA DI ATELLA", "EBOLI", "EBOLI"],
+        "INDIRIZZO": ["Strada Provinciale", "Via Fiume", "Via Fiume"],
+        "Potenz. (A.E.)": ["391016", "30000", "30000"],
+        "Data Sopralluogo": ["2024-05-08", "2024-06-01", "2024-06-01"],
+    }).to_csv(tmp_path / "impianti_Campania_2024.csv", index=False)
+    return tmp_path
+
+
+@pytest.mark.parametrize("suffix", [".parquet", ".csv"])
+def test_regions_merge_into_canonical_columns(regional_files, tmp_path, suffix):
+    output = str(tmp_path / f"nazionale{suffix}")
+    report = normalize_regions.normalize_regions([str(regional_files)], output, workers=2)
+    merged = pd.read_parquet(output) if suffix == ".parquet" else pd.read_csv(output)
+
+    assert report.set_index("regione")["righe"].to_dict() == {"CAMPANIA": 2, "VENETO": 2}
+    # Le intestazioni regionali diverse finiscono nelle stesse colonne canoniche
+    assert not {"PROVINCIA", "COMUNE", "Potenz. (A.E.)", "Numero Ab. Equiv. (AE)"} & set(merged.columns)
+    by_comune = merged.set_index("Comune")
+    assert by_comune.loc["Verona", ["Provincia", "Numero_AE", "regione"]].tolist() == ["VR", 1200, "VENETO"]
+    assert by_comune.loc["EBOLI", ["Provincia", "Numero_AE", "regione"]].tolist() == ["SALERNO", 30000, "CAMPANIA"]
+    assert pd.isna(by_comune.loc["Verona", "Data_Sopralluogo"])
+    assert str(pd.Timestamp(by_comune.loc["EBOLI", "Data_Sopralluogo"]).date()) == "2024-06-01"
+
+
+def test_unmapped_region_keeps_its_headers(regional_files, tmp_path):
+    pd.DataFrame({"Comune ": ["Bologna"], "AE": ["10"]}).to_csv(regional_files / "impianti_Emilia_Romagna.csv", index=False)
+    output = str(tmp_path / "nazionale.parquet")
+    normalize_regions.normalize_regions([str(regional_files)], output, workers=2)
+    merged = pd.read_parquet(output)
+
+    emilia = merged[merged["regione"] == "EMILIA ROMAGNA"]
+    assert emilia["AE"].tolist() == ["10"] and emilia["Comune"].tolist() == ["Bologna"]
+    assert merged.loc[merged["regione"] == "VENETO", "AE"].isna().all()
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from olap_cube import Cube
+
+QUANTILES = (0.25, 0.5, 0.75)
+COLUMNS = ["count", "mean", "std", "min", "25%", "50%", "75%", "max"]
+
+
+def _frame(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "anno": rng.choice([2021, 2022, 2023], n),
+        "tipo": rng.choice(["primario", "secondario", "terziario"], n),
+        "valore": rng.lognormal(3, 1, n).round(1),
+    })
+
+
+def test_aggregate_matches_describe():
+    df = _frame()
+    cube = Cube(df, ["anno", "tipo"], ["valore"], sketch_measure="valore")
+    result = cube.aggregate(["anno", "tipo"], quantiles=QUANTILES)[COLUMNS]
+    expected = df.groupby(["anno", "tipo"])["valore"].describe()[COLUMNS]
+
+    exact = ["count", "mean", "std", "min", "max"]
+    np.testing.assert_allclose(result[exact].to_numpy(dtype=float), expected[exact].to_numpy(), rtol=1e-9)
+    # I quartili vengono dallo sketch: errore entro un intervallo dell'istogramma
+    spread = (expected["max"] - expected["min"]).to_numpy()[:, None]
+    error = np.abs(result[["25%", "50%", "75%"]].to_numpy() - expected[["25%", "50%", "75%"]].to_numpy())
+    assert (error <= 0.02 * spread).all()
+
+
+def test_aggregate_with_filters_matches_rows():
+    df = _frame()
+    cube = Cube(df, ["anno", "tipo"], ["valore"], sketch_measure="valore")
+    rows = df[df["anno"].isin([2022]) & df["tipo"].isin(["primario", "terziario"])]
+
+    assert cube.count_rows({"anno": [2022], "tipo": ["primario", "terziario"]}) == len(rows)
+    assert cube.total({"anno": [2022], "tipo": ["primario", "terziario"]}) == pytest.approx(rows["valore"].sum())
+    assert sorted(cube.members("tipo", {"anno": [2022]})) == ["primario", "secondario", "terziario"]
+
+
+@pytest.mark.parametrize("values", [[42.0], [7.5] * 20])
+def test_single_distinct_value(values):
+    df = pd.DataFrame({"anno": 2023, "tipo": "primario", "valore": values})
+    cube = Cube(df, ["anno", "tipo"], ["valore"], sketch_measure="valore")
+    result = cube.aggregate(["anno", "tipo"], quantiles=QUANTILES).iloc[0]
+
+    assert result["count"] == len(values)
+    assert result[["min", "25%", "50%", "75%", "max"]].tolist() == [values[0]] * 5
+
+
+def test_no_valid_values():
+    df = pd.DataFrame({"anno": [2023, 2023], "tipo": ["primario", "primario"], "valore": [np.nan, np.nan]})
+    result = Cube(df, ["anno", "tipo"], ["valore"], sketch_measure="valore").aggregate(quantiles=QUANTILES).iloc[0]
+
+    assert result["count"] == 0 and np.isnan(result["50%"]) and np.isnan(result["mean"])
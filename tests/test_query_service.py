@@ -0,0 +1,100 @@
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+from fastapi.testclient import TestClient
+
+import query_service
+from query_service import ARROW_MEDIA_TYPE, QueryService
+
+ROWS = pd.DataFrame({
+    "_id": [1, 2, 3, 4, 5],
+    "PROVINCIA": ["NAPOLI", "NAPOLI", "SALERNO", "SALERNO", "CASERTA"],
+    "COMUNE": ["NAPOLI", "POZZUOLI", "SALERNO", "EBOLI", "CASERTA"],
+    "Tipologia Impianto": ["Comprensoriale", "Comunale", "Comunale", "Comunale", "Comprensoriale"],
+    "Potenz. (A.E.)": [500000, 20000, 150000, 30000, 80000],
+    "Latitudine": [40.85, 40.82, 40.68, 40.61, 41.07],
+    "Longitudine": [14.27, 14.12, 14.77, 15.05, 14.33],
+})
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    path = tmp_path / "depuratori_normalizzati.csv"
+    ROWS.to_csv(path, index=False)
+    monkeypatch.setattr(query_service, "service", QueryService(str(path)))
+    return TestClient(query_service.app)
+
+
+def test_filters_and_pagination(client):
+    response = client.get("/depuratori", params={"provincia": ["SALERNO", "NAPOLI"], "limit": 2, "offset": 1})
+    body = response.json()
+
+    assert response.status_code == 200
+    assert body["total"] == 4 and response.headers["X-Total-Count"] == "4"
+    assert [item["Comune"] for item in body["items"]] == ["POZZUOLI", "SALERNO"]
+
+
+def test_aggregates_by_province(client):
+    body = client.get("/aggregati/provincia", params={"tipo": "Comunale"}).json()
+
+    assert [(i["provincia"], i["impianti"], i["Numero_AE"]) for i in body["items"]] == \
+        [("SALERNO", 2, 180000.0), ("NAPOLI", 1, 20000.0)]
+
+
+def test_missing_columns_are_errors(client):
+    assert client.get("/aggregati/comune").status_code == 200
+    assert client.get("/aggregati/sconosciuta").status_code == 404
+    # Il dataset non ha né regione né stato: errore esplicito invece di zero risultati
+    response = client.get("/aggregati/regione")
+    assert response.status_code == 404 and "regione" in response.json()["detail"]
+    response = client.get("/depuratori", params={"regione": "CAMPANIA"})
+    assert response.status_code == 400 and "regione" in response.json()["detail"]
+    assert client.get("/depuratori", params={"stato": "Attivo"}).status_code == 400
+
+
+def test_nearest_and_bbox(client):
+    near = client.get("/vicini", params={"lat": 40.84, "lon": 14.25, "k": 2}).json()["items"]
+    assert [i["Comune"] for i in near] == ["NAPOLI", "POZZUOLI"]
+    assert near[0]["Distanza_km"] < near[1]["Distanza_km"]
+
+    box = client.get("/depuratori", params={"bbox": "14.5,40.5,15.1,40.7"}).json()
+    assert sorted(i["Comune"] for i in box["items"]) == ["EBOLI", "SALERNO"]
+    assert client.get("/depuratori", params={"bbox": "15,40,14,41"}).status_code == 400
+
+
+def test_etag_and_not_modified(client):
+    first = client.get("/depuratori", params={"provincia": ["NAPOLI", "SALERNO"]})
+    etag = first.headers["ETag"]
+    # Stessa selezione in ordine diverso: stesso ETag
+    reordered = client.get("/depuratori", params={"provincia": ["SALERNO", "NAPOLI"]})
+    assert reordered.headers["ETag"] == etag
+
+    cached = client.get("/depuratori", params={"provincia": ["NAPOLI", "SALERNO"]}, headers={"If-None-Match": etag})
+    assert cached.status_code == 304 and cached.content == b""
+    other = client.get("/depuratori", params={"provincia": "NAPOLI"}, headers={"If-None-Match": etag})
+    assert other.status_code == 200 and other.headers["ETag"] != etag
+
+
+def test_etag_changes_with_dataset(client, tmp_path):
+    etag = client.get("/depuratori").headers["ETag"]
+    ROWS.iloc[:3].to_csv(tmp_path / "depuratori_normalizzati.csv", index=False)
+    response = client.get("/depuratori", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200 and response.json()["total"] == 3
+    assert response.headers["ETag"] != etag
+
+
+def test_arrow_output(client):
+    response = client.get("/depuratori", params={"provincia": "SALERNO"}, headers={"Accept": ARROW_MEDIA_TYPE})
+    table = pa.ipc.open_stream(io.BytesIO(response.content)).read_all()
+
+    assert response.headers["content-type"] == ARROW_MEDIA_TYPE
+    assert table.num_rows == 2 and table.column("Comune").to_pylist() == ["SALERNO", "EBOLI"]
+    assert client.get("/depuratori", params={"format": "xml"}).status_code == 400
+
+
+def test_unavailable_dataset(tmp_path, monkeypatch):
+    monkeypatch.setattr(query_service, "service", QueryService(str(tmp_path / "assente.csv")))
+    assert TestClient(query_service.app).get("/salute").status_code == 503
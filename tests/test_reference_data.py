@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+
+import pytest
+
+from reference_data import REFERENCE_FILES, ReferenceFile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def reference(tmp_path):
+    path = tmp_path / "coordinate.csv"
+    path.write_text("SIT_ID,LAT\n1,45.0\n")
+
+    def parse(p):
+        with open(p) as f:
+            return f.read()
+
+    return ReferenceFile(str(path), parse)
+
+
+def _touch(path, content=None):
+    """Riscrive il file (stesso contenuto se non indicato) con un mtime diverso"""
+    if content is not None:
+        with open(path, "w") as f:
+            f.write(content)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_loaded_once(reference):
+    assert reference.get() == "SIT_ID,LAT\n1,45.0\n"
+    assert reference.get() is reference.get()
+    assert reference.reloads == 1
+
+
+def test_touch_with_same_content_does_not_reparse(reference):
+    value, version = reference.get(), reference.version
+    _touch(reference.path)
+    _touch(reference.path, "SIT_ID,LAT\n1,45.0\n")
+
+    assert reference.get() is value
+    assert reference.version == version
+    assert reference.reloads == 1
+
+
+def test_changed_content_reloads_and_changes_version(reference):
+    version = reference.version
+    _touch(reference.path, "SIT_ID,LAT\n1,45.5\n")
+
+    assert reference.get() == "SIT_ID,LAT\n1,45.5\n"
+    assert reference.version != version and len(reference.version) == 12
+    assert reference.reloads == 2
+
+
+def test_missing_file(reference, tmp_path):
+    missing = ReferenceFile(str(tmp_path / "assente.csv"), lambda p: pytest.fail("file assente letto"))
+    assert missing.get() is None and missing.version == "assente"
+
+    reference.get()
+    os.remove(reference.path)
+    assert reference.get() is None and reference.version == "assente"
+
+    # Il file ricompare: nuova lettura
+    with open(reference.path, "w") as f:
+        f.write("SIT_ID,LAT\n2,46.0\n")
+    assert reference.get() == "SIT_ID,LAT\n2,46.0\n"
+    assert reference.reloads == 2
+
+
+def test_previous_version_served_during_reload(tmp_path):
+    path = tmp_path / "archivio.csv"
+    path.write_text("v1")
+    started, release = threading.Event(), threading.Event()
+
+    def parse(p):
+        content = open(p).read()
+        if content == "v2":
+            started.set()
+            release.wait(5)
+        return content
+
+    ref = ReferenceFile(str(path), parse)
+    assert ref.get() == "v1"
+    _touch(str(path), "v2")
+    reloader = threading.Thread(target=ref.get)
+    reloader.start()
+    assert started.wait(5)
+
+    # Mentre una sessione rilegge, le altre ricevono subito la versione precedente
+    start = time.monotonic()
+    assert ref.get() == "v1"
+    assert time.monotonic() - start < 1
+    release.set()
+    reloader.join()
+    assert ref.get() == "v2" and ref.reloads == 2
+
+
+def test_registered_reference_files(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    stato = REFERENCE_FILES["stato_archivio"].get()
+    coordinate = REFERENCE_FILES["coordinate_campania"].get()
+
+    assert stato.index.name == "Regione" and "Regione" in stato.columns
+    assert len(coordinate.by_address) > 0
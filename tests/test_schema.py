@@ -0,0 +1,134 @@
+"""Schema canonico confrontato con la gestione delle colonne precedente di ciascuna dashboard."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from schema import SOURCE_MAPPINGS, SchemaError, compact_dtypes, conform, required_columns
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CAMPANIA = os.path.join(ROOT, "data/Elenco_impianti_depurazione_Campania_agg_gen2024.csv")
+
+VENETO = pd.DataFrame({
+    "PROVINCIA": ["BL", "BL ", "PD", None],
+    "COMUNE": ["Belluno", " Feltre", "Padova", "Adria"],
+    ' "SIT_ID" ': ["101", "102", "103", ""],
+    "DENOMINAZIONE UNITA' LOCALE": ["Depuratore A", "Depuratore B ", "Depuratore C", "D"],
+    "TIPO SCARICO": ["Acque superficiali", "Suolo", "Acque superficiali", "Suolo"],
+    "Numero Ab. Equiv. (AE)": ["1,200", " 800", "n.d.", "50000"],
+    "STATO DEPURATORE": ["Attivo", "Attivo", "Dismesso", "Attivo"],
+    "COLONNA EXTRA": [" a ", "b", "c", "d"],
+})
+
+
+def _values(series):
+    """Valori come lista Python, con None per i mancanti di qualunque tipo"""
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+def veneto_reference(df):
+    """Gestione precedente di veneto.py: rinomina, AE numerico e strip del testo"""
+    df = df.copy()
+    df.columns = df.columns.str.strip().str.replace('"', '')
+    df = df.rename(columns=SOURCE_MAPPINGS["veneto"])
+    df["Numero_AE"] = pd.to_numeric(df["Numero_AE"].astype(str).str.replace(",", ""), errors="coerce")
+    string_columns = df.select_dtypes(include=["object"]).columns
+    df[string_columns] = df[string_columns].apply(lambda x: x.str.strip())
+    return df
+
+
+def test_veneto_matches_previous_handling():
+    result = conform(VENETO, "veneto")
+    expected = veneto_reference(VENETO)
+
+    assert result.columns.tolist()[:3] == ["ID_Sito", "Provincia", "Comune"]
+    assert set(result.columns) == set(expected.columns)
+    for col in ["Provincia", "Comune", "Nome_Depuratore", "Tipo_Scarico", "Stato_Depuratore", "Numero_AE"]:
+        assert _values(result[col]) == _values(expected[col]), col
+    # Le colonne non previste dallo schema restano invariate
+    assert result["COLONNA EXTRA"].tolist() == VENETO["COLONNA EXTRA"].tolist()
+
+    assert result["Provincia"].dtype == "category" and result["Provincia"].cat.categories.tolist() == ["BL", "PD"]
+    assert result["Numero_AE"].dtype == "Int32" and result["ID_Sito"].dtype == "Int32"
+    assert result["ID_Sito"].isna().tolist() == [False, False, False, True]
+    assert result["Nome_Depuratore"].dtype == object
+
+
+def test_campania_matches_previous_handling():
+    raw = pd.read_csv(CAMPANIA)
+    result = conform(raw, "campania")
+
+    # campania.py convertiva la potenzialità togliendo le virgole delle migliaia
+    expected_ae = pd.to_numeric(raw["Potenz. (A.E.)"].astype(str).str.replace(",", ""), errors="coerce")
+    assert result["Numero_AE"].astype("float64").tolist() == pytest.approx(expected_ae.tolist(), nan_ok=True)
+    assert result["Nome_Corpo_Idrico"].dropna().tolist() == raw["Corpo  Recettore"].dropna().str.strip().tolist()
+    assert result["Data_Sopralluogo"].dtype == "datetime64[ns]"
+    assert result["Esito_Prelievo"].dtype == "category"
+    assert "_id" in result.columns and len(result) == len(raw)
+    assert result.attrs["schema_report"]["colonne_extra"] == ["_id"]
+
+
+def test_ckan_and_campania_share_column_names():
+    raw = pd.read_csv(CAMPANIA, nrows=20)
+
+    assert conform(raw, "ckan").columns.tolist() == conform(raw, "campania").columns.tolist()
+
+
+def test_prelievo_domain():
+    df = pd.DataFrame({"PRELIEVO": ["si", " NO", "forse", None, "Si"]})
+    result = conform(df, "campania")
+
+    assert result["Prelievo"].cat.categories.tolist() == ["SI", "NO"]
+    assert _values(result["Prelievo"]) == ["SI", "NO", None, None, "SI"]
+    report = result.attrs["schema_report"]
+    assert report["fuori_dominio"] == {"Prelievo": 1}
+    assert report["non_convertiti"] == {}
+
+
+def test_schema_report_counts_lost_values():
+    df = pd.DataFrame({"SIT_ID": ["1", "x", None], "Numero Ab. Equiv. (AE)": ["10", "20", "abc"]})
+    df.attrs["origine"] = "test"
+    result = conform(df, "veneto", keep_extra=False)
+
+    assert result.attrs["origine"] == "test"
+    assert result.attrs["schema_report"] == {
+        "fonte": "veneto", "colonne_canoniche": 2, "colonne_extra": [],
+        "non_convertiti": {"ID_Sito": 1, "Numero_AE": 1}, "fuori_dominio": {},
+    }
+
+
+def test_integers_out_of_range_stay_float():
+    result = conform(pd.DataFrame({"Numero Ab. Equiv. (AE)": ["1.5", "3"]}), "veneto")
+
+    assert result["Numero_AE"].dtype == "float64"
+
+
+def test_national_required_columns():
+    df = pd.DataFrame({
+        "id": [1, 2], "area_riferimento": ["A", "B"], "tipo_trattamento": [1, 3],
+        "anno": [2022, 2023], "valore_osservato": ["10.5", "n.d."],
+    })
+    result = conform(df, "nazionale")
+
+    assert required_columns("nazionale") == ["id", "area_riferimento", "tipo_trattamento", "anno", "valore_osservato"]
+    assert result.dtypes.astype(str).tolist() == ["Int32", "category", "Int8", "Int16", "float32"]
+    with pytest.raises(SchemaError, match="anno, valore_osservato"):
+        conform(df.drop(columns=["anno", "valore_osservato"]), "nazionale")
+
+
+def test_compact_dtypes_keeps_coordinates_double():
+    df = pd.DataFrame({
+        "LAT": [45.123456789] * 4, "LON": [12.3] * 4, "Portata": [1.5, 2.5, 3.5, 4.5],
+        "Stato": ["Attivo", "Attivo", "Dismesso", "Attivo"], "Nome": ["a", "b", "c", "d"],
+        "Conteggio": np.array([1, 2, 3, 4], dtype="int64"), "AE": pd.array([1, None, 3, 4], dtype="Int32"),
+    })
+    result = compact_dtypes(df)
+
+    assert result["LAT"].dtype == "float64" and result["LAT"].iloc[0] == 45.123456789
+    assert result["LON"].dtype == "float64"
+    assert result["Portata"].dtype == "float32"
+    assert result["Stato"].dtype == "category" and result["Nome"].dtype == object
+    assert result["Conteggio"].dtype == "int8" and result["AE"].dtype == "Int32"
+    report = result.attrs["memory_report"]
+    assert report["dopo_mb"] <= report["prima_mb"]
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from spatial_index import SpatialIndex
+
+
+def test_queries_match_brute_force():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"LAT": rng.uniform(40, 42, 2000), "LON": rng.uniform(13, 15, 2000)})
+    df.loc[::50, "LAT"] = np.nan
+    index = SpatialIndex(df)
+
+    inside = df["LAT"].between(40.5, 41) & df["LON"].between(13.5, 14)
+    assert index.bbox(13.5, 40.5, 14, 41).tolist() == np.flatnonzero(inside).tolist()
+
+    positions, distances = index.nearest(41, 14, k=3)
+    assert len(positions) == 3 and np.all(np.diff(distances) >= 0)
+    within, _ = index.within(41, 14, distances[-1] + 1e-6)
+    assert set(positions) <= set(within)
+
+
+def test_index_without_coordinates():
+    df = pd.DataFrame({"LAT": [np.nan, np.nan], "LON": [np.nan, 14.0]})
+    index = SpatialIndex(df)
+
+    assert len(index) == 0
+    assert index.bbox(13, 40, 15, 42).size == 0
+    assert index.nearest(41, 14, k=5)[0].size == 0
+    assert index.within(41, 14, 10)[0].size == 0
+
+
+def test_query_point_without_coordinates():
+    index = SpatialIndex(pd.DataFrame({"LAT": [40.8, 41.0], "LON": [14.2, 14.5]}))
+
+    for lat, lon in [(np.nan, 14.0), (41.0, np.nan), (np.nan, np.nan)]:
+        positions, distances = index.nearest(lat, lon, k=2)
+        assert positions.size == 0 and distances.size == 0
+        assert index.within(lat, lon, 50)[0].size == 0
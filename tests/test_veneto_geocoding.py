@@ -0,0 +1,63 @@
+"""Geocodifica per comune della dashboard Veneto con un provider offline (nessuna chiamata di rete)."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import veneto
+from batch_geocoding import OfflineProvider
+from geocoding_cache import GeocodingCache
+
+COMUNI = {
+    "Belluno, Veneto, Italy": (46.14, 12.22),
+    "Feltre, Veneto, Italy": (46.02, 11.91),
+}
+
+
+@pytest.fixture
+def provider(monkeypatch, tmp_path):
+    provider = OfflineProvider(COMUNI)
+    monkeypatch.setattr(veneto, "NominatimProvider", lambda **kwargs: provider)
+    cache = GeocodingCache(str(tmp_path / "cache.sqlite"))
+    monkeypatch.setattr(veneto, "get_geocoding_cache", lambda: cache)
+    return provider
+
+
+def test_each_comune_geocoded_once(provider):
+    df = pd.DataFrame({
+        "Comune": ["Belluno", "Belluno ", "Feltre", "Belluno", "Paese Ignoto", "Feltre", None, "Padova"],
+        "LAT": [np.nan, np.nan, np.nan, np.nan, np.nan, 45.0, np.nan, 45.41],
+        "LON": [np.nan, np.nan, np.nan, np.nan, np.nan, 11.0, np.nan, 11.88],
+    })
+    result = veneto.DataProcessor._geocode_missing_coordinates(df)
+
+    # Una chiamata per comune distinto tra le righe senza coordinate
+    assert sorted(provider.calls) == sorted(
+        ["Belluno, Veneto, Italy", "Feltre, Veneto, Italy", "Paese Ignoto, Veneto, Italy"]
+    )
+    assert result["LAT"].iloc[:4].tolist() == [46.14, 46.14, 46.02, 46.14]
+    assert result["LON"].iloc[:4].tolist() == [12.22, 12.22, 11.91, 12.22]
+    # Le coordinate già presenti non vengono toccate; i comuni non trovati restano vuoti
+    assert result["LAT"].iloc[5] == 45.0 and result["LAT"].iloc[7] == 45.41
+    assert result[["LAT", "LON"]].iloc[[4, 6]].isna().all(axis=None)
+
+    report = result.attrs["geocoding_report"].set_index("Comune")
+    assert report["Righe_Riempite"].to_dict() == {"Belluno": 3, "Feltre": 1, "Paese Ignoto": 0}
+    assert report.loc["Feltre", ["LAT", "LON"]].tolist() == [46.02, 11.91]
+    assert report.loc["Paese Ignoto", ["LAT", "LON"]].isna().all()
+
+
+def test_second_run_served_from_cache(provider):
+    df = pd.DataFrame({"Comune": ["Belluno", "Feltre"], "LAT": [np.nan] * 2, "LON": [np.nan] * 2})
+    veneto.DataProcessor._geocode_missing_coordinates(df.copy())
+    result = veneto.DataProcessor._geocode_missing_coordinates(df.copy())
+
+    assert len(provider.calls) == 2
+    assert result["LAT"].tolist() == [46.14, 46.02]
+
+
+def test_nothing_to_geocode(provider):
+    df = pd.DataFrame({"Comune": ["Belluno", None], "LAT": [46.0, np.nan], "LON": [12.0, np.nan]})
+    result = veneto.DataProcessor._geocode_missing_coordinates(df)
+
+    assert provider.calls == []
+    assert "geocoding_report" not in result.attrs
@@ -1,37 +1,31 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import folium
 from folium import plugins
 from streamlit_folium import folium_static
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut
 from dataclasses import dataclass
 from typing import Optional, Tuple, List
 import logging
-import time
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.cluster import KMeans # Esempio clustering
+import plotly.graph_objects as go
+import charts
+from clustering import ClusterModel, evaluate_k
+from batch_geocoding import BatchGeocoder, NominatimProvider
+from comuni_centroids import get_centroid_index
+from dataset_cache import load_dataset
+from filter_index import FilterIndex
+from map_rendering import FAST_MAP_THRESHOLD, add_fast_markers, use_fast_rendering
+from olap_cube import Cube
+from geocoding_cache import get_geocoding_cache
+from reference_data import get_reference
+from schema import compact_dtypes, conform
+from spatial_index import SpatialIndex, with_distance
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 VENETO_CENTER = (45.4347, 12.3384)
-COLUMN_MAPPINGS = {
-   "PROVINCIA": "Provincia",
-   "COMUNE": "Comune",
-   "SIT_ID": "ID_Sito",
-   "DENOMINAZIONE UNITA' LOCALE": "Nome_Depuratore",
-   "TIPO SCARICO": "Tipo_Scarico",
-   "TIPO CORPO IDRICO": "Tipo_Corpo_Idrico",
-   "NOME CORPO IDRICO RECETTORE": "Nome_Corpo_Idrico",
-   "CLASSIFICAZIONE DEPURATORE": "Classificazione_Depuratore",
-   "Numero Ab. Equiv. (AE)": "Numero_AE",
-   "STATO UNITA' LOCALE": "Stato_Unita_Locale",
-   "STATO DEPURATORE": "Stato_Depuratore",
-   "STATO SCARICO": "Stato_Scarico",
-}
 
 @dataclass
 class AppConfig:
@@ -41,7 +35,9 @@ class AppConfig:
    initial_sidebar_state: str = "expanded"
    map_width: int = 1400
    map_height: int = 600
-   cache_ttl: int = 3600
+   pipeline_version: int = 5
+   fast_map_threshold: int = FAST_MAP_THRESHOLD
+   cluster_categorical: Tuple[str, ...] = ("Tipo_Scarico", "Tipo_Corpo_Idrico")
 
 class StyleManager:
    @staticmethod
@@ -91,29 +87,64 @@ class StyleManager:
 
 class DataProcessor:
 
-    _coord_df = None  # Class variable to store the coordinates DataFrame
-
     @staticmethod
-    def _load_coord_data():
-        try:
-            if DataProcessor._coord_df is None:
-              DataProcessor._coord_df = pd.read_csv("data/depuratori_con_coordinate.csv")
-            return DataProcessor._coord_df
-        except FileNotFoundError:
+    def _load_coord_data() -> Optional[pd.DataFrame]:
+        """Coordinates indexed by SIT_ID, reloaded only when the file changes on disk"""
+        coords = get_reference("coordinate_veneto").get()
+        if coords is None:
             logger.error("File delle coordinate non trovato.")
             st.error("File delle coordinate non trovato.")
-            return None
-        except Exception as e:
-            logger.error(f"Errore nel caricamento delle coordinate: {e}")
-            st.error(f"Errore nel caricamento delle coordinate: {e}")
-            return None
+        return coords
 
     @staticmethod
-    @st.cache_data(ttl=AppConfig.cache_ttl)
     def load_and_process_data(uploaded_file) -> Optional[pd.DataFrame]:
+        """Shared in-memory copy of the processed dataset (read-only: do not modify in place)"""
+        return load_dataset(
+            uploaded_file, "veneto", AppConfig.pipeline_version, DataProcessor._build,
+            references=[get_reference("coordinate_veneto")],
+        )
+
+    @staticmethod
+    def _build(uploaded_file) -> Optional[pd.DataFrame]:
+        """Pipeline completa seguita dalla riduzione dei tipi, prima di salvare nell'archivio"""
+        df = DataProcessor._process_data(uploaded_file)
+        return compact_dtypes(df) if df is not None else None
+
+    @staticmethod
+    @st.cache_resource(max_entries=16)
+    def get_filter_index(_df: pd.DataFrame, dataset_key: Optional[str]) -> FilterIndex:
+        """Filter index for the table, built once per dataset version"""
+        return FilterIndex(_df, ["Provincia", "Stato_Depuratore", "Tipo_Scarico"])
+
+    @staticmethod
+    @st.cache_resource(max_entries=16)
+    def get_cube(_df: pd.DataFrame, dataset_key: Optional[str]) -> Cube:
+        """Aggregati di AE e portata per provincia, stato e scarico, costruiti una volta per versione del dataset"""
+        return Cube(_df, ["Provincia", "Stato_Depuratore", "Tipo_Scarico"], ["Portata_m3_giorno", "Numero_AE"])
+
+    @staticmethod
+    @st.cache_resource(max_entries=16)
+    def get_spatial_index(_df: pd.DataFrame, dataset_key: Optional[str]) -> SpatialIndex:
+        """Indice spaziale delle coordinate, costruito una volta per versione del dataset"""
+        return SpatialIndex(_df)
+
+    @staticmethod
+    @st.cache_resource(max_entries=32)
+    def get_cluster_model(_df: pd.DataFrame, dataset_key: Optional[str], filter_key: tuple, n_clusters: int) -> ClusterModel:
+        """Modello di clustering addestrato una volta per versione del dataset, filtri e numero di cluster"""
+        return ClusterModel(n_clusters, categorical=AppConfig.cluster_categorical).fit(_df)
+
+    @staticmethod
+    @st.cache_data(max_entries=16, show_spinner="Valutazione del numero di cluster...")
+    def get_cluster_scores(_df: pd.DataFrame, dataset_key: Optional[str], filter_key: tuple) -> pd.DataFrame:
+        """Inerzia e silhouette per k = 2..8, calcolate una volta per versione del dataset e filtri"""
+        return evaluate_k(ClusterModel(categorical=AppConfig.cluster_categorical), _df)
+
+    @staticmethod
+    def _process_data(uploaded_file) -> Optional[pd.DataFrame]:
         try:
             df = pd.read_csv(uploaded_file)
-            df = DataProcessor._rename_columns(df)
+            df = conform(df, "veneto")
             df = DataProcessor._add_coordinates(df)
             df = DataProcessor._clean_and_transform_data(df)
             return df
@@ -122,21 +153,21 @@ class DataProcessor:
             st.error(f"Errore nel caricamento dei dati: {str(e)}")
             return None
 
-    @staticmethod
-    def _rename_columns(df: pd.DataFrame) -> pd.DataFrame:
-        return df.rename(columns=COLUMN_MAPPINGS)
-
     @staticmethod
     def _add_coordinates(df: pd.DataFrame) -> pd.DataFrame:
         coord_df = DataProcessor._load_coord_data()
-        if coord_df is None:
-             return df
         try:
-            df = pd.merge(df, coord_df[['SIT_ID', 'LAT', 'LON']],
-                         left_on='ID_Sito',
-                         right_on='SIT_ID',
-                         how='left')
-            df.drop('SIT_ID', axis=1, inplace=True)
+            if coord_df is not None:
+                # Lookup on the SIT_ID index: one output row per input row
+                positions = coord_df.index.get_indexer(df['ID_Sito'].astype('float64'))
+                found = positions >= 0
+                for col in ('LAT', 'LON'):
+                    values = np.full(len(df), np.nan)
+                    values[found] = coord_df[col].to_numpy(dtype=float)[positions[found]]
+                    df[col] = values
+
+            # Offline comune centroids before any network call
+            df, _ = get_centroid_index().fill_missing(df, 'Comune', 'Provincia')
 
             # Geocode missing coordinates
             missing_coords_df = df[df['LAT'].isna() | df['LON'].isna()]
@@ -152,43 +183,54 @@ class DataProcessor:
     def _geocode_missing_coordinates(df: pd.DataFrame) -> pd.DataFrame:
        """
        Geocodes missing coordinates for depuratori based on their Comune.
+       Each distinct Comune is resolved once; rows are then filled with a vectorised join.
+       The per-Comune report is stored in df.attrs['geocoding_report'].
        """
-       geolocator = Nominatim(user_agent="depuratori_app", timeout=5)
-       for index, row in df.iterrows():
-            if pd.isna(row["LAT"]) or pd.isna(row["LON"]):
-               try:
-                    location = geolocator.geocode(row['Comune'] + ", Veneto, Italy", exactly_one=True)
-                    if location:
-                        df.loc[index, 'LAT'] = location.latitude
-                        df.loc[index, 'LON'] = location.longitude
-                        logger.info(f"Geocoded {row['Comune']}: {location.latitude}, {location.longitude}")
-                    else:
-                        logger.warning(f"Could not geocode: {row['Comune']}")
-               except GeocoderTimedOut:
-                   logger.warning(f"Geocoding timed out for: {row['Comune']}. Retrying...")
-                   time.sleep(1) # Wait for one second before retry
-                   try:
-                       location = geolocator.geocode(row['Comune'] + ", Veneto, Italy", exactly_one=True, timeout=10)
-                       if location:
-                            df.loc[index, 'LAT'] = location.latitude
-                            df.loc[index, 'LON'] = location.longitude
-                            logger.info(f"Geocoded {row['Comune']} on retry: {location.latitude}, {location.longitude}")
-                       else:
-                             logger.warning(f"Could not geocode: {row['Comune']} even on retry")
-                   except GeocoderTimedOut:
-                       logger.error(f"Geocoding timed out even on retry: {row['Comune']}")
-               except Exception as e:
-                    logger.error(f"Errore geocoding {row['Comune']}: {e}")
+       missing = df["LAT"].isna() | df["LON"].isna()
+       comuni = df["Comune"].astype(str).str.strip()
+       counts = comuni[missing & df["Comune"].notna()].value_counts()
+       if counts.empty:
+           return df
+
+       geocoder = BatchGeocoder(
+           NominatimProvider(user_agent="depuratori_app", timeout=5),
+           cache=get_geocoding_cache(),
+       )
+       results = geocoder.geocode_batch([f"{comune}, Veneto, Italy" for comune in counts.index])
+       resolved = pd.DataFrame(
+           {"LAT": [r.lat for r in results], "LON": [r.lon for r in results]},
+           index=counts.index,
+           dtype="float64",
+       )
+
+       fill_lat = comuni.map(resolved["LAT"])
+       fill_lon = comuni.map(resolved["LON"])
+       to_fill = missing & fill_lat.notna() & fill_lon.notna()
+       df["LAT"] = df["LAT"].mask(to_fill, fill_lat)
+       df["LON"] = df["LON"].mask(to_fill, fill_lon)
+
+       report = resolved.assign(
+           Righe_Riempite=counts.where(resolved["LAT"].notna(), 0)
+       ).rename_axis("Comune").reset_index()
+       df.attrs["geocoding_report"] = report
+
+       not_found = report.loc[report["LAT"].isna(), "Comune"].tolist()
+       logger.info(
+           f"Geocodifica per comune: {len(counts) - len(not_found)}/{len(counts)} comuni risolti, "
+           f"{int(to_fill.sum())} righe riempite con {geocoder.stats['network_calls']} chiamate di rete"
+       )
+       if not_found:
+           logger.warning(f"Could not geocode: {', '.join(not_found)}")
        return df
 
 
     @staticmethod
     def _clean_and_transform_data(df: pd.DataFrame) -> pd.DataFrame:
-       df["Numero_AE"] = pd.to_numeric(
-           df["Numero_AE"].astype(str).str.replace(",", ""), errors="coerce"
-       )
+       # Le colonne dello schema sono già convertite da conform: restano quelle extra
        string_columns = df.select_dtypes(include=["object"]).columns
        df[string_columns] = df[string_columns].apply(lambda x: x.str.strip())
+       # Stima della portata (0,2 m³/giorno per AE), calcolata una volta nella pipeline
+       df["Portata_m3_giorno"] = (df["Numero_AE"] * 0.2).astype("float64")
        return df
 
 class MapVisualizer:
@@ -202,10 +244,20 @@ class MapVisualizer:
            return
 
        m = folium.Map(location=VENETO_CENTER, zoom_start=8)
-       marker_cluster = plugins.MarkerCluster().add_to(m)
 
-       for _, row in df_map.iterrows():
-           MapVisualizer._add_marker(marker_cluster, row)
+       if use_fast_rendering(df_map, AppConfig.fast_map_threshold):
+           add_fast_markers(m, df_map, {
+               "Comune": "Comune",
+               "Tipo Scarico": "Tipo_Scarico",
+               "Corpo Idrico": "Nome_Corpo_Idrico",
+               "AE": "Numero_AE",
+               "Stato": "Stato_Unita_Locale",
+               "Stato Depuratore": "Stato_Depuratore",
+           }, title_col="Nome_Depuratore")
+       else:
+           marker_cluster = plugins.MarkerCluster().add_to(m)
+           for _, row in df_map.iterrows():
+               MapVisualizer._add_marker(marker_cluster, row)
 
        folium.LayerControl().add_to(m) # Add layer control
 
@@ -264,11 +316,42 @@ class Dashboard:
    def _show_dashboard_components(self, df: pd.DataFrame):
        self._show_statistics(df)
        MapVisualizer.create_map(df)
+       self._show_nearby(df)
        self._show_data_analysis(df)
        self._show_additional_visualizations(df)  # Chiamata alla funzione aggiunta
        self._show_predictions(df) #Chiamata alla funzione previsioni
        self._show_table(df)
+       self._show_geocoding_report(df)
+
+   def _show_nearby(self, df: pd.DataFrame):
+       st.subheader("Depuratori vicini a un corpo idrico")
+       corpi = sorted(df["Nome_Corpo_Idrico"].dropna().astype(str).unique())
+       if not corpi:
+           return
+
+       col1, col2 = st.columns([3, 1])
+       with col1:
+           corpo = st.selectbox("Corpo idrico recettore", corpi)
+       with col2:
+           km = st.slider("Raggio (km)", min_value=1, max_value=50, value=10)
 
+       # Punti di partenza: i depuratori che scaricano nel corpo idrico scelto
+       index = DataProcessor.get_spatial_index(df, df.attrs.get("dataset_key"))
+       scaricano = np.flatnonzero((df["Nome_Corpo_Idrico"].astype(str) == corpo).to_numpy())
+       positions, distances = index.within(df["LAT"].to_numpy()[scaricano], df["LON"].to_numpy()[scaricano], km)
+       vicini = with_distance(df, positions, distances, exclude=scaricano)
+
+       st.write(f"{len(scaricano)} depuratori scaricano in {corpo}; altri {len(vicini)} entro {km} km")
+       st.dataframe(
+           vicini[["Distanza_km", "Nome_Depuratore", "Comune", "Provincia", "Nome_Corpo_Idrico", "Numero_AE"]],
+           use_container_width=True,
+       )
+
+   def _show_geocoding_report(self, df: pd.DataFrame):
+       report = df.attrs.get("geocoding_report")
+       if report is not None and not report.empty:
+           with st.expander("Report geocodifica per comune"):
+               st.dataframe(report, use_container_width=True)
 
    def _show_statistics(self, df: pd.DataFrame):
        col1, col2, col3, col4 = st.columns(4)
@@ -280,7 +363,7 @@ class Dashboard:
        with col3:
            st.metric("Comuni Serviti", df["Comune"].nunique())
        with col4:
-           tot_ae = df["Numero_AE"].sum()
+           tot_ae = DataProcessor.get_cube(df, df.attrs.get("dataset_key")).total(measure="Numero_AE")
            st.metric("Totale AE", f"{int(tot_ae):,}")
 
    def _show_data_analysis(self, df: pd.DataFrame):
@@ -288,35 +371,19 @@ class Dashboard:
     col1, col2 = st.columns(2)
 
     with col1:
-        fig1, ax1 = plt.subplots()
-        stato_counts = df["Stato_Depuratore"].value_counts()
-        ax1.bar(stato_counts.index, stato_counts.values)
-        plt.xticks(rotation=45, ha='right')
-        plt.title("Distribuzione per Stato Depuratore")
-        plt.tight_layout()
-        st.pyplot(fig1)
+        fig1 = charts.figure("bar_counts", df, "Stato_Depuratore", "Distribuzione per Stato Depuratore")
+        st.plotly_chart(fig1, use_container_width=True)
 
     with col2:
-        fig2, ax2 = plt.subplots()
-        scarico_counts = df["Tipo_Scarico"].value_counts()
-        ax2.bar(scarico_counts.index, scarico_counts.values)
-        plt.xticks(rotation=45, ha='right')
-        plt.title("Distribuzione per Tipo Scarico")
-        plt.tight_layout()
-        st.pyplot(fig2)
+        fig2 = charts.figure("bar_counts", df, "Tipo_Scarico", "Distribuzione per Tipo Scarico")
+        st.plotly_chart(fig2, use_container_width=True)
 
     st.write("#### Stima della Portata (m³/giorno)")
-    df["Portata_m3_giorno"] = df["Numero_AE"] * 0.2
-    portata_totale = df["Portata_m3_giorno"].sum()
+    portata_totale = DataProcessor.get_cube(df, df.attrs.get("dataset_key")).total(measure="Portata_m3_giorno")
     st.metric("Portata Totale Regionale (m³/giorno)", f"{portata_totale:,.0f}")
 
-    fig3, ax3 = plt.subplots()
-    portata_per_provincia = df.groupby("Provincia")["Portata_m3_giorno"].sum()
-    ax3.bar(portata_per_provincia.index, portata_per_provincia.values)
-    plt.xticks(rotation=45, ha='right')
-    plt.title("Portata per Provincia")
-    plt.tight_layout()
-    st.pyplot(fig3)
+    fig3 = charts.figure("bar_sums", df, "Provincia", "Portata per Provincia", value="Portata_m3_giorno")
+    st.plotly_chart(fig3, use_container_width=True)
 
    def _show_additional_visualizations(self, df: pd.DataFrame):
        st.subheader("Visualizzazioni Aggiuntive")
@@ -329,34 +396,48 @@ class Dashboard:
 
        with col2:
            st.write("#### Distribuzione AE per Provincia (Box Plot)")
-           fig_bp, ax_bp = plt.subplots()
-           sns.boxplot(x="Provincia", y="Numero_AE", data=df, ax=ax_bp)
-           ax_bp.tick_params(axis='x', rotation=45)
-           st.pyplot(fig_bp)
+           fig_bp = charts.figure("box", df, "Provincia", "AE per Provincia", value="Numero_AE")
+           st.plotly_chart(fig_bp, use_container_width=True)
 
 
        st.write("#### Percentuale per Tipo Scarico (Torta)")
-       scarico_counts = df["Tipo_Scarico"].value_counts()
-       fig_pie, ax_pie = plt.subplots()
-       ax_pie.pie(scarico_counts, labels=scarico_counts.index, autopct='%1.1f%%', startangle=140)
-       ax_pie.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
-       st.pyplot(fig_pie)
+       fig_pie = charts.figure("pie_counts", df, "Tipo_Scarico", "Tipo Scarico")
+       st.plotly_chart(fig_pie, use_container_width=True)
 
    def _show_predictions(self, df: pd.DataFrame):
        st.subheader("Previsioni e Analisi Avanzate")
 
-       # Esempio di calcolo di anomalie con K-means
+       index = DataProcessor.get_filter_index(df, df.attrs.get("dataset_key"))
+       col1, col2 = st.columns([3, 1])
+       with col1:
+           province = st.multiselect("Province da analizzare", options=index.options("Provincia"), key="cluster_province")
+       with col2:
+           n_clusters = st.number_input("Numero di cluster", min_value=2, max_value=8, value=3)
+       filter_key = tuple(sorted(province))
+       df_cluster = index.apply(df, {"Provincia": province})
+
        try:
-           kmeans = KMeans(n_clusters=3, random_state=42, n_init = 'auto')  # Riduci n_init al default
-           df_for_clustering = df[["Numero_AE", "Portata_m3_giorno"]].dropna()
-           if not df_for_clustering.empty:
-               kmeans.fit(df_for_clustering)
-               df['cluster'] = pd.NA  # Inizializza la colonna cluster con NA
-               df.loc[df_for_clustering.index, 'cluster'] = kmeans.labels_
-               st.write("#### Analisi cluster basata su Numero_AE e Portata_m3_giorno:")
-               st.write(df[["Nome_Depuratore", "Numero_AE", "Portata_m3_giorno", "cluster"]].dropna())
+           # Caratteristiche: log degli AE e posizione (la portata è AE × 0,2, quindi ridondante)
+           model = DataProcessor.get_cluster_model(df_cluster, df.attrs.get("dataset_key"), filter_key, int(n_clusters))
+           if model.labels_ is None or not len(model.labels_):
+               st.warning("Non ci sono dati validi per effettuare la clusterizzazione.")
            else:
-              st.warning("Non ci sono dati validi per effettuare la clusterizzazione.")
+               st.write("#### Cluster per dimensione, posizione e tipo di scarico")
+               st.dataframe(model.summary(df_cluster), use_container_width=True)
+
+               scores = DataProcessor.get_cluster_scores(df_cluster, df.attrs.get("dataset_key"), filter_key)
+               if not scores.empty:
+                   fig = go.Figure(layout=dict(
+                       title="Scelta del numero di cluster", xaxis_title="k",
+                       yaxis=dict(title="Inerzia"), yaxis2=dict(title="Silhouette", overlaying="y", side="right"),
+                   ))
+                   fig.add_trace(go.Scatter(x=scores["k"], y=scores["inerzia"], name="Inerzia (gomito)"))
+                   fig.add_trace(go.Scatter(x=scores["k"], y=scores["silhouette"], name="Silhouette", yaxis="y2"))
+                   st.plotly_chart(fig, use_container_width=True)
+
+               with st.expander("Depuratori per cluster"):
+                   clusters = df_cluster.loc[model.index_, ["Nome_Depuratore", "Comune", "Numero_AE", "Tipo_Scarico"]]
+                   st.dataframe(clusters.assign(Cluster=model.labels_), use_container_width=True)
        except Exception as e:
             logger.error(f"Errore durante il calcolo dei cluster: {e}")
             st.warning(f"Errore durante il calcolo dei cluster: {e}")
@@ -372,37 +453,35 @@ class Dashboard:
    def _show_table(self, df: pd.DataFrame):
        st.subheader("Dati dei Depuratori")
 
+       index = DataProcessor.get_filter_index(df, df.attrs.get("dataset_key"))
+
        col1, col2, col3 = st.columns(3)
        with col1:
            provincia_filter = st.multiselect(
-               "Filtra per Provincia", options=sorted(df["Provincia"].unique())
+               "Filtra per Provincia", options=index.options("Provincia")
            )
        with col2:
            stato_filter = st.multiselect(
                "Filtra per Stato Depuratore",
-               options=sorted(df["Stato_Depuratore"].unique()),
+               options=index.options("Stato_Depuratore"),
            )
        with col3:
            tipo_scarico_filter = st.multiselect(
-               "Filtra per Tipo Scarico", options=sorted(df["Tipo_Scarico"].unique())
+               "Filtra per Tipo Scarico", options=index.options("Tipo_Scarico")
            )
 
-       filtered_df = df.copy()
-       if provincia_filter:
-           filtered_df = filtered_df[filtered_df["Provincia"].isin(provincia_filter)]
-       if stato_filter:
-           filtered_df = filtered_df[filtered_df["Stato_Depuratore"].isin(stato_filter)]
-       if tipo_scarico_filter:
-           filtered_df = filtered_df[filtered_df["Tipo_Scarico"].isin(tipo_scarico_filter)]
-
-       st.dataframe(
-           filtered_df[[
-               "Provincia", "Comune", "Nome_Depuratore", "Tipo_Scarico",
-               "Nome_Corpo_Idrico", "Numero_AE", "Portata_m3_giorno",
-               "Stato_Depuratore", "Stato_Scarico"
-           ]],
-           use_container_width=True,
-       )
+       # Si raccolgono solo le colonne mostrate nella tabella
+       filtered_df = index.apply(df, {
+           "Provincia": provincia_filter,
+           "Stato_Depuratore": stato_filter,
+           "Tipo_Scarico": tipo_scarico_filter,
+       }, columns=[
+           "Provincia", "Comune", "Nome_Depuratore", "Tipo_Scarico",
+           "Nome_Corpo_Idrico", "Numero_AE", "Portata_m3_giorno",
+           "Stato_Depuratore", "Stato_Scarico"
+       ])
+
+       st.dataframe(filtered_df, use_container_width=True)
 
    def _show_welcome_message(self):
        st.info(